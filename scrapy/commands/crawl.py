@@ -23,6 +23,8 @@ class Command(ScrapyCommand):
                           help="dump scraped items into FILE (use - for stdout)")
         parser.add_option("-t", "--output-format", metavar="FORMAT",
                           help="format to use for dumping items with -o")
+        parser.add_option("--workers", type="int", metavar="N",
+                          help="run the spider in N worker processes")
 
     def process_options(self, args, opts):
         ## 用选项更新配置
@@ -48,6 +50,15 @@ class Command(ScrapyCommand):
                                  " from the supported list %s" % (opts.output_format,
                                                                   tuple(valid_output_formats)))
             self.settings.set('FEED_FORMAT', opts.output_format, priority='cmdline')
+        if opts.workers is not None:
+            if opts.workers < 1:
+                raise UsageError("Invalid --workers value, use a positive integer",
+                                 print_help=False)
+            if opts.workers > 1 and self.settings['FEED_URI']:
+                raise UsageError("--workers cannot be used with feed exports "
+                                 "(-o or FEED_URI), every worker would write "
+                                 "to the same feed", print_help=False)
+            self.settings.set('CRAWL_WORKERS', opts.workers, priority='cmdline')
 
     def run(self, args, opts):
         ## 运行爬虫
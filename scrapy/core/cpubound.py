@@ -0,0 +1,244 @@
+"""
+Process pool for CPU-bound spider callbacks.
+
+Callbacks decorated with :func:`scrapy.utils.decorators.cpu_bound`, and
+callbacks of requests with the ``cpu_bound`` meta key set to ``True``, are run
+in a pool of worker processes instead of the reactor thread, so that parsing
+large responses does not stall downloads.
+
+The pool is started by forking the crawl process when the spider is opened,
+if the spider has ``@cpu_bound`` callbacks or the ``CPU_BOUND_PROCESSES``
+setting is not 0 (otherwise responses of requests with the ``cpu_bound`` meta
+key are processed in the reactor thread). With
+:class:`~scrapy.crawler.CrawlerProcess` (and the ``crawl`` command) this
+happens before the reactor, and thus its thread pool, is started: forking a
+process running other threads may leave the workers with locks held by
+threads which do not exist there. The workers get a copy of the spider as it
+was once opened. The response is sent to a worker, the callback runs there,
+and the items and requests it returns are sent back, requests being rebuilt
+with :func:`~scrapy.utils.reqser.request_from_dict`. This means that:
+
+* callbacks must be methods of the spider, and the requests they return must
+  be serializable like the requests of persistent jobs;
+* changes made by offloaded callbacks to the spider are not seen by the crawl
+  process;
+* spider middlewares still run in the crawl process.
+
+Responses which cannot be sent to the pool are processed in the reactor
+thread, as usual.
+"""
+import os
+import pickle
+import signal
+import logging
+import traceback
+import multiprocessing
+
+import six
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+
+from scrapy import signals
+from scrapy.http import Request
+from scrapy.utils.reqser import request_to_dict, request_from_dict, \
+    response_to_dict, response_from_dict
+
+logger = logging.getLogger(__name__)
+
+# spider run by the pool workers, set in the crawl process right before they
+# are forked
+_spider = None
+
+
+class _RemoteTraceback(Exception):
+    """Traceback of an exception raised in a pool worker, chained to that
+    exception (as ``__cause__``) so it is logged with it"""
+
+    def __init__(self, tb):
+        self.tb = tb
+
+    def __str__(self):
+        return self.tb
+
+
+def _init_worker():
+    # the shutdown handlers of the crawl process were inherited: let the
+    # pool be terminated, and keyboard interrupts be handled by the crawl
+    # process alone
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def fork_pool(processes):
+    """Start a :mod:`multiprocessing` pool of ``processes`` workers forked
+    from the crawl process, so they get a copy of its state at that time.
+
+    This should be called before any other thread is started, see the
+    documentation of this module.
+    """
+    context = multiprocessing if six.PY2 \
+        else multiprocessing.get_context('fork')
+    return context.Pool(processes, _init_worker)
+
+
+def defer_to_pool(pool, func, *args):
+    """Call ``func(*args)`` in ``pool``, return a deferred fired (in the
+    reactor thread) with its result, or with the exception it raised.
+
+    ``func`` and ``args`` are pickled here and the outcome of the call is
+    pickled by the worker, so that pickling errors are reported as failures
+    too (on Python 2, failures never reach the callbacks of the pool).
+    """
+    try:
+        data = pickle.dumps((func, args), protocol=2)
+    except Exception:
+        return defer.fail()
+    d = defer.Deferred()
+    kwargs = {}
+    if not six.PY2:
+        kwargs['error_callback'] = lambda e: reactor.callFromThread(d.errback, e)
+    pool.apply_async(_call, (data,),
+                     callback=lambda r: reactor.callFromThread(_fire, d, r),
+                     **kwargs)
+    return d
+
+
+def _call(data):
+    func, args = pickle.loads(data)
+    return dump_call(func, *args)
+
+
+def _fire(d, data):
+    try:
+        result = load_result(data)
+    except Exception:
+        d.errback()
+    else:
+        d.callback(result)
+
+
+def dump_call(func, *args):
+    """Call ``func(*args)`` and return its result pickled, along with the
+    exception it raised (if any), to be loaded with :func:`load_result`"""
+    try:
+        return pickle.dumps((True, func(*args)), protocol=2)
+    except Exception as e:
+        tb = traceback.format_exc()
+        try:
+            return pickle.dumps((False, (e, tb)), protocol=2)
+        except Exception:
+            # exceptions which cannot be pickled (or unpickled)
+            e = Exception('%s: %s' % (type(e).__name__, e))
+            return pickle.dumps((False, (e, tb)), protocol=2)
+
+
+def load_result(data):
+    """Return the result pickled by :func:`dump_call`, or raise the exception
+    it recorded, chained to its remote traceback"""
+    ok, result = pickle.loads(data)
+    if not ok:
+        exc, tb = result
+        if not six.PY2:
+            exc.__cause__ = _RemoteTraceback(tb)
+        raise exc
+    return result
+
+
+def _callback_output(callback_name, data):
+    """Run in the pool workers: call the spider callback and return its
+    output, requests being converted to dicts"""
+    response = response_from_dict(pickle.loads(data), _spider)
+    output = []
+    for x in getattr(_spider, callback_name)(response) or ():
+        if isinstance(x, Request):
+            output.append((True, request_to_dict(x, _spider)))
+        else:
+            output.append((False, x))
+    return output
+
+
+def _has_cpu_bound_callbacks(spider):
+    spidercls = type(spider)
+    return any(getattr(getattr(spidercls, name, None), 'cpu_bound', False)
+               for name in dir(spidercls))
+
+
+class CallbackProcessPool(object):
+    ## 用进程池执行 CPU 密集型的爬虫回调，避免解析大响应时阻塞 reactor 线程（进而阻塞下载）
+
+    def __init__(self, processes=0, max_pending=0, stats=None):
+        # a number of processes given explicitly starts the pool even if
+        # no callback is decorated with @cpu_bound
+        self.always_start = bool(processes)
+        self.processes = processes or multiprocessing.cpu_count()
+        self.max_pending = max_pending or 2 * self.processes
+        self.stats = stats
+        self._pool = None
+        self._warned = False
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        pool = cls(settings.getint('CPU_BOUND_PROCESSES'),
+                   settings.getint('CPU_BOUND_MAX_PENDING'),
+                   crawler.stats)
+        crawler.signals.connect(pool.spider_opened, signal=signals.spider_opened)
+        return pool
+
+    def spider_opened(self, spider):
+        if hasattr(os, 'fork') and self._pool is None and \
+                (self.always_start or _has_cpu_bound_callbacks(spider)):
+            self._start_pool(spider)
+
+    def wants(self, result, request, callback, spider):
+        """Whether ``callback`` should be called with ``result`` in the pool"""
+        if isinstance(result, Failure) \
+                or getattr(callback, '__self__', None) is not spider:
+            return False
+        if not (getattr(callback, 'cpu_bound', False)
+                or request.meta.get('cpu_bound')):
+            return False
+        if self._pool is None:
+            if hasattr(os, 'fork') and not self._warned:
+                self._warned = True
+                logger.warning("Processing cpu_bound responses in the reactor "
+                               "thread: the callback process pool is only "
+                               "started for spiders with @cpu_bound callbacks "
+                               "or when CPU_BOUND_PROCESSES is set",
+                               extra={'spider': spider})
+            self.stats.inc_value('cpu_bound/inline', spider=spider)
+            return False
+        return True
+
+    def call(self, response, callback, spider):
+        """Call ``callback`` with ``response`` in the pool. Return a deferred
+        with its output, or ``None`` if the response cannot be offloaded."""
+        try:
+            data = pickle.dumps(response_to_dict(response, spider), protocol=2)
+        except Exception as e:
+            logger.debug("Processing %(response)s in the reactor thread, it "
+                         "cannot be sent to the callback pool: %(error)s",
+                         {'response': response, 'error': e},
+                         extra={'spider': spider})
+            self.stats.inc_value('cpu_bound/inline', spider=spider)
+            return
+        self.stats.inc_value('cpu_bound/offloaded', spider=spider)
+        d = defer_to_pool(self._pool, _callback_output, callback.__name__, data)
+        return d.addCallback(self._load_output, spider)
+
+    def _start_pool(self, spider):
+        global _spider
+        _spider = spider
+        self._pool = fork_pool(self.processes)
+        logger.info("Started callback process pool with %(processes)d "
+                    "processes", {'processes': self.processes},
+                    extra={'spider': spider})
+
+    def _load_output(self, output, spider):
+        return [request_from_dict(x, spider) if is_request else x
+                for is_request, x in output]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
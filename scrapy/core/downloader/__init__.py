@@ -116,9 +116,13 @@ class Downloader(object):
         ## 注册结束回调
         return dfd.addBoth(_deactivate)
 
-    def needs_backout(self):
+    def needs_backout(self, spider=None):
         return len(self.active) >= self.total_concurrency
 
+    def spider_active(self, spider):
+        """Number of requests of the given spider being downloaded"""
+        return len(self.active)
+
     def _get_slot(self, request, spider):
         key = self._get_slot_key(request, spider)
         if key not in self.slots:
@@ -132,11 +136,12 @@ class Downloader(object):
         if 'download_slot' in request.meta:
             return request.meta['download_slot']
 
-        key = urlparse_cached(request).hostname or ''
-        if self.ip_concurrency:
-            key = dnscache.get(key, key)
+        return self._get_host_slot_key(urlparse_cached(request).hostname or '')
 
-        return key
+    def _get_host_slot_key(self, hostname):
+        if self.ip_concurrency:
+            return dnscache.get(hostname, hostname)
+        return hostname
 
     def _enqueue_request(self, request, spider):
         ## 将 request 加入下载请求队列
@@ -9,6 +9,7 @@ from six.moves.urllib.parse import urldefrag
 
 from zope.interface import implementer
 from twisted.internet import defer, reactor, protocol
+from twisted.python.failure import Failure
 from twisted.web.http_headers import Headers as TxHeaders
 from twisted.web.iweb import IBodyProducer, UNKNOWN_LENGTH
 from twisted.internet.error import TimeoutError
@@ -64,7 +65,8 @@ class HTTP11DownloadHandler(object):
         agent = ScrapyAgent(contextFactory=self._contextFactory, pool=self._pool,
             maxsize=getattr(spider, 'download_maxsize', self._default_maxsize),
             warnsize=getattr(spider, 'download_warnsize', self._default_warnsize),
-            fail_on_dataloss=self._fail_on_dataloss)
+            fail_on_dataloss=self._fail_on_dataloss,
+            stream=getattr(spider, 'download_stream', None))
         return agent.download_request(request)
 
     def close(self):
@@ -268,7 +270,7 @@ class ScrapyAgent(object):
     _TunnelingAgent = TunnelingAgent
 
     def __init__(self, contextFactory=None, connectTimeout=10, bindAddress=None, pool=None,
-                 maxsize=0, warnsize=0, fail_on_dataloss=True):
+                 maxsize=0, warnsize=0, fail_on_dataloss=True, stream=None):
         self._contextFactory = contextFactory
         self._connectTimeout = connectTimeout
         self._bindAddress = bindAddress
@@ -276,6 +278,7 @@ class ScrapyAgent(object):
         self._maxsize = maxsize
         self._warnsize = warnsize
         self._fail_on_dataloss = fail_on_dataloss
+        self._stream = stream
         self._txresponse = None
 
     def _get_agent(self, request, timeout):
@@ -355,9 +358,26 @@ class ScrapyAgent(object):
         request.meta['download_latency'] = time() - start_time
         return result
 
+    def _get_consumer(self, txresponse, request):
+        ## 流式接收响应体：请求 meta 中的 download_stream，或 spider 的 download_stream(request)
+        consumer = request.meta.get('download_stream')
+        if consumer is None and self._stream is not None:
+            consumer = self._stream(request)
+            if consumer is not None:
+                request.meta['download_stream'] = consumer
+        if consumer is not None:
+            headers = Headers(txresponse.headers.getAllRawHeaders())
+            consumer.start(request, int(txresponse.code), headers)
+        return consumer
+
     def _cb_bodyready(self, txresponse, request):
+        consumer = self._get_consumer(txresponse, request)
+
         # deliverBody hangs for responses without body
         if txresponse.length == 0:
+            request.meta['download_wire_bytes'] = _wire_size(txresponse, 0)
+            if consumer is not None:
+                return txresponse, consumer.finish(), ['streamed']
             return txresponse, b'', None
 
         maxsize = request.meta.get('download_maxsize', self._maxsize)
@@ -372,6 +392,8 @@ class ScrapyAgent(object):
 
             logger.error(error_msg, error_args)
             txresponse._transport._producer.loseConnection()
+            if consumer is not None:
+                consumer.fail(None)
             raise defer.CancelledError(error_msg % error_args)
 
         if warnsize and expected_size > warnsize:
@@ -385,7 +407,8 @@ class ScrapyAgent(object):
 
         d = defer.Deferred(_cancel)
         txresponse.deliverBody(_ResponseReader(
-            d, txresponse, request, maxsize, warnsize, fail_on_dataloss))
+            d, txresponse, request, maxsize, warnsize, fail_on_dataloss,
+            consumer))
 
         # save response for timeouts
         self._txresponse = txresponse
@@ -421,11 +444,13 @@ class _RequestBodyProducer(object):
 class _ResponseReader(protocol.Protocol):
 
     def __init__(self, finished, txresponse, request, maxsize, warnsize,
-                 fail_on_dataloss):
+                 fail_on_dataloss, consumer=None):
         self._finished = finished
         self._txresponse = txresponse
         self._request = request
-        self._bodybuf = BytesIO()
+        self._consumer = consumer
+        self._consumer_closed = False
+        self._bodybuf = BytesIO() if consumer is None else None
         self._maxsize  = maxsize
         self._warnsize  = warnsize
         self._fail_on_dataloss = fail_on_dataloss
@@ -439,7 +464,17 @@ class _ResponseReader(protocol.Protocol):
         if self._finished.called:
             return
 
-        self._bodybuf.write(bodyBytes)
+        if self._consumer is not None:
+            try:
+                self._consumer.write(bodyBytes)
+            except Exception:
+                failure = Failure()
+                self._consumer_failed(failure)
+                self._finished.errback(failure)
+                self._txresponse._transport._producer.abortConnection()
+                return
+        else:
+            self._bodybuf.write(bodyBytes)
         self._bytes_received += len(bodyBytes)
 
         if self._maxsize and self._bytes_received > self._maxsize:
@@ -450,7 +485,10 @@ class _ResponseReader(protocol.Protocol):
                           'request': self._request})
             # Clear buffer earlier to avoid keeping data in memory for a long
             # time.
-            self._bodybuf.truncate(0)
+            if self._consumer is not None:
+                self._consumer_failed(None)
+            else:
+                self._bodybuf.truncate(0)
             self._finished.cancel()
 
         if self._warnsize and self._bytes_received > self._warnsize and not self._reached_warnsize:
@@ -462,20 +500,21 @@ class _ResponseReader(protocol.Protocol):
 
     def connectionLost(self, reason):
         if self._finished.called:
+            # cancelled (timeout, max size...) or failed while consuming
+            self._consumer_failed(reason)
             return
 
-        body = self._bodybuf.getvalue()
         if reason.check(ResponseDone):
-            self._finished.callback((self._txresponse, body, None))
+            self._done(None)
             return
 
         if reason.check(PotentialDataLoss):
-            self._finished.callback((self._txresponse, body, ['partial']))
+            self._done(['partial'])
             return
 
         if reason.check(ResponseFailed) and any(r.check(_DataLoss) for r in reason.value.reasons):
             if not self._fail_on_dataloss:
-                self._finished.callback((self._txresponse, body, ['dataloss']))
+                self._done(['dataloss'])
                 return
 
             elif not self._fail_on_dataloss_warned:
@@ -485,4 +524,38 @@ class _ResponseReader(protocol.Protocol):
                             self._txresponse.request.absoluteURI.decode())
                 self._fail_on_dataloss_warned = True
 
+        self._consumer_failed(reason)
         self._finished.errback(reason)
+
+    def _done(self, flags):
+        self._request.meta['download_wire_bytes'] = _wire_size(
+            self._txresponse, self._bytes_received)
+        if self._consumer is None:
+            body = self._bodybuf.getvalue()
+        else:
+            self._consumer_closed = True
+            try:
+                body = self._consumer.finish()
+            except Exception:
+                self._finished.errback(Failure())
+                return
+            flags = (flags or []) + ['streamed']
+        self._finished.callback((self._txresponse, body, flags))
+
+    def _consumer_failed(self, reason):
+        if self._consumer is not None and not self._consumer_closed:
+            self._consumer_closed = True
+            self._consumer.fail(reason)
+
+
+def _wire_size(txresponse, body_size):
+    """Number of bytes received for a response: status line, headers and
+    body as sent by the server (before any content decoding, but after
+    removing the chunked transfer encoding)"""
+    version = txresponse.version
+    size = len(version[0]) + len(str(version[1])) + len(str(version[2])) + 2
+    size += len(str(txresponse.code)) + len(txresponse.phrase or b'') + 4
+    for name, values in txresponse.headers.getAllRawHeaders():
+        for value in values:
+            size += len(name) + len(value) + 4
+    return size + 2 + body_size
@@ -0,0 +1,167 @@
+"""
+Downloader shared by several crawlers running in the same process.
+
+When the ``SHARED_DOWNLOADER`` setting of a
+:class:`~scrapy.crawler.CrawlerRunner` is enabled, all its crawlers use a
+single :class:`SharedDownloader` instead of building their own downloader,
+so they share the download handlers (and thus the HTTP connection pool), the
+per-host download slots and the robots.txt cache. Each crawler keeps its own
+engine, scheduler, downloader middlewares, pipelines, signals and stats.
+"""
+from time import time
+from collections import defaultdict
+
+import six
+from twisted.internet import defer, reactor, task
+
+from scrapy import signals
+from scrapy.signalmanager import SignalManager
+from scrapy.core.downloader import Downloader
+from scrapy.core.downloader.middleware import DownloaderMiddlewareManager
+from scrapy.core.downloader.handlers import DownloadHandlers
+
+
+class _HandlersOwner(object):
+    """What :class:`DownloadHandlers` needs from a crawler"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.signals = SignalManager(self)
+
+
+class _SpiderSignals(object):
+    """Send downloader signals through the signal manager of the crawler of
+    the spider they refer to"""
+
+    def send_catch_log(self, signal, **kwargs):
+        return kwargs['spider'].crawler.signals.send_catch_log(
+            signal=signal, **kwargs)
+
+
+class SharedDownloader(Downloader):
+    """Downloader used by all the crawlers attached to it.
+
+    Concurrency settings are taken from the settings of the runner.
+    Requests go through the downloader middlewares of the crawler of their
+    spider. While several crawlers are attached, each spider may use up to
+    an equal share of ``CONCURRENT_REQUESTS``, so that busy spiders do not
+    starve the others.
+
+    Download slots are shared by all spiders: their delay and concurrency
+    come from the spider which created them. Queued requests are kept with
+    their spider, so they are downloaded with its settings whichever spider
+    makes the slot queue progress.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.signals = _SpiderSignals()
+        self.slots = {}
+        self.active = set()
+        self.handlers = DownloadHandlers(_HandlersOwner(settings))
+        self.total_concurrency = self.settings.getint('CONCURRENT_REQUESTS')
+        self.domain_concurrency = self.settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN')
+        self.ip_concurrency = self.settings.getint('CONCURRENT_REQUESTS_PER_IP')
+        self.randomize_delay = self.settings.getbool('RANDOMIZE_DOWNLOAD_DELAY')
+        self.crawlers = set()
+        self.middlewares = {}
+        self.robotstxt_parsers = {}
+        self._spider_active = defaultdict(int)
+        self._slot_gc_loop = task.LoopingCall(self._slot_gc)
+        self._slot_gc_loop.start(60)
+
+    def attach(self, crawler):
+        """Make ``crawler`` use this downloader"""
+        crawler.shared_downloader = self
+        self.crawlers.add(crawler)
+        self.middlewares[crawler] = DownloaderMiddlewareManager.from_crawler(crawler)
+
+    def detach(self, crawler):
+        """Stop using this downloader for ``crawler``. Return whether other
+        crawlers are still attached."""
+        self.crawlers.discard(crawler)
+        self.middlewares.pop(crawler, None)
+        return bool(self.crawlers)
+
+    def fetch(self, request, spider):
+        self.active.add(request)
+        self._spider_active[spider] += 1
+        middleware = self.middlewares[spider.crawler]
+        dfd = middleware.download(self._enqueue_request, request, spider)
+        return dfd.addBoth(self._deactivate, request, spider)
+
+    def _deactivate(self, response, request, spider):
+        self.active.remove(request)
+        self._spider_active[spider] -= 1
+        if not self._spider_active[spider]:
+            del self._spider_active[spider]
+        # the engine of the spider schedules its next request by itself, the
+        # other ones may have backed out while the downloader was full
+        for crawler in self.crawlers:
+            slot = getattr(crawler.engine, 'slot', None)
+            if crawler is not spider.crawler and slot is not None:
+                slot.nextcall.schedule()
+        return response
+
+    def _enqueue_request(self, request, spider):
+        key, slot = self._get_slot(request, spider)
+        request.meta['download_slot'] = key
+
+        def _deactivate(response):
+            slot.active.remove(request)
+            return response
+
+        slot.active.add(request)
+        self.signals.send_catch_log(signal=signals.request_reached_downloader,
+                                    request=request,
+                                    spider=spider)
+        deferred = defer.Deferred().addBoth(_deactivate)
+        slot.queue.append((request, deferred, spider))
+        self._process_queue(spider, slot)
+        return deferred
+
+    def _process_queue(self, spider, slot):
+        # ``spider`` is the one which made the queue progress, queued
+        # requests are downloaded with their own spider
+        if slot.latercall and slot.latercall.active():
+            return
+
+        now = time()
+        delay = slot.download_delay()
+        if delay:
+            penalty = delay - now + slot.lastseen
+            if penalty > 0:
+                slot.latercall = reactor.callLater(penalty, self._process_queue, spider, slot)
+                return
+
+        while slot.queue and slot.free_transfer_slots() > 0:
+            slot.lastseen = now
+            request, deferred, request_spider = slot.queue.popleft()
+            dfd = self._download(slot, request, request_spider)
+            dfd.chainDeferred(deferred)
+            # prevent burst if inter-request delays were configured
+            if delay:
+                self._process_queue(spider, slot)
+                break
+
+    def needs_backout(self, spider=None):
+        if len(self.active) >= self.total_concurrency:
+            return True
+        if spider is None or len(self.crawlers) < 2:
+            return False
+        share = max(1, self.total_concurrency // len(self.crawlers))
+        return self._spider_active.get(spider, 0) >= share
+
+    def spider_active(self, spider):
+        return self._spider_active.get(spider, 0)
+
+    def close(self):
+        # called by every engine closing a spider: the downloader is closed
+        # by the runner once no crawler uses it, see close_shared()
+        pass
+
+    def close_shared(self):
+        self._slot_gc_loop.stop()
+        for slot in six.itervalues(self.slots):
+            slot.close()
+        return self.handlers._close()
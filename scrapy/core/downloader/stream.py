@@ -0,0 +1,343 @@
+"""
+Consumers for streamed response bodies.
+
+By default the HTTP/1.1 download handler buffers the whole body of a response
+in memory before building the :class:`~scrapy.http.Response`. A body consumer
+receives the body chunk by chunk instead, as it arrives from the network, so
+large responses never have to be held in memory at once.
+
+Streaming is enabled per request, by setting the ``download_stream`` meta key
+to a :class:`BodyConsumer` instance, or per spider, by setting its
+``download_stream`` attribute to a callable which receives a request and
+returns a consumer (or ``None`` not to stream that request). The consumer is
+kept in ``response.meta['download_stream']``, and the body of the response is
+what :meth:`BodyConsumer.finish` returns (empty by default). Streamed
+responses are flagged with ``'streamed'``; since they carry the body as
+received on the wire, the HTTP compression and cache middlewares leave them
+alone.
+
+A consumer may be started more than once (on redirects or retries, which copy
+the request meta), so :meth:`BodyConsumer.start` must reset its state.
+"""
+
+import os
+import zlib
+import tempfile
+
+from scrapy.utils.iterators import _xmliter_tag, _xmliter_node
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class BodyConsumer(object):
+    """Base class for response body consumers"""
+
+    def start(self, request, status, headers):
+        """Called once the response status and headers are known, before any
+        body data"""
+        pass
+
+    def write(self, data):
+        """Called for every chunk of the response body"""
+        raise NotImplementedError
+
+    def finish(self):
+        """Called once the whole body was received. Return the body to use
+        for the response"""
+        return b''
+
+    def fail(self, reason):
+        """Called instead of :meth:`finish` if the download failed"""
+        pass
+
+
+class FileBodyConsumer(BodyConsumer):
+    """Write the body to the file at ``path`` (a new temporary file if not
+    given). The file is written to ``path + '.part'`` and renamed once
+    complete; it is removed if the download fails."""
+
+    def __init__(self, path=None, dir=None):
+        self.path = path
+        self.dir = dir
+        self.size = 0
+        self._file = None
+
+    def start(self, request, status, headers):
+        self._close()
+        if self.path is None:
+            fd, self.path = tempfile.mkstemp(prefix='scrapy-', dir=self.dir)
+            os.close(fd)
+        self._file = open(self.path + '.part', 'wb')
+        self.size = 0
+
+    def write(self, data):
+        self._file.write(data)
+        self.size += len(data)
+
+    def finish(self):
+        self._close()
+        if os.name == 'nt' and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(self.path + '.part', self.path)
+        return b''
+
+    def fail(self, reason):
+        self._close()
+        if os.path.exists(self.path + '.part'):
+            os.remove(self.path + '.part')
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class DecompressingConsumer(BodyConsumer):
+    """Undo the ``Content-Encoding`` of the body before passing it to another
+    consumer. Header values passed on to that consumer no longer include
+    ``Content-Encoding``, unless its encoding is not supported by
+    :class:`Decoder` and the body is passed on as received."""
+
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self._decoder = None
+
+    def __getattr__(self, name):
+        # let callers reach the wrapped consumer's attributes (path, nodes...)
+        if name == 'consumer':
+            raise AttributeError(name)
+        return getattr(self.consumer, name)
+
+    def start(self, request, status, headers):
+        encoding = headers.get('Content-Encoding')
+        self._decoder = Decoder(encoding) if encoding else None
+        if self._decoder is not None and self._decoder.passthrough:
+            # the body is kept as received
+            self._decoder = None
+        if self._decoder is not None:
+            headers = headers.copy()
+            del headers['Content-Encoding']
+        self.consumer.start(request, status, headers)
+
+    def write(self, data):
+        if self._decoder is not None:
+            data = self._decoder.decompress(data)
+        if data:
+            self.consumer.write(data)
+
+    def finish(self):
+        if self._decoder is not None:
+            data = self._decoder.flush()
+            if data:
+                self.consumer.write(data)
+        return self.consumer.finish()
+
+    def fail(self, reason):
+        self.consumer.fail(reason)
+
+
+class XmlNodeConsumer(BodyConsumer):
+    """Parse the body incrementally and collect the ``nodename`` nodes as
+    selectors, like :func:`~scrapy.utils.iterators.xmliter_lxml` does for a
+    whole response. Parsed nodes are removed from the document as they are
+    collected, so only the collected nodes are kept in memory.
+
+    If ``callback`` is given it is called with every node instead of adding
+    it to the ``nodes`` list.
+    """
+
+    def __init__(self, nodename, namespace=None, prefix='x', callback=None):
+        self.nodename = nodename
+        self.namespace = namespace
+        self.prefix = prefix
+        self.callback = callback
+        self.nodes = []
+        self._parser = None
+
+    def start(self, request, status, headers):
+        from lxml import etree
+        tag = _xmliter_tag(self.nodename, self.namespace)
+        self._parser = etree.XMLPullParser(events=('end',), tag=tag,
+                                           resolve_entities=False)
+        self.nodes = []
+
+    def write(self, data):
+        self._parser.feed(data)
+        self._read_events()
+
+    def finish(self):
+        try:
+            self._parser.close()
+        except Exception:
+            # keep the nodes parsed so far from truncated documents
+            pass
+        self._read_events()
+        return b''
+
+    def _read_events(self):
+        for _, node in self._parser.read_events():
+            sel = _xmliter_node(node, self.nodename, self.namespace,
+                                self.prefix)
+            node.clear()
+            while node.getprevious() is not None:
+                del node.getparent()[0]
+            if self.callback is not None:
+                self.callback(sel)
+            else:
+                self.nodes.append(sel)
+
+
+class DecompressionMaxSizeExceeded(ValueError):
+    """A body decompresses to more than the allowed size"""
+
+
+def decompress(body, encoding, max_size=0):
+    """Undo the ``encoding`` content encoding of a whole ``body``, chunk by
+    chunk, raising :exc:`DecompressionMaxSizeExceeded` as soon as the output
+    grows beyond ``max_size`` bytes (if not 0)"""
+    decoder = Decoder(encoding)
+    chunks = []
+    size = 0
+    for chunk in decoder.iter_decompress(body):
+        size += len(chunk)
+        if max_size and size > max_size:
+            raise DecompressionMaxSizeExceeded(
+                "Decompressed size exceeds %d bytes" % max_size)
+        chunks.append(chunk)
+    chunk = decoder.flush()
+    if max_size and size + len(chunk) > max_size:
+        raise DecompressionMaxSizeExceeded(
+            "Decompressed size exceeds %d bytes" % max_size)
+    chunks.append(chunk)
+    # the output is allocated once, at its final size
+    return b''.join(chunks)
+
+
+class Decoder(object):
+    """Incremental decoder for the ``gzip``, ``deflate`` and (if the brotli
+    module is available) ``br`` content encodings. Data in other encodings
+    (``identity``, ``compress``...) is passed through unchanged, as
+    :class:`~scrapy.downloadermiddlewares.httpcompression.HttpCompressionMiddleware`
+    does; :attr:`passthrough` is then true.
+
+    Data following a complete gzip member which is not another gzip member
+    is ignored, like :func:`~scrapy.utils.gz.gunzip` does.
+
+    With ``salvage``, when decompression fails the output that preceded the
+    error is kept in :attr:`salvaged` before the error is raised (gzip
+    checksums, for instance, are only checked once all the data they cover
+    was decompressed).
+    """
+
+    def __init__(self, encoding, salvage=False):
+        self.encoding = encoding.lower()
+        self.salvage = salvage
+        self.salvaged = b''
+        self._first = True
+        self._members = 0  # complete gzip members
+        self._done = False
+        if self.encoding in (b'gzip', b'x-gzip'):
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == b'deflate':
+            self._obj = zlib.decompressobj()
+        elif self.encoding == b'br' and brotli is not None:
+            self._obj = brotli.Decompressor()
+        else:
+            self._obj = None
+
+    @property
+    def passthrough(self):
+        return self._obj is None
+
+    def decompress(self, data):
+        return b''.join(self.iter_decompress(data))
+
+    def iter_decompress(self, data, size=65536):
+        """Decompress ``data``, yielding the output in chunks of at most
+        ``size`` bytes, so callers can stop before all of it is produced"""
+        if self._obj is None:
+            if data:
+                yield data
+            return
+        if self._done:
+            return
+        if self.encoding == b'br':
+            for chunk in self._iter_brotli(data, size):
+                yield chunk
+            return
+        if self.encoding == b'deflate' and self._first:
+            self._first = False
+            try:
+                output = self._obj.decompress(data, size)
+            except zlib.error:
+                # raw deflate content sent by some servers, see
+                # HttpCompressionMiddleware._decode()
+                self._obj = zlib.decompressobj(-15)
+                output = self._obj.decompress(data, size)
+        else:
+            output = self._next_output(data, size)
+        while output is not None:
+            if output:
+                yield output
+            if self._obj.unused_data or getattr(self._obj, 'eof', False):
+                # end of the stream, what follows it is in unused_data
+                if not self._obj.unused_data or self.encoding == b'deflate':
+                    break
+                # gzip bodies may be made of several members
+                data = self._obj.unused_data
+                self._members += 1
+                self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                output = self._next_output(data, size)
+            elif self._obj.unconsumed_tail:
+                output = self._next_output(self._obj.unconsumed_tail, size)
+            else:
+                break
+
+    def _next_output(self, data, size):
+        # return None once data that is not a gzip member is found after a
+        # complete one
+        try:
+            return self._decompress(data, size)
+        except zlib.error:
+            if not self._members:
+                raise
+            self._done = True
+
+    def _decompress(self, data, size):
+        if not self.salvage:
+            return self._obj.decompress(data, size)
+        backup = self._obj.copy()
+        try:
+            return self._obj.decompress(data, size)
+        except zlib.error:
+            # replay the input byte by byte, up to the error
+            output = []
+            for i in range(len(data)):
+                try:
+                    output.append(backup.decompress(data[i:i + 1]))
+                except zlib.error:
+                    break
+            self.salvaged = b''.join(output)
+            raise
+
+    def _iter_brotli(self, data, size):
+        try:
+            output = self._obj.process(data, output_buffer_limit=size)
+        except TypeError:
+            # brotli<1.1 cannot limit its output
+            yield self._obj.process(data)
+            return
+        while output:
+            yield output
+            if self._obj.is_finished():
+                break
+            # an empty output means all the input given so far was processed
+            output = self._obj.process(b'', output_buffer_limit=size)
+
+    def flush(self):
+        if self._obj is None or self._done or self.encoding == b'br':
+            return b''
+        return self._obj.flush()
@@ -16,6 +16,7 @@ from scrapy.exceptions import DontCloseSpider
 from scrapy.http import Response, Request
 from scrapy.utils.misc import load_object
 from scrapy.utils.reactor import CallLaterOnce
+from scrapy.utils.defer import YieldPolicy, set_yield_policy
 from scrapy.utils.log import logformatter_adapter, failure_to_exc_info
 
 logger = logging.getLogger(__name__)
@@ -74,10 +75,13 @@ class ExecutionEngine(object):
         self.scheduler_cls = load_object(self.settings['SCHEDULER'])
         ## 从配置文件中加载下载器类
         downloader_cls = load_object(self.settings['DOWNLOADER'])
-        ## 实例化下载器
-        self.downloader = downloader_cls(crawler)
+        ## 实例化下载器（若 crawler 使用多个 crawler 共用的下载器，则直接使用它）
+        self.downloader = getattr(crawler, 'shared_downloader', None) \
+            or downloader_cls(crawler)
         ## 实例化 scraper，它是引擎连接爬虫类（Spider）和管道类（Pipeline）的桥梁
         self.scraper = Scraper(crawler)
+        ## 设置 defer_succeed/defer_fail 推迟回调的方式（让出 reactor 的策略）
+        set_yield_policy(YieldPolicy.from_settings(self.settings))
         ## 指定爬虫关闭的回调函数
         self._spider_closed_callback = spider_closed_callback
 
@@ -168,7 +172,7 @@ class ExecutionEngine(object):
         slot = self.slot
         return not self.running \
             or slot.closing \
-            or self.downloader.needs_backout() \
+            or self.downloader.needs_backout(spider) \
             or self.scraper.slot.needs_backout()
 
     def _next_request_from_scheduler(self, spider):
@@ -218,7 +222,7 @@ class ExecutionEngine(object):
             # scraper is not idle
             return False
 
-        if self.downloader.active:
+        if self.downloader.spider_active(spider):
             # downloader has pending requests
             return False
 
@@ -13,7 +13,8 @@ logger = logging.getLogger(__name__)
 class Scheduler(object):
 
     def __init__(self, dupefilter, jobdir=None, dqclass=None, mqclass=None,
-                 logunser=False, stats=None, pqclass=None):
+                 logunser=False, stats=None, pqclass=None, mqlimit=0,
+                 mqbytes=0, crawler=None):
         ## 调度器的初始化主要做了两件事：
         ## 1. 实例化请求指纹过滤器（用来过滤重复请求，可自己重写替换之）
         ## 2. 定义各种不同类型的任务队列（基于优先级、磁盘、内存的任务队列）
@@ -32,6 +33,13 @@ class Scheduler(object):
         self.logunser = logunser
         ## 统计
         self.stats = stats
+        self.crawler = crawler
+        ## 混合模式：请求先放在内存队列中，超出数量或字节预算后才转移到磁盘队列
+        ## （需要 JOBDIR，且优先级队列类与 queuelib.PriorityQueue 兼容）
+        self.mqlimit = mqlimit
+        self.mqbytes = mqbytes
+        self.hybrid = bool(self.dqdir and (mqlimit or mqbytes))
+        self._mqbytes = 0
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -51,7 +59,10 @@ class Scheduler(object):
         logunser = settings.getbool('LOG_UNSERIALIZABLE_REQUESTS', settings.getbool('SCHEDULER_DEBUG'))
         ## 返回一个调度器实例
         return cls(dupefilter, jobdir=job_dir(settings), logunser=logunser,
-                   stats=crawler.stats, pqclass=pqclass, dqclass=dqclass, mqclass=mqclass)
+                   stats=crawler.stats, pqclass=pqclass, dqclass=dqclass, mqclass=mqclass,
+                   mqlimit=settings.getint('SCHEDULER_MEMORY_QUEUE_LIMIT'),
+                   mqbytes=settings.getint('SCHEDULER_MEMORY_QUEUE_BYTES'),
+                   crawler=crawler)
 
     def has_pending_requests(self):
         return len(self) > 0
@@ -59,13 +70,23 @@ class Scheduler(object):
     def open(self, spider):
         self.spider = spider
         ## 实例化一个基于优先级的任务队列
-        self.mqs = self.pqclass(self._newmq)
+        self.mqs = self._newpq(self._newmq)
         ## 如果存在 dqdir 则实例化一个基于磁盘的任务队列
         self.dqs = self._dq() if self.dqdir else None
+        if self.hybrid and not hasattr(self.mqs, 'queues'):
+            logger.warning("%(pqclass)s does not support spilling requests to "
+                           "disk, ignoring SCHEDULER_MEMORY_QUEUE_LIMIT and "
+                           "SCHEDULER_MEMORY_QUEUE_BYTES",
+                           {'pqclass': self.pqclass.__name__},
+                           extra={'spider': spider})
+            self.hybrid = False
         ## 调用请求指纹过滤器的 open 方法
         return self.df.open()
 
     def close(self, reason):
+        if self.hybrid:
+            ## 混合模式下，将内存队列中的请求全部写入磁盘，以便恢复爬取
+            self._spill(flush=True)
         if self.dqs:
             prios = self.dqs.close()
             with open(join(self.dqdir, 'active.json'), 'w') as f:
@@ -78,19 +99,26 @@ class Scheduler(object):
             self.df.log(request, self.spider)
             return False
         ## 磁盘队列是否入队成功
-        dqok = self._dqpush(request)
+        if self.hybrid:
+            dqok = self._hybridpush(request)
+        else:
+            dqok = self._dqpush(request)
         if dqok:
             self.stats.inc_value('scheduler/enqueued/disk', spider=self.spider)
         else:
             ## 没有定义磁盘队列，则使用内存队列
             self._mqpush(request)
             self.stats.inc_value('scheduler/enqueued/memory', spider=self.spider)
+            if self.hybrid and self._mq_over_budget():
+                self._spill()
         self.stats.inc_value('scheduler/enqueued', spider=self.spider)
         return True
 
     def next_request(self):
         request = self.mqs.pop()
         if request:
+            if self.hybrid:
+                self._mqbytes -= _request_size(request)
             self.stats.inc_value('scheduler/dequeued/memory', spider=self.spider)
         else:
             request = self._dqpop()
@@ -129,6 +157,43 @@ class Scheduler(object):
     def _mqpush(self, request):
         ## 放入内存队列
         self.mqs.push(request, -request.priority)
+        if self.hybrid:
+            self._mqbytes += _request_size(request)
+
+    def _hybridpush(self, request):
+        # Requests with a lower priority than anything on disk go straight to
+        # disk, so that memory always holds the most urgent requests
+        if len(self.dqs) and -request.priority > self.dqs.curprio:
+            return self._dqpush(request)
+
+    def _mq_over_budget(self, ratio=1.0):
+        return bool(
+            (self.mqlimit and len(self.mqs) > self.mqlimit * ratio) or
+            (self.mqbytes and self._mqbytes > self.mqbytes * ratio))
+
+    def _spill(self, flush=False):
+        """Move requests from memory to disk, lowest priority first, until
+        memory is down to half of its budget (or empty, if ``flush`` is
+        true). Requests that cannot be serialized are kept in memory."""
+        queues = self.mqs.queues
+        kept = []
+        while queues and (flush or self._mq_over_budget(0.5)):
+            prio = max(queues)
+            q = queues[prio]
+            request = q.pop()
+            if not len(q):
+                del queues[prio]
+                q.close()
+                self.mqs.curprio = min(queues) if queues else None
+            if request is None:
+                continue
+            self._mqbytes -= _request_size(request)
+            if self._dqpush(request):
+                self.stats.inc_value('scheduler/spilled', spider=self.spider)
+            else:
+                kept.append(request)
+        for request in kept:
+            self._mqpush(request)
 
     def _dqpop(self):
         if self.dqs:
@@ -136,6 +201,13 @@ class Scheduler(object):
             if d:
                 return request_from_dict(d, self.spider)
 
+    def _newpq(self, qfactory, startprios=()):
+        ## 若优先级队列类定义了 from_crawler（例如需要访问下载器状态），则通过它创建
+        if self.crawler is not None and hasattr(self.pqclass, 'from_crawler'):
+            return self.pqclass.from_crawler(self.crawler, qfactory,
+                                             startprios=startprios)
+        return self.pqclass(qfactory, startprios=startprios)
+
     def _newmq(self, priority):
         return self.mqclass()
 
@@ -151,7 +223,7 @@ class Scheduler(object):
                 prios = json.load(f)
         else:
             prios = ()
-        q = self.pqclass(self._newdq, startprios=prios)
+        q = self._newpq(self._newdq, startprios=prios)
         if q:
             logger.info("Resuming crawl (%(queuesize)d requests scheduled)",
                         {'queuesize': len(q)}, extra={'spider': self.spider})
@@ -163,3 +235,11 @@ class Scheduler(object):
             if not exists(dqdir):
                 os.makedirs(dqdir)
             return dqdir
+
+
+def _request_size(request):
+    """Rough estimate of the memory used by a request, in bytes"""
+    size = len(request.url) + len(request.body)
+    for key, values in request.headers.items():
+        size += len(key) + sum(len(v) for v in values)
+    return size
@@ -16,6 +16,7 @@ from scrapy import signals
 from scrapy.http import Request, Response
 from scrapy.item import BaseItem
 from scrapy.core.spidermw import SpiderMiddlewareManager
+from scrapy.core.cpubound import CallbackProcessPool
 from scrapy.utils.request import referer_str
 
 logger = logging.getLogger(__name__)
@@ -26,11 +27,13 @@ class Slot(object):
 
     MIN_RESPONSE_SIZE = 1024
 
-    def __init__(self, max_active_size=5000000):
+    def __init__(self, max_active_size=5000000, max_offloaded=0):
         self.max_active_size = max_active_size
+        self.max_offloaded = max_offloaded
         self.queue = deque()
         self.active = set()
         self.active_size = 0
+        self.offloaded = 0
         self.itemproc_size = 0
         self.closing = None
 
@@ -59,6 +62,8 @@ class Slot(object):
         return not (self.queue or self.active)
 
     def needs_backout(self):
+        if self.max_offloaded and self.offloaded >= self.max_offloaded:
+            return True
         return self.active_size > self.max_active_size
 
 
@@ -75,6 +80,8 @@ class Scraper(object):
         self.itemproc = itemproc_cls.from_crawler(crawler)
         ## 从配置中获取同时处理 item 的并发数
         self.concurrent_items = crawler.settings.getint('CONCURRENT_ITEMS')
+        ## 执行 CPU 密集型回调的进程池（在爬虫打开时启动，见 scrapy.core.cpubound）
+        self.callback_pool = CallbackProcessPool.from_crawler(crawler)
         self.crawler = crawler
         self.signals = crawler.signals
         self.logformatter = crawler.logformatter
@@ -84,7 +91,7 @@ class Scraper(object):
         """Open the given spider for scraping and allocate resources for it"""
         ## 打开一个给定的爬虫，用于抓取和分配资源
 
-        self.slot = Slot()
+        self.slot = Slot(max_offloaded=self.callback_pool.max_pending)
         ## 调用所有 pipeline 的 open_spider 方法
         ## 这里的工作主要是 scraper 调用所用 pipeline 的 open_spider 方法，即，如果我们
         ## 定义了多个 pipeline 输出类，重写 open_spider 方法，以完成每个 pipeline 处理
@@ -97,6 +104,7 @@ class Scraper(object):
 
         slot = self.slot
         slot.closing = defer.Deferred()
+        slot.closing.addBoth(lambda _: self.callback_pool.close() or _)
         slot.closing.addCallback(self.itemproc.close_spider)
         self._check_if_closing(spider, slot)
         return slot.closing
@@ -165,9 +173,21 @@ class Scraper(object):
         ## 回调爬虫模块
 
         result.request = request
+        callback = request.callback or spider.parse
+        ## CPU 密集型的回调交由进程池执行
+        if self.callback_pool.wants(result, request, callback, spider):
+            dfd = self.callback_pool.call(result, callback, spider)
+            if dfd is not None:
+                slot = self.slot
+                slot.offloaded += 1
+
+                def _offload_done(_):
+                    slot.offloaded -= 1
+                    return _
+                return dfd.addBoth(_offload_done)
         dfd = defer_result(result)
         ## 注册回调，如果回调未定义则调用爬虫模块的 parse 方法
-        dfd.addCallbacks(request.callback or spider.parse, request.errback)
+        dfd.addCallbacks(callback, request.errback)
         return dfd.addCallback(iterate_spider_output)
 
     def handle_spider_error(self, _failure, request, response, spider):
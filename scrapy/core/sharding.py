@@ -0,0 +1,472 @@
+"""
+Multi-process crawls.
+
+When the ``CRAWL_WORKERS`` setting is greater than 1, a crawler does not run
+its spider itself: its engine is a :class:`ShardedEngine`, which starts that
+many worker processes, each one running the spider with a regular engine.
+
+The requests are partitioned between workers by a consistent hash of their
+download slot key (the host name, unless the ``download_slot`` meta key is
+set), so all requests to a given site are downloaded, deduplicated and
+throttled by the same worker. Requests returned by spider callbacks which
+belong to another worker are sent to it through the parent process (see
+:class:`~scrapy.spidermiddlewares.sharding.ShardingMiddleware`); start
+requests are generated by every worker, which keeps only its own.
+
+Workers report to the parent when they are idle; once all of them are idle
+with no request in transit, the parent tells them to close their spider. The
+stats of all workers are merged into the stats of the parent crawler, which
+are dumped once the crawl is finished.
+
+Spider classes must be importable by the worker processes, and requests sent
+to other workers must be serializable like the requests of persistent jobs
+(see :func:`~scrapy.utils.reqser.request_to_dict`). Every worker runs its own
+item pipelines; feed exports are not supported, as all workers would write to
+the same feed. Each worker gets its own ``shard-<n>`` subdirectory of
+``JOBDIR`` and ``HTTPCACHE_DIR``, and its own ``LOG_FILE`` (``<name>.shard-<n>``
+plus the extension), since those cannot be shared by several processes. A job
+must be resumed with the number of workers it was started with.
+"""
+import os
+import sys
+import pickle
+import struct
+import hashlib
+import logging
+from datetime import datetime
+
+from twisted.internet import defer, protocol, reactor
+from twisted.protocols.basic import Int32StringReceiver
+
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.misc import load_object
+from scrapy.utils.python import to_bytes
+from scrapy.utils.reqser import request_to_dict, request_from_dict
+
+logger = logging.getLogger(__name__)
+
+# file descriptors of the pipes between the parent and the worker processes,
+# as seen by the workers
+_WORKER_OUT = 3
+_WORKER_IN = 4
+
+_WORKER_COMMAND = 'from scrapy.core.sharding import worker_main; worker_main()'
+
+
+def shard_for(key, shards):
+    """Return the shard (between 0 and ``shards - 1``) of the given key.
+
+    Uses the jump consistent hash of Lamping and Veach: when the number of
+    shards grows from n to n + 1, only 1/(n + 1) of the keys move.
+    """
+    h = int(hashlib.md5(to_bytes(key)).hexdigest()[:16], 16)
+    b, j = -1, 0
+    while j < shards:
+        b = j
+        h = (h * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((h >> 33) + 1)))
+    return b
+
+
+def request_shard_key(request):
+    """Key used to assign ``request`` to a shard: its download slot key,
+    without resolving host names (workers do not share their DNS cache)"""
+    if 'download_slot' in request.meta:
+        return request.meta['download_slot']
+    return urlparse_cached(request).hostname or ''
+
+
+def shard_settings(settings, index):
+    """Return the settings of worker ``index`` which differ from the settings
+    of the crawl: the paths that only one process can write to"""
+    overrides = {}
+    for name in ('JOBDIR', 'HTTPCACHE_DIR'):
+        if settings[name]:
+            overrides[name] = os.path.join(settings[name], 'shard-%d' % index)
+    if settings['LOG_FILE']:
+        root, ext = os.path.splitext(settings['LOG_FILE'])
+        overrides['LOG_FILE'] = '%s.shard-%d%s' % (root, index, ext)
+    return overrides
+
+
+def check_settings(settings):
+    """Raise ``ValueError`` if the crawl cannot run in ``CRAWL_WORKERS``
+    worker processes with these settings"""
+    workers = settings.getint('CRAWL_WORKERS')
+    if settings['FEED_URI']:
+        raise ValueError("Feed exports are not supported in multi-process "
+                         "crawls: all workers would write to %s"
+                         % settings['FEED_URI'])
+    jobdir = settings['JOBDIR']
+    if not jobdir:
+        return
+    # requests are partitioned by the number of workers, a job cannot be
+    # resumed with a different one
+    path = os.path.join(jobdir, 'crawl.workers')
+    if os.path.exists(path):
+        with open(path) as f:
+            previous = int(f.read().strip() or 0)
+        if previous != workers:
+            raise ValueError("JOBDIR %s was crawled with %d workers, it must be "
+                             "resumed with the same number of workers, not %d"
+                             % (jobdir, previous, workers))
+    else:
+        if not os.path.exists(jobdir):
+            os.makedirs(jobdir)
+        with open(path, 'w') as f:
+            f.write('%d\n' % workers)
+
+
+def merge_stats(stats_list):
+    """Merge the stats of several workers: numbers are added up (keys with
+    ``max`` or ``min`` in their name keep the highest or lowest value),
+    ``start_time`` keeps the earliest date and other dates the latest one.
+    Other values are taken from the first worker which has them."""
+    merged = {}
+    for stats in stats_list:
+        for key, value in stats.items():
+            if key not in merged:
+                merged[key] = value
+                continue
+            current = merged[key]
+            if isinstance(value, datetime) and isinstance(current, datetime):
+                merged[key] = min(current, value) if key == 'start_time' \
+                    else max(current, value)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool) \
+                    and isinstance(current, (int, float)):
+                if 'max' in key:
+                    merged[key] = max(current, value)
+                elif 'min' in key:
+                    merged[key] = min(current, value)
+                else:
+                    merged[key] = current + value
+    return merged
+
+
+class _MessageProtocol(Int32StringReceiver):
+    """Length prefixed pickled messages"""
+
+    MAX_LENGTH = 2 ** 31 - 1
+
+    def __init__(self, handler, on_lost=None):
+        self.handler = handler
+        self.on_lost = on_lost
+
+    def stringReceived(self, data):
+        self.handler(pickle.loads(data))
+
+    def send(self, message):
+        self.sendString(pickle.dumps(message, protocol=2))
+
+    def connectionLost(self, reason):
+        if self.on_lost is not None:
+            self.on_lost(reason)
+
+
+class _ChildPipe(object):
+    """Transport writing to the input pipe of a worker process"""
+
+    def __init__(self, process):
+        self.process = process
+
+    def write(self, data):
+        self.process.writeToChild(_WORKER_IN, data)
+
+    def writeSequence(self, seq):
+        self.write(b''.join(seq))
+
+
+class _WorkerProcess(protocol.ProcessProtocol):
+    ## 父进程中代表一个 worker 进程的对象，负责与其收发消息
+
+    def __init__(self, engine, index, config):
+        self.engine = engine
+        self.index = index
+        self.config = config
+        self.messages = _MessageProtocol(self._message_received)
+        self.idle = False
+        self.received = 0   # requests the worker reported as received
+        self.forwarded = 0  # requests sent to the worker
+        self.stats = None
+        self.ended = False
+
+    def connectionMade(self):
+        self.messages.makeConnection(_ChildPipe(self.transport))
+        self.send(('start', self.config))
+
+    def send(self, message):
+        if not self.ended:
+            self.messages.send(message)
+
+    def childDataReceived(self, childFD, data):
+        if childFD == _WORKER_OUT:
+            self.messages.dataReceived(data)
+
+    def _message_received(self, message):
+        self.engine.message_received(self, message)
+
+    def processEnded(self, reason):
+        self.ended = True
+        self.engine.worker_ended(self, reason)
+
+
+class ShardedEngine(object):
+    """Engine of the parent process of a multi-process crawl.
+
+    It has the interface of :class:`~scrapy.core.engine.ExecutionEngine`
+    used by :class:`~scrapy.crawler.Crawler`, but runs the spider in
+    ``CRAWL_WORKERS`` worker processes.
+    """
+
+    def __init__(self, crawler, spider_args=(), spider_kwargs=None):
+        self.crawler = crawler
+        self.spider_args = (spider_args, spider_kwargs or {})
+        self.settings = crawler.settings
+        self.signals = crawler.signals
+        self.workers_count = self.settings.getint('CRAWL_WORKERS')
+        self.workers = []
+        self.running = False
+        self.stopping = False
+        self.spider = None
+        self._closewait = None
+
+    def open_spider(self, spider, start_requests=(), close_if_idle=True):
+        # start requests are generated by the workers
+        spidercls = type(spider)
+        if spidercls.__module__ == '__main__':
+            raise ValueError("Spiders of multi-process crawls must be "
+                             "importable, %s is defined in __main__"
+                             % spidercls.__name__)
+        check_settings(self.crawler.settings)
+        self.spider = spider
+        self.crawler.stats.open_spider(spider)
+        settings = pickle.dumps(self.crawler.settings, protocol=2)
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.pathsep.join(p or os.curdir for p in sys.path)
+        for index in range(self.workers_count):
+            config = {
+                'spidercls': '%s.%s' % (spidercls.__module__, spidercls.__name__),
+                'args': self.spider_args,
+                'settings': settings,
+                'shard': index,
+                'workers': self.workers_count,
+            }
+            worker = _WorkerProcess(self, index, config)
+            reactor.spawnProcess(
+                worker, sys.executable, [sys.executable, '-c', _WORKER_COMMAND],
+                env=env, path=os.getcwd(),
+                childFDs={1: 1, 2: 2, _WORKER_OUT: 'r', _WORKER_IN: 'w'})
+            self.workers.append(worker)
+        logger.info("Started %(count)d crawl workers",
+                    {'count': self.workers_count}, extra={'spider': spider})
+        return defer.succeed(None)
+
+    @defer.inlineCallbacks
+    def start(self):
+        assert not self.running, "Engine already running"
+        yield self.signals.send_catch_log_deferred(signal=signals.engine_started)
+        self.running = True
+        self._closewait = defer.Deferred()
+        if not any(not w.ended for w in self.workers):
+            self._finish()
+        yield self._closewait
+
+    def stop(self):
+        """Ask the workers to stop gracefully, and wait for them to finish"""
+        assert self.running, "Engine not running"
+        self.stopping = True
+        for worker in self.workers:
+            worker.send(('shutdown',))
+        return self._wait()
+
+    def close(self):
+        if self.running:
+            return self.stop()
+        for worker in self.workers:
+            if not worker.ended:
+                worker.transport.signalProcess('TERM')
+        return defer.succeed(None)
+
+    def _wait(self):
+        d = defer.Deferred()
+
+        def _finished(result):
+            d.callback(None)
+            return result
+
+        self._closewait.addBoth(_finished)
+        return d
+
+    def message_received(self, worker, message):
+        kind = message[0]
+        if kind == 'request':
+            target = self.workers[message[1]]
+            if target.ended or self.stopping:
+                logger.debug("Dropped request sent to stopping worker %(shard)d",
+                             {'shard': target.index}, extra={'spider': self.spider})
+                self.crawler.stats.inc_value('shard/requests_dropped', spider=self.spider)
+                return
+            target.forwarded += 1
+            target.send(('request', message[2]))
+        elif kind == 'idle':
+            worker.idle = True
+            worker.received = message[1]
+            self._check_idle()
+        elif kind == 'stats':
+            worker.stats = message[1]
+
+    def _check_idle(self):
+        if self.stopping:
+            return
+        for worker in self.workers:
+            if not worker.ended and \
+                    (not worker.idle or worker.received != worker.forwarded):
+                return
+        self.stopping = True
+        for worker in self.workers:
+            worker.send(('stop',))
+
+    def worker_ended(self, worker, reason):
+        if worker.stats is None:
+            logger.error("Crawl worker %(shard)d ended without reporting its "
+                         "stats: %(reason)s",
+                         {'shard': worker.index, 'reason': reason.value},
+                         extra={'spider': self.spider})
+            self.crawler.stats.inc_value('shard/workers_failed', spider=self.spider)
+        if all(w.ended for w in self.workers):
+            if self.running:
+                self._finish()
+        else:
+            # a worker may have failed while the others wait for it
+            self._check_idle()
+
+    def _finish(self):
+        stats = merge_stats([w.stats for w in self.workers if w.stats] +
+                            [self.crawler.stats.get_stats(self.spider)])
+        stats['shard/workers'] = self.workers_count
+        reasons = set(s.get('finish_reason') for s in
+                      (w.stats for w in self.workers if w.stats))
+        reasons.discard('finished')
+        reason = reasons.pop() if len(reasons) == 1 else 'finished'
+        self.crawler.stats.set_stats(stats, spider=self.spider)
+        self.crawler.stats.close_spider(self.spider, reason=reason)
+        self.running = False
+        d = self.signals.send_catch_log_deferred(signal=signals.engine_stopped)
+        d.addBoth(lambda _: self._closewait.callback(None))
+
+
+class ShardWorker(object):
+    """Worker side of a multi-process crawl, available as ``crawler.shard``
+    in worker processes"""
+
+    def __init__(self, crawler, index, count, stdin=_WORKER_IN, stdout=_WORKER_OUT):
+        from twisted.internet.stdio import StandardIO
+        self.crawler = crawler
+        self.index = index
+        self.count = count
+        self.received = 0
+        self.stopping = False
+        # requests received before the spider is opened
+        self._pending = []
+        self._lost = defer.Deferred()
+        self.messages = _MessageProtocol(self._message_received,
+                                         lambda _: self._lost.callback(None))
+        StandardIO(self.messages, stdin=stdin, stdout=stdout)
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_idle, signal=signals.spider_idle)
+        # report the stats before the reactor stops, however the crawl ends
+        reactor.addSystemEventTrigger('before', 'shutdown', self.close)
+
+    def owns(self, request):
+        """Whether ``request`` belongs to this worker"""
+        return shard_for(request_shard_key(request), self.count) == self.index
+
+    def route(self, request, spider):
+        """Send ``request`` to the worker it belongs to. Return ``False`` if
+        the request cannot be serialized, so it should be kept here."""
+        try:
+            message = ('request', shard_for(request_shard_key(request), self.count),
+                       request_to_dict(request, spider))
+            self.messages.send(message)
+        except Exception as e:
+            logger.debug("Keeping unserializable request %(request)s in "
+                         "worker %(shard)d: %(error)s",
+                         {'request': request, 'shard': self.index, 'error': e},
+                         extra={'spider': spider})
+            return False
+        return True
+
+    def _message_received(self, message):
+        kind = message[0]
+        engine = self.crawler.engine
+        spider = self.crawler.spider
+        if kind == 'request':
+            self.received += 1
+            if self._pending is not None:
+                self._pending.append(message[1])
+            else:
+                self._crawl(message[1], spider)
+        elif kind == 'stop':
+            self.stopping = True
+            if self._pending is None and engine.slot is not None \
+                    and engine.spider_is_idle(spider):
+                engine.close_spider(spider, reason='finished')
+        elif kind == 'shutdown':
+            self.stopping = True
+            self.crawler.stop()
+
+    def _crawl(self, d, spider):
+        self.crawler.stats.inc_value('shard/requests_received', spider=spider)
+        self.crawler.engine.crawl(request_from_dict(d, spider), spider)
+
+    def spider_opened(self, spider):
+        pending, self._pending = self._pending, None
+        for d in pending:
+            self._crawl(d, spider)
+
+    def spider_idle(self, spider):
+        if self.stopping:
+            return
+        self.messages.send(('idle', self.received))
+        raise DontCloseSpider
+
+    def close(self):
+        """Send the stats to the parent process and close the pipes"""
+        if self.messages.transport.disconnecting:
+            return
+        self.messages.send(('stats', self.crawler.stats.get_stats()))
+        self.messages.transport.loseConnection()
+        return self._lost
+
+
+def _read_message(fd):
+    def read(size):
+        data = b''
+        while len(data) < size:
+            chunk = os.read(fd, size - len(data))
+            if not chunk:
+                raise EOFError("Crawl worker input closed")
+            data += chunk
+        return data
+    size, = struct.unpack('!i', read(4))
+    return pickle.loads(read(size))
+
+
+def worker_main():
+    """Entry point of the worker processes"""
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.settings import Settings
+    _, config = _read_message(_WORKER_IN)
+    # settings keep their priorities, but not the frozen state of the parent
+    settings = Settings(pickle.loads(config['settings']))
+    for name, value in shard_settings(settings, config['shard']).items():
+        settings.set(name, value, priority=settings.getpriority(name))
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(load_object(config['spidercls']))
+    crawler.shard = ShardWorker(crawler, config['shard'], config['workers'])
+    args, kwargs = config['args']
+    process.crawl(crawler, *args, **kwargs)
+    process.start()
+    sys.exit(1 if process.bootstrap_failed else 0)
@@ -9,14 +9,15 @@ from zope.interface.verify import verifyClass, DoesNotImplement
 
 from scrapy import Spider
 from scrapy.core.engine import ExecutionEngine
-from scrapy.resolver import CachingThreadedResolver
+from scrapy.core.sharding import ShardedEngine
+from scrapy.resolver import CachingResolver
 from scrapy.interfaces import ISpiderLoader
 from scrapy.extension import ExtensionManager
 from scrapy.settings import overridden_settings, Settings
 from scrapy.signalmanager import SignalManager
 from scrapy.exceptions import ScrapyDeprecationWarning
 from scrapy.utils.ossignal import install_shutdown_handlers, signal_names
-from scrapy.utils.misc import load_object
+from scrapy.utils.misc import load_object, create_instance
 from scrapy.utils.log import (
     LogCounterHandler, configure_logging, log_scrapy_info,
     get_scrapy_root_handler, install_scrapy_root_handler)
@@ -68,6 +69,11 @@ class Crawler(object):
         ## 当产生引擎停止信号时，将会由 __remove_handler 处理器进行处理
         self.signals.connect(self.__remove_handler, signals.engine_stopped)
 
+        ## 请求指纹生成器，供需要请求指纹的组件共用
+        self.request_fingerprinter = create_instance(
+            load_object(self.settings['REQUEST_FINGERPRINTER_CLASS']),
+            settings=self.settings, crawler=self)
+
         lf_cls = load_object(self.settings['LOG_FORMATTER'])
         ## 初始化日志格式化器实例
         self.logformatter = lf_cls.from_crawler(self)
@@ -81,6 +87,10 @@ class Crawler(object):
         self.spider = None
         ## 执行引擎，用来协调调度器、下载器、spiders 之间的爬取逻辑
         self.engine = None
+        ## 与其他 crawler 共用的下载器（见 CrawlerRunner 的 SHARED_DOWNLOADER 配置）
+        self.shared_downloader = None
+        ## 多进程爬取时，worker 进程中的 ShardWorker 对象（见 CRAWL_WORKERS 配置）
+        self.shard = None
 
     @property
     def spiders(self):
@@ -103,6 +113,7 @@ class Crawler(object):
         self.crawling = True
 
         try:
+            self._spider_args = (args, kwargs)
             ## 创建爬虫实例
             self.spider = self._create_spider(*args, **kwargs)
             ## 创建引擎
@@ -135,6 +146,9 @@ class Crawler(object):
 
     def _create_engine(self):
         ## 返回一个执行引擎类的实例
+        ## 配置了多个 worker 进程时（且当前不是 worker 进程），由 ShardedEngine 启动并协调各 worker
+        if self.shard is None and self.settings.getint('CRAWL_WORKERS') > 1:
+            return ShardedEngine(self, *self._spider_args)
         return ExecutionEngine(self, lambda _: self.stop())
 
     @defer.inlineCallbacks
@@ -176,6 +190,8 @@ class CrawlerRunner(object):
         self._crawlers = set()
         self._active = set()
         self.bootstrap_failed = False
+        ## 所有 crawler 共用的下载器（开启 SHARED_DOWNLOADER 时）
+        self.shared_downloader = None
 
     @property
     def spiders(self):
@@ -220,6 +236,8 @@ class CrawlerRunner(object):
     def _crawl(self, crawler, *args, **kwargs):
         ## 向 crawlers 集合中添加 crawler
         self.crawlers.add(crawler)
+        if self.settings.getbool('SHARED_DOWNLOADER'):
+            self._attach_shared_downloader(crawler)
         ## 调用 Crawler 类中的 crawl 方法
         d = crawler.crawl(*args, **kwargs)
         self._active.add(d)
@@ -229,10 +247,26 @@ class CrawlerRunner(object):
             self.crawlers.discard(crawler)
             self._active.discard(d)
             self.bootstrap_failed |= not getattr(crawler, 'spider', None)
+            if crawler.shared_downloader is not None:
+                return self._detach_shared_downloader(crawler, result)
             return result
 
         return d.addBoth(_done)
 
+    def _attach_shared_downloader(self, crawler):
+        if self.shared_downloader is None:
+            from scrapy.core.downloader.shared import SharedDownloader
+            self.shared_downloader = SharedDownloader(self.settings.frozencopy())
+        self.shared_downloader.attach(crawler)
+
+    def _detach_shared_downloader(self, crawler, result):
+        downloader = crawler.shared_downloader
+        if downloader.detach(crawler) or downloader is not self.shared_downloader:
+            return result
+        self.shared_downloader = None
+        d = defer.maybeDeferred(downloader.close_shared)
+        return d.addBoth(lambda _: result)
+
     def create_crawler(self, crawler_or_spidercls):
         """
         Return a :class:`~scrapy.crawler.Crawler` object.
@@ -368,15 +402,7 @@ class CrawlerProcess(CrawlerRunner):
         reactor.run(installSignalHandlers=False)  # blocking call
 
     def _get_dns_resolver(self):
-        if self.settings.getbool('DNSCACHE_ENABLED'):
-            cache_size = self.settings.getint('DNSCACHE_SIZE')
-        else:
-            cache_size = 0
-        return CachingThreadedResolver(
-            reactor=reactor,
-            cache_size=cache_size,
-            timeout=self.settings.getfloat('DNS_TIMEOUT')
-        )
+        return CachingResolver.from_settings(self.settings, reactor)
 
     def _graceful_stop_reactor(self):
         d = self.stop()
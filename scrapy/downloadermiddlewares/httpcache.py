@@ -1,3 +1,4 @@
+import logging
 from email.utils import formatdate
 from twisted.internet import defer
 from twisted.internet.error import TimeoutError, DNSLookupError, \
@@ -7,6 +8,9 @@ from twisted.web.client import ResponseFailed
 from scrapy import signals
 from scrapy.exceptions import NotConfigured, IgnoreRequest
 from scrapy.utils.misc import load_object
+from scrapy.utils.log import failure_to_exc_info
+
+logger = logging.getLogger(__name__)
 
 
 class HttpCacheMiddleware(object):
@@ -30,20 +34,24 @@ class HttpCacheMiddleware(object):
                            ConnectionLost, TCPTimedOutError, ResponseFailed,
                            IOError)
 
-    def __init__(self, settings, stats):
+    def __init__(self, settings, stats, crawler=None):
         if not settings.getbool('HTTPCACHE_ENABLED'):
             raise NotConfigured
         ## 缓存策略
         self.policy = load_object(settings['HTTPCACHE_POLICY'])(settings)
-        ## 缓存存储方式
-        self.storage = load_object(settings['HTTPCACHE_STORAGE'])(settings)
+        ## 缓存存储方式：若存储类定义了 from_crawler，则通过它创建（以共用请求指纹生成器等组件）
+        storagecls = load_object(settings['HTTPCACHE_STORAGE'])
+        if crawler is not None and hasattr(storagecls, 'from_crawler'):
+            self.storage = storagecls.from_crawler(crawler)
+        else:
+            self.storage = storagecls(settings)
         self.ignore_missing = settings.getbool('HTTPCACHE_IGNORE_MISSING')
         ## 统计
         self.stats = stats
 
     @classmethod
     def from_crawler(cls, crawler):
-        o = cls(crawler.settings, crawler.stats)
+        o = cls(crawler.settings, crawler.stats, crawler)
         crawler.signals.connect(o.spider_opened, signal=signals.spider_opened)
         crawler.signals.connect(o.spider_closed, signal=signals.spider_closed)
         return o
@@ -52,7 +60,7 @@ class HttpCacheMiddleware(object):
         self.storage.open_spider(spider)
 
     def spider_closed(self, spider):
-        self.storage.close_spider(spider)
+        return self.storage.close_spider(spider)
 
     def process_request(self, request, spider):
         if request.meta.get('dont_cache', False):
@@ -66,7 +74,14 @@ class HttpCacheMiddleware(object):
 
         # Look for cached response and check if expired
         ## 查询被缓存的响应，并检查其是否过期
+        ## 存储后端可以返回 Deferred（磁盘 I/O 不在 reactor 线程中进行）
         cachedresponse = self.storage.retrieve_response(spider, request)
+        if isinstance(cachedresponse, defer.Deferred):
+            return cachedresponse.addCallback(self._process_cached_response,
+                                              request, spider)
+        return self._process_cached_response(cachedresponse, request, spider)
+
+    def _process_cached_response(self, cachedresponse, request, spider):
         if cachedresponse is None:
             self.stats.inc_value('httpcache/miss', spider=spider)
             if self.ignore_missing:
@@ -90,8 +105,9 @@ class HttpCacheMiddleware(object):
             return response
 
         # Skip cached responses and uncacheable requests
-        ## 跳过已被缓存的响应和不可缓存的请求
-        if 'cached' in response.flags or '_dont_cache' in request.meta:
+        ## 跳过已被缓存的响应和不可缓存的请求（以及响应体被流式交给消费者的响应）
+        if 'cached' in response.flags or '_dont_cache' in request.meta \
+                or 'streamed' in response.flags:
             request.meta.pop('_dont_cache', None)
             return response
 
@@ -124,6 +140,16 @@ class HttpCacheMiddleware(object):
     def _cache_response(self, spider, response, request, cachedresponse):
         if self.policy.should_cache_response(response, request):
             self.stats.inc_value('httpcache/store', spider=spider)
-            self.storage.store_response(spider, request, response)
+            dfd = self.storage.store_response(spider, request, response)
+            if isinstance(dfd, defer.Deferred):
+                # do not hold the response back while it is being written
+                dfd.addErrback(self._store_failed, request, spider)
         else:
             self.stats.inc_value('httpcache/uncacheable', spider=spider)
+
+    def _store_failed(self, failure, request, spider):
+        self.stats.inc_value('httpcache/store_error', spider=spider)
+        logger.error("Error storing %(request)s in the HTTP cache",
+                     {'request': request},
+                     exc_info=failure_to_exc_info(failure),
+                     extra={'spider': spider})
@@ -1,9 +1,12 @@
-import zlib
+import logging
 
 from scrapy.utils.gz import gunzip
 from scrapy.http import Response, TextResponse
 from scrapy.responsetypes import responsetypes
-from scrapy.exceptions import NotConfigured
+from scrapy.exceptions import NotConfigured, IgnoreRequest
+from scrapy.core.downloader.stream import decompress, DecompressionMaxSizeExceeded
+
+logger = logging.getLogger(__name__)
 
 
 ACCEPTED_ENCODINGS = [b'gzip', b'deflate']
@@ -20,11 +23,18 @@ class HttpCompressionMiddleware(object):
     sent/received from web sites"""
     ## 该中间件允许对从 web sites 发送或接收的数据进行压缩处理（gzip，deflate）
 
+    def __init__(self, stats=None, maxsize=0, warnsize=0):
+        self.stats = stats
+        self._maxsize = maxsize
+        self._warnsize = warnsize
+
     @classmethod
     def from_crawler(cls, crawler):
         if not crawler.settings.getbool('COMPRESSION_ENABLED'):
             raise NotConfigured
-        return cls()
+        return cls(crawler.stats,
+                   crawler.settings.getint('DOWNLOAD_MAXSIZE'),
+                   crawler.settings.getint('DOWNLOAD_WARNSIZE'))
 
     def process_request(self, request, spider):
         request.headers.setdefault('Accept-Encoding',
@@ -34,11 +44,35 @@ class HttpCompressionMiddleware(object):
 
         if request.method == 'HEAD':
             return response
+        if 'streamed' in response.flags:
+            # the body went to a consumer, see scrapy.core.downloader.stream
+            return response
         if isinstance(response, Response):
             content_encoding = response.headers.getlist('Content-Encoding')
             if content_encoding:
                 encoding = content_encoding.pop()
-                decoded_body = self._decode(response.body, encoding.lower())
+                ## 解压后的大小同样受 DOWNLOAD_MAXSIZE 限制，超出时立即中止解压，以防压缩炸弹
+                maxsize = request.meta.get('download_maxsize',
+                    getattr(spider, 'download_maxsize', self._maxsize))
+                warnsize = request.meta.get('download_warnsize',
+                    getattr(spider, 'download_warnsize', self._warnsize))
+                try:
+                    decoded_body = self._decode(response.body,
+                                                encoding.lower(), maxsize)
+                except DecompressionMaxSizeExceeded:
+                    if self.stats:
+                        self.stats.inc_value('httpcompression/maxsize_exceeded',
+                                             spider=spider)
+                    raise IgnoreRequest(
+                        "Ignored response %s: its body (%d bytes compressed) "
+                        "exceeded the download max size (%d bytes) during "
+                        "decompression" % (response, len(response.body), maxsize))
+                if warnsize and len(decoded_body) > warnsize:
+                    logger.warning("Decompressed size (%(size)s) of %(response)s "
+                                   "larger than download warn size (%(warnsize)s)",
+                                   {'size': len(decoded_body), 'response': response,
+                                    'warnsize': warnsize}, extra={'spider': spider})
+                self._update_stats(response.body, decoded_body, spider)
                 respcls = responsetypes.from_args(headers=response.headers, \
                     url=response.url, body=decoded_body)
                 kwargs = dict(cls=respcls, body=decoded_body)
@@ -52,22 +86,31 @@ class HttpCompressionMiddleware(object):
 
         return response
 
-    def _decode(self, body, encoding):
-        ## 解压缩
+    def _update_stats(self, body, decoded_body, spider):
+        if not self.stats:
+            return
+        self.stats.inc_value('httpcompression/response_count', spider=spider)
+        self.stats.inc_value('httpcompression/compressed_bytes', len(body),
+                             spider=spider)
+        self.stats.inc_value('httpcompression/response_bytes',
+                             len(decoded_body), spider=spider)
+        if body:
+            ratio = round(float(len(decoded_body)) / len(body), 2)
+            self.stats.max_value('httpcompression/max_ratio', ratio,
+                                 spider=spider)
+
+    def _decode(self, body, encoding, maxsize=0):
+        ## 分块增量解压，解压后的大小超过 maxsize（不为 0 时）即抛出 DecompressionMaxSizeExceeded
 
         if encoding == b'gzip' or encoding == b'x-gzip':
-            body = gunzip(body)
-
-        if encoding == b'deflate':
-            try:
-                body = zlib.decompress(body)
-            except zlib.error:
-                # ugly hack to work with raw deflate content that may
-                # be sent by microsoft servers. For more information, see:
-                # http://carsten.codimi.de/gzip.yaws/
-                # http://www.port80software.com/200ok/archive/2005/10/31/868.aspx
-                # http://www.gzip.org/zlib/zlib_faq.html#faq38
-                body = zlib.decompress(body, -15)
-        if encoding == b'br' and b'br' in ACCEPTED_ENCODINGS:
-            body = brotli.decompress(body)
+            body = gunzip(body, maxsize)
+
+        if encoding == b'deflate' or \
+                (encoding == b'br' and b'br' in ACCEPTED_ENCODINGS):
+            # raw deflate content, sent by some microsoft servers, is
+            # handled by the decoder. For more information, see:
+            # http://carsten.codimi.de/gzip.yaws/
+            # http://www.port80software.com/200ok/archive/2005/10/31/868.aspx
+            # http://www.gzip.org/zlib/zlib_faq.html#faq38
+            body = decompress(body, encoding, maxsize)
         return body
@@ -27,7 +27,9 @@ class RobotsTxtMiddleware(object):
 
         self.crawler = crawler
         self._useragent = crawler.settings.get('USER_AGENT')
-        self._parsers = {}
+        # crawlers using a shared downloader share their robots.txt cache
+        shared = getattr(crawler, 'shared_downloader', None)
+        self._parsers = shared.robotstxt_parsers if shared is not None else {}
 
     @classmethod
     def from_crawler(cls, crawler):
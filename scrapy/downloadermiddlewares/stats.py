@@ -1,27 +1,30 @@
 from scrapy.exceptions import NotConfigured
-from scrapy.utils.request import request_httprepr
-from scrapy.utils.response import response_httprepr
+from scrapy.utils.request import request_httprepr_size
+from scrapy.utils.response import response_httprepr_size
 from scrapy.utils.python import global_object_name
 
 
 class DownloaderStats(object):
     ## DownloaderStats：用于收集从所有经由 requests, responses 和 exceptions 的统计数据
 
-    def __init__(self, stats):
+    def __init__(self, stats, per_slot=False):
         self.stats = stats
+        self.per_slot = per_slot
 
     @classmethod
     def from_crawler(cls, crawler):
         if not crawler.settings.getbool('DOWNLOADER_STATS'):
             raise NotConfigured
-        return cls(crawler.stats)
+        return cls(crawler.stats,
+                   per_slot=crawler.settings.getbool('DOWNLOADER_STATS_PER_SLOT'))
 
     def process_request(self, request, spider):
         ## 请求数量的统计
         self.stats.inc_value('downloader/request_count', spider=spider)
         ## 请求方法数量的统计
         self.stats.inc_value('downloader/request_method_count/%s' % request.method, spider=spider)
-        reqlen = len(request_httprepr(request))
+        ## 字节数由请求头和请求体的长度直接算出，而不是构造完整的 HTTP 报文
+        reqlen = request_httprepr_size(request)
         self.stats.inc_value('downloader/request_bytes', reqlen, spider=spider)
 
     def process_response(self, request, response, spider):
@@ -29,8 +32,21 @@ class DownloaderStats(object):
         self.stats.inc_value('downloader/response_count', spider=spider)
         ## 响应状态码数量的统计
         self.stats.inc_value('downloader/response_status_count/%s' % response.status, spider=spider)
-        reslen = len(response_httprepr(response))
+        reslen = response_httprepr_size(response)
         self.stats.inc_value('downloader/response_bytes', reslen, spider=spider)
+        self.stats.inc_value('downloader/response_status_bytes/%s' % response.status,
+                             reslen, spider=spider)
+        ## 实际从网络接收的字节数（压缩的响应体按压缩后的大小计），由 HTTP/1.1 下载处理器记录
+        wirelen = request.meta.get('download_wire_bytes')
+        if wirelen is not None:
+            self.stats.inc_value('downloader/response_wire_bytes', wirelen, spider=spider)
+        if self.per_slot and 'download_slot' in request.meta:
+            slot = request.meta['download_slot']
+            self.stats.inc_value('downloader/slot_response_bytes/%s' % slot,
+                                 reslen, spider=spider)
+            if wirelen is not None:
+                self.stats.inc_value('downloader/slot_response_wire_bytes/%s' % slot,
+                                     wirelen, spider=spider)
         return response
 
     def process_exception(self, request, exception, spider):
@@ -1,9 +1,12 @@
 from __future__ import print_function
 import os
 import logging
+from binascii import hexlify, unhexlify
 
 from scrapy.utils.job import job_dir
-from scrapy.utils.request import referer_str, request_fingerprint
+from scrapy.utils.fpstore import FingerprintStore, BloomFilter
+from scrapy.utils.python import to_native_str
+from scrapy.utils.request import referer_str, RequestFingerprinter
 
 class BaseDupeFilter(object):
     ## 过滤器基类，子类可重写一下方法
@@ -15,6 +18,11 @@ class BaseDupeFilter(object):
     def request_seen(self, request):
         return False
 
+    def request_seen_many(self, requests):
+        """Return a list of booleans telling whether each of the given
+        requests was already seen"""
+        return [bool(self.request_seen(r)) for r in requests]
+
     def open(self):  # can return deferred
         ## 可重写，完成过滤器的初始化工作
         pass
@@ -31,8 +39,10 @@ class RFPDupeFilter(BaseDupeFilter):
     """Request Fingerprint duplicates filter"""
     ## 请求指纹过滤器：过滤重复请求，可自定义过滤规则
 
-    def __init__(self, path=None, debug=False):
+    def __init__(self, path=None, debug=False, fingerprinter=None):
         self.file = None
+        ## 请求指纹生成器
+        self.fingerprinter = fingerprinter or RequestFingerprinter()
         ## 指纹集合，使用 set 进行去重，默认是基于内存
         self.fingerprints = set()
         ## 日志去重是否开启
@@ -48,11 +58,16 @@ class RFPDupeFilter(BaseDupeFilter):
             self.fingerprints.update(x.rstrip() for x in self.file)
 
     @classmethod
-    def from_settings(cls, settings):
+    def from_settings(cls, settings, fingerprinter=None):
         ## 基于配置创建一个请求指纹过滤器的实例
 
         debug = settings.getbool('DUPEFILTER_DEBUG')
-        return cls(job_dir(settings), debug)
+        return cls(job_dir(settings), debug, fingerprinter=fingerprinter)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls.from_settings(crawler.settings,
+                                 fingerprinter=crawler.request_fingerprinter)
 
     def request_seen(self, request):
         ## 根据请求生成一个请求指纹
@@ -67,8 +82,8 @@ class RFPDupeFilter(BaseDupeFilter):
             self.file.write(fp + os.linesep)
 
     def request_fingerprint(self, request):
-        ## 根据请求创建指纹，调用 utils.request 的 request_fingerprint 方法
-        return request_fingerprint(request)
+        ## 根据请求创建指纹（十六进制字符串），由共用的请求指纹生成器计算
+        return to_native_str(hexlify(self.fingerprinter.fingerprint(request)))
 
     def close(self, reason):
         if self.file:
@@ -87,3 +102,101 @@ class RFPDupeFilter(BaseDupeFilter):
             self.logdupes = False
 
         spider.crawler.stats.inc_value('dupefilter/filtered', spider=spider)
+
+
+class CompactRFPDupeFilter(RFPDupeFilter):
+    """Request Fingerprint duplicates filter storing binary digests
+
+    Fingerprints are kept as 20-byte digests in a
+    :class:`~scrapy.utils.fpstore.FingerprintStore` instead of a set of hex
+    strings. When ``JOBDIR`` is set the store lives in ``requests.seen.idx``
+    and is memory-mapped on resume rather than read back into memory.
+    """
+
+    def __init__(self, path=None, debug=False, fingerprinter=None):
+        self.file = None
+        self.fingerprinter = fingerprinter or RequestFingerprinter()
+        self.logdupes = True
+        self.debug = debug
+        self.logger = logging.getLogger(__name__)
+        storepath = os.path.join(path, 'requests.seen.idx') if path else None
+        fresh = not (storepath and os.path.exists(storepath))
+        self.fingerprints = FingerprintStore(storepath)
+        ## 兼容旧的 requests.seen 文本文件：首次使用时导入其中的十六进制指纹
+        if path and fresh:
+            seenpath = os.path.join(path, 'requests.seen')
+            if os.path.exists(seenpath):
+                with open(seenpath) as f:
+                    for line in f:
+                        line = line.rstrip()
+                        if line:
+                            self.fingerprints.add(unhexlify(line))
+
+    def request_seen(self, request):
+        return self.fingerprints.add(self.request_fingerprint(request))
+
+    def request_seen_many(self, requests):
+        return self.fingerprints.add_many(
+            self.request_fingerprint(r) for r in requests)
+
+    def request_fingerprint(self, request):
+        return self.fingerprinter.fingerprint(request)
+
+    def close(self, reason):
+        self.fingerprints.close()
+
+
+class BloomDupeFilter(CompactRFPDupeFilter):
+    """Probabilistic request fingerprint duplicates filter
+
+    Fingerprints are kept in a :class:`~scrapy.utils.fpstore.BloomFilter`
+    sized from the ``DUPEFILTER_EXPECTED_ITEMS`` and ``DUPEFILTER_FP_RATE``
+    settings, so a small fraction of new requests may be wrongly filtered as
+    duplicates. When ``JOBDIR`` is set the bit array is memory-mapped from
+    ``requests.seen.bloom``.
+    """
+
+    stats_interval = 1000
+
+    def __init__(self, path=None, debug=False, expected_items=1000000,
+                 fp_rate=0.001, stats=None, fingerprinter=None):
+        self.file = None
+        self.fingerprinter = fingerprinter or RequestFingerprinter()
+        self.logdupes = True
+        self.debug = debug
+        self.logger = logging.getLogger(__name__)
+        self.stats = stats
+        bloompath = os.path.join(path, 'requests.seen.bloom') if path else None
+        self.fingerprints = BloomFilter(bloompath, expected_items, fp_rate)
+
+    @classmethod
+    def from_settings(cls, settings, fingerprinter=None, stats=None):
+        return cls(job_dir(settings),
+                   debug=settings.getbool('DUPEFILTER_DEBUG'),
+                   expected_items=settings.getint('DUPEFILTER_EXPECTED_ITEMS'),
+                   fp_rate=settings.getfloat('DUPEFILTER_FP_RATE'),
+                   stats=stats, fingerprinter=fingerprinter)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls.from_settings(crawler.settings,
+                                 fingerprinter=crawler.request_fingerprinter,
+                                 stats=crawler.stats)
+
+    def request_seen(self, request):
+        seen = super(BloomDupeFilter, self).request_seen(request)
+        if not seen and not len(self.fingerprints) % self.stats_interval:
+            self._update_stats()
+        return seen
+
+    def _update_stats(self):
+        if self.stats is None:
+            return
+        bloom = self.fingerprints
+        self.stats.set_value('dupefilter/bloom/items', len(bloom))
+        self.stats.set_value('dupefilter/bloom/fill_ratio', bloom.fill_ratio)
+        self.stats.set_value('dupefilter/bloom/fp_rate', bloom.fp_rate)
+
+    def close(self, reason):
+        self._update_stats()
+        super(BloomDupeFilter, self).close(reason)
@@ -4,6 +4,7 @@ Extension for collecting core stats like items scraped and start/finish times
 import datetime
 
 from scrapy import signals
+from scrapy.resolver import dnscache
 
 class CoreStats(object):
     ## 该插件主要用来采集核心的统计数据（例如，已抓取的 items 数量，爬虫开始和结束时间等）
@@ -23,10 +24,20 @@ class CoreStats(object):
 
     def spider_opened(self, spider):
         self.stats.set_value('start_time', datetime.datetime.utcnow(), spider=spider)
+        self._dnscache_counts = self._get_dnscache_counts()
 
     def spider_closed(self, spider, reason):
         self.stats.set_value('finish_time', datetime.datetime.utcnow(), spider=spider)
         self.stats.set_value('finish_reason', reason, spider=spider)
+        ## DNS 缓存由进程内所有爬虫共用，这里记录本爬虫运行期间的命中情况
+        counts = self._get_dnscache_counts()
+        for key, start in zip(('hit', 'miss', 'negative_hit'), self._dnscache_counts):
+            end = counts.pop(0)
+            if end > start:
+                self.stats.set_value('dnscache/%s' % key, end - start, spider=spider)
+
+    def _get_dnscache_counts(self):
+        return [dnscache.hits, dnscache.misses, dnscache.negative_hits]
 
     def item_scraped(self, item, spider):
         self.stats.inc_value('item_scraped_count', spider=spider)
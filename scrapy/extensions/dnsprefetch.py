@@ -0,0 +1,116 @@
+"""
+DNS prefetch extension
+
+Resolves the host names of newly scheduled requests in the background, so the
+resolver cache is already warm when the downloader gets to those requests.
+
+See documentation in docs/topics/extensions.rst
+"""
+import logging
+import socket
+from collections import deque
+
+from twisted.internet import reactor
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.resolver import CachingResolver, dnscache
+from scrapy.utils.httpobj import urlparse_cached
+
+logger = logging.getLogger(__name__)
+
+
+class DnsPrefetch(object):
+    ## DNS 预解析扩展：在请求进入调度器时，提前解析其主机名并写入 DNS 缓存，
+    ## 这样下载器处理到这些请求时就不必再等待 DNS 查询
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool('DNS_PREFETCH_ENABLED'):
+            raise NotConfigured
+        if not settings.getbool('DNSCACHE_ENABLED'):
+            raise NotConfigured
+        self.stats = crawler.stats
+        self.concurrency = settings.getint('DNS_PREFETCH_CONCURRENCY')
+        self.queue_size = settings.getint('DNS_PREFETCH_QUEUE_SIZE')
+        self.queue = deque()
+        self.seen = set()  # queued or being resolved
+        self.active = 0
+        self.enabled = None  # unknown until the resolver is installed
+        crawler.signals.connect(self.request_scheduled, signal=signals.request_scheduled)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        ## 预解析的结果只有通过 CachingResolver 才能被下载器复用；
+        ## reactor 已经运行时解析器已经安装好，可以直接检查
+        if reactor.running and not _caching_resolver_installed():
+            raise NotConfigured
+        return cls(crawler)
+
+    def request_scheduled(self, request, spider):
+        if self.enabled is None:
+            # CrawlerProcess installs its resolver after the extensions are
+            # built, so check it when the first request gets scheduled
+            self.enabled = _caching_resolver_installed()
+            if not self.enabled:
+                logger.info("DNS prefetch disabled: the installed resolver "
+                            "does not cache lookups", extra={'spider': spider})
+        if not self.enabled:
+            return
+        if request.meta.get('proxy'):
+            return  # the proxy host is what gets resolved
+        hostname = urlparse_cached(request).hostname
+        if not hostname or hostname in self.seen or hostname in dnscache \
+                or _is_ip_address(hostname):
+            return
+        if len(self.queue) >= self.queue_size:
+            self.stats.inc_value('dnsprefetch/dropped', spider=spider)
+            return
+        self.seen.add(hostname)
+        self.queue.append(hostname)
+        self.stats.inc_value('dnsprefetch/queued', spider=spider)
+        self._process_queue(spider)
+
+    def _process_queue(self, spider):
+        while self.queue and self.active < self.concurrency:
+            hostname = self.queue.popleft()
+            self.active += 1
+            d = reactor.resolver.getHostByName(hostname)
+            d.addCallbacks(self._resolved, self._failed,
+                           callbackArgs=(spider,), errbackArgs=(spider,))
+            d.addBoth(self._lookup_done, hostname, spider)
+
+    def _resolved(self, result, spider):
+        self.stats.inc_value('dnsprefetch/resolved', spider=spider)
+
+    def _failed(self, failure, spider):
+        self.stats.inc_value('dnsprefetch/failed', spider=spider)
+        logger.debug("DNS prefetch failed: %(error)s",
+                     {'error': failure.value}, extra={'spider': spider})
+
+    def _lookup_done(self, _, hostname, spider):
+        self.active -= 1
+        self.seen.discard(hostname)
+        if self.queue:
+            self._process_queue(spider)
+
+    def spider_closed(self, spider):
+        self.queue.clear()
+        self.seen.clear()
+
+
+def _caching_resolver_installed():
+    return isinstance(getattr(reactor, 'resolver', None), CachingResolver)
+
+
+def _is_ip_address(hostname):
+    for family in (socket.AF_INET, getattr(socket, 'AF_INET6', None)):
+        if family is None:
+            continue
+        try:
+            socket.inet_pton(family, hostname)
+        except (socket.error, ValueError, AttributeError):
+            continue
+        return True
+    return False
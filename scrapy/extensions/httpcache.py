@@ -1,23 +1,40 @@
 from __future__ import print_function
 import os
+import re
 import gzip
+import mmap
+import struct
 import logging
+import threading
 from six.moves import cPickle as pickle
 from importlib import import_module
 from time import time
 from weakref import WeakKeyDictionary
+from collections import OrderedDict
+from binascii import hexlify
 from email.utils import mktime_tz, parsedate_tz
 from w3lib.http import headers_raw_to_dict, headers_dict_to_raw
+from twisted.internet import defer, reactor, task, threads
+from twisted.python.threadpool import ThreadPool
 from scrapy.http import Headers, Response
 from scrapy.responsetypes import responsetypes
-from scrapy.utils.request import request_fingerprint
+from scrapy.utils.request import RequestFingerprinter
 from scrapy.utils.project import data_path
 from scrapy.utils.httpobj import urlparse_cached
-from scrapy.utils.python import to_bytes, to_unicode, garbage_collect
+from scrapy.utils.python import to_bytes, to_unicode, to_native_str, garbage_collect
+from scrapy.utils.fpstore import FingerprintStore
+from scrapy.utils.log import failure_to_exc_info
+from scrapy.utils.misc import load_object
 
 
 logger = logging.getLogger(__name__)
 
+# PackedCacheStorage index values: segment, offset, length, timestamp
+_PACKED_ENTRY = struct.Struct('<IQId')
+# PackedCacheStorage record header: status, url, headers and body lengths
+_PACKED_RECORD = struct.Struct('<HIII')
+_SEGMENT_NAME_RE = re.compile(r'^seg-\d+$')
+
 
 class DummyPolicy(object):
 
@@ -214,11 +231,16 @@ class RFC2616Policy(object):
 
 class DbmCacheStorage(object):
 
-    def __init__(self, settings):
+    def __init__(self, settings, fingerprinter=None):
         self.cachedir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
         self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
         self.dbmodule = import_module(settings['HTTPCACHE_DBM_MODULE'])
         self.db = None
+        self.fingerprinter = fingerprinter or RequestFingerprinter()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, fingerprinter=crawler.request_fingerprinter)
 
     def open_spider(self, spider):
         dbpath = os.path.join(self.cachedir, '%s.db' % spider.name)
@@ -266,16 +288,21 @@ class DbmCacheStorage(object):
         return pickle.loads(db['%s_data' % key])
 
     def _request_key(self, request):
-        return request_fingerprint(request)
+        return _fingerprint_hex(self.fingerprinter, request)
 
 
 class FilesystemCacheStorage(object):
 
-    def __init__(self, settings):
+    def __init__(self, settings, fingerprinter=None):
         self.cachedir = data_path(settings['HTTPCACHE_DIR'])
         self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
         self.use_gzip = settings.getbool('HTTPCACHE_GZIP')
         self._open = gzip.open if self.use_gzip else open
+        self.fingerprinter = fingerprinter or RequestFingerprinter()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, fingerprinter=crawler.request_fingerprinter)
 
     def open_spider(self, spider):
         logger.debug("Using filesystem cache storage in %(cachedir)s" % {'cachedir': self.cachedir},
@@ -327,7 +354,7 @@ class FilesystemCacheStorage(object):
             f.write(request.body)
 
     def _get_request_path(self, spider, request):
-        key = request_fingerprint(request)
+        key = _fingerprint_hex(self.fingerprinter, request)
         return os.path.join(self.cachedir, spider.name, key[0:2], key)
 
     def _read_meta(self, spider, request):
@@ -342,14 +369,365 @@ class FilesystemCacheStorage(object):
             return pickle.load(f)
 
 
+class ThreadedFilesystemCacheStorage(object):
+    """Filesystem storage whose ``retrieve_response`` and ``store_response``
+    return deferreds, running all the disk I/O in a dedicated thread pool of
+    ``HTTPCACHE_THREADPOOL_MAXSIZE`` threads instead of the reactor thread.
+
+    Each entry is written as a single file (atomically, through a temporary
+    file and a rename) holding the pickled metadata, headers and bodies,
+    under ``HTTPCACHE_DIR/<spider name>.tcache`` so it does not clash with
+    the entry directories of :class:`FilesystemCacheStorage`. Entries that
+    cannot be read are treated as misses.
+    """
+
+    def __init__(self, settings, fingerprinter=None):
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'])
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.use_gzip = settings.getbool('HTTPCACHE_GZIP')
+        self._open = gzip.open if self.use_gzip else open
+        self.fingerprinter = fingerprinter or RequestFingerprinter()
+        self.threadpool_size = settings.getint('HTTPCACHE_THREADPOOL_MAXSIZE')
+        self.threadpool = None
+        self._pending = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, fingerprinter=crawler.request_fingerprinter)
+
+    def open_spider(self, spider):
+        logger.debug("Using threaded filesystem cache storage in %(cachedir)s" % {'cachedir': self.cachedir},
+                     extra={'spider': spider})
+        self.threadpool = ThreadPool(minthreads=0,
+                                     maxthreads=self.threadpool_size,
+                                     name='httpcache')
+        self.threadpool.start()
+
+    def close_spider(self, spider):
+        # wait for pending writes before stopping the thread pool
+        dfd = defer.DeferredList(list(self._pending))
+        dfd.addBoth(lambda _: self.threadpool.stop())
+        return dfd
+
+    def _defer(self, func, *args):
+        return threads.deferToThreadPool(reactor, self.threadpool, func, *args)
+
+    def retrieve_response(self, spider, request):
+        """Return a deferred firing the response if present in cache, or
+        None otherwise."""
+        path = self._get_request_path(spider, request)
+        dfd = self._defer(self._read_entry, path)
+        dfd.addCallback(self._build_response)
+        return dfd
+
+    def _build_response(self, data):
+        if data is None:
+            return  # not cached
+        url = data['meta']['response_url']
+        status = data['meta']['status']
+        headers = Headers(data['response_headers'])
+        respcls = responsetypes.from_args(headers=headers, url=url)
+        return respcls(url=url, headers=headers, status=status,
+                       body=data['response_body'])
+
+    def store_response(self, spider, request, response):
+        """Store the given response in the cache. Return a deferred firing
+        once it has been written."""
+        path = self._get_request_path(spider, request)
+        data = {
+            'meta': {
+                'url': request.url,
+                'method': request.method,
+                'status': response.status,
+                'response_url': response.url,
+                'timestamp': time(),
+            },
+            'response_headers': dict(response.headers),
+            'response_body': response.body,
+            'request_headers': dict(request.headers),
+            'request_body': request.body,
+        }
+        dfd = self._defer(self._write_entry, path, data)
+        self._pending.add(dfd)
+        dfd.addBoth(self._written, dfd)
+        return dfd
+
+    def _written(self, result, dfd):
+        self._pending.discard(dfd)
+        return result
+
+    def _get_request_path(self, spider, request):
+        key = _fingerprint_hex(self.fingerprinter, request)
+        return os.path.join(self.cachedir, '%s.tcache' % spider.name,
+                            key[0:2], key)
+
+    # The following methods run in the thread pool
+
+    def _read_entry(self, path):
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return  # not found
+        if 0 < self.expiration_secs < time() - mtime:
+            return  # expired
+        try:
+            with self._open(path, 'rb') as f:
+                data = pickle.load(f)
+        except Exception as e:
+            logger.warning("Ignoring unreadable cache entry %(path)s: %(error)s",
+                           {'path': path, 'error': e})
+            return
+        if not isinstance(data, dict) or 'meta' not in data:
+            logger.warning("Ignoring unreadable cache entry %(path)s",
+                           {'path': path})
+            return
+        return data
+
+    def _write_entry(self, path, data):
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:  # created meanwhile by another thread
+                if not os.path.isdir(dirname):
+                    raise
+        tmppath = '%s.%s.tmp' % (path, id(data))
+        with self._open(tmppath, 'wb') as f:
+            pickle.dump(data, f, protocol=2)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmppath, path)
+
+
+class PackedCacheStorage(object):
+    """Storage appending every entry as a single record to large segment
+    files (``seg-NNNNNN`` under ``HTTPCACHE_DIR/<spider name>.pcache``).
+
+    A memory-mapped :class:`~scrapy.utils.fpstore.FingerprintStore` maps each
+    request fingerprint to the segment, offset and length of its latest
+    record, and segments are memory-mapped for reading, so a lookup costs no
+    system calls once pages are cached. A new segment is started once the
+    current one reaches ``HTTPCACHE_SEGMENT_SIZE`` bytes.
+
+    When ``HTTPCACHE_EXPIRATION_SECS`` is set, full segments are compacted in
+    a background thread: segments where less than half of the bytes belong
+    to live (indexed and not expired) entries have those entries copied to a
+    new segment and are then removed.
+    """
+
+    compact_ratio = 0.5
+    _scan_chunk = 4096
+
+    def __init__(self, settings, fingerprinter=None):
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.segment_size = settings.getint('HTTPCACHE_SEGMENT_SIZE')
+        self.fingerprinter = fingerprinter or RequestFingerprinter()
+        self.index = None
+        self._lock = threading.Lock()
+        self._compaction = None
+        self._compact_loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, fingerprinter=crawler.request_fingerprinter)
+
+    def open_spider(self, spider):
+        self.path = os.path.join(self.cachedir, '%s.pcache' % spider.name)
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        logger.debug("Using packed cache storage in %(cachepath)s" % {'cachepath': self.path},
+                     extra={'spider': spider})
+        self.index = FingerprintStore(os.path.join(self.path, 'index'),
+                                      value_size=_PACKED_ENTRY.size)
+        self.segments = set(int(name[4:]) for name in os.listdir(self.path)
+                            if _SEGMENT_NAME_RE.match(name))
+        self._maps = {}
+        self._nextseg = max(self.segments) + 1 if self.segments else 0
+        self._open_segment(max(self.segments) if self.segments else None)
+        if self.expiration_secs > 0:
+            self._compact_loop = task.LoopingCall(self._compact)
+            self._compact_loop.start(max(self.expiration_secs, 60), now=True)
+
+    def close_spider(self, spider):
+        if self._compact_loop and self._compact_loop.running:
+            self._compact_loop.stop()
+        dfd = self._compaction or defer.succeed(None)
+        return dfd.addBoth(self._close)
+
+    def _close(self, _):
+        with self._lock:
+            self.segf.close()
+            for mm in self._maps.values():
+                mm.close()
+            self._maps.clear()
+            self.index.close()
+            self.index = None
+
+    def _segment_path(self, segno):
+        return os.path.join(self.path, 'seg-%06d' % segno)
+
+    def _open_segment(self, segno=None):
+        if segno is None:
+            segno = self._nextseg
+            self._nextseg += 1
+            self.segments.add(segno)
+        self.segno = segno
+        self.segf = open(self._segment_path(segno), 'ab')
+        self.segf.seek(0, os.SEEK_END)
+        self.segpos = self.segf.tell()
+
+    def _map(self, segno, end):
+        """Return a mmap of the given segment covering at least ``end`` bytes,
+        or None if the segment is gone"""
+        mm = self._maps.get(segno)
+        if mm is None or len(mm) < end:
+            if segno not in self.segments:
+                return
+            if mm is not None:
+                mm.close()
+            with open(self._segment_path(segno), 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segno] = mm
+        return mm
+
+    def retrieve_response(self, spider, request):
+        """Return response if present in cache, or None otherwise."""
+        fp = self.fingerprinter.fingerprint(request)
+        with self._lock:
+            entry = self.index.get(fp)
+            if entry is None:
+                return  # not cached
+            segno, offset, length, ts = _PACKED_ENTRY.unpack(entry)
+            if 0 < self.expiration_secs < time() - ts:
+                return  # expired
+            mm = self._map(segno, offset + length)
+            if mm is None:
+                return  # compacted away
+            status, urllen, hdrlen, bodylen = _PACKED_RECORD.unpack_from(mm, offset)
+            pos = offset + _PACKED_RECORD.size
+            url = to_native_str(mm[pos:pos + urllen])
+            pos += urllen
+            rawheaders = mm[pos:pos + hdrlen]
+            pos += hdrlen
+            body = mm[pos:pos + bodylen]
+        headers = Headers(headers_raw_to_dict(rawheaders))
+        respcls = responsetypes.from_args(headers=headers, url=url)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        """Store the given response in the cache."""
+        fp = self.fingerprinter.fingerprint(request)
+        url = to_bytes(response.url)
+        rawheaders = headers_dict_to_raw(response.headers)
+        header = _PACKED_RECORD.pack(response.status, len(url),
+                                     len(rawheaders), len(response.body))
+        length = len(header) + len(url) + len(rawheaders) + len(response.body)
+        with self._lock:
+            if self.segpos and self.segpos + length > self.segment_size:
+                self.segf.close()
+                self._open_segment()
+            offset = self.segpos
+            for data in (header, url, rawheaders, response.body):
+                self.segf.write(data)
+            self.segf.flush()
+            self.segpos += length
+            self.index.set(fp, _PACKED_ENTRY.pack(self.segno, offset, length,
+                                                  time()))
+
+    def _compact(self):
+        if self._compaction is not None:
+            return
+        with self._lock:
+            sealed = set(self.segments) - set([self.segno])
+            if not sealed:
+                return
+            newseg = self._nextseg
+            self._nextseg += 1
+            capacity = self.index.capacity
+        dfd = threads.deferToThread(self._compact_segments, sealed, newseg,
+                                    capacity, time())
+        dfd.addCallback(self._compacted, newseg)
+        dfd.addErrback(lambda f: logger.error(
+            "Error compacting HTTP cache segments in %(path)s",
+            {'path': self.path}, exc_info=failure_to_exc_info(f)))
+        dfd.addBoth(self._compaction_done)
+        self._compaction = dfd
+
+    def _compaction_done(self, _):
+        self._compaction = None
+
+    def _compact_segments(self, sealed, newseg, capacity, now):
+        """Runs in a thread: copy the live entries of sparse sealed segments
+        to segment ``newseg``. Return the segments to drop and the moved
+        entries as ``(fp, old entry, new entry)``, or None if the index grew
+        meanwhile (the scan is then incomplete)"""
+        live = dict((segno, []) for segno in sealed)
+        pos = 0
+        while pos < capacity:
+            with self._lock:
+                if self.index is None or self.index.capacity != capacity:
+                    return
+                chunk = list(self.index.items(pos, pos + self._scan_chunk))
+            pos += self._scan_chunk
+            for fp, entry in chunk:
+                segno, offset, length, ts = _PACKED_ENTRY.unpack(entry)
+                if segno in live and not 0 < self.expiration_secs < now - ts:
+                    live[segno].append((fp, entry))
+        drop = []
+        for segno, entries in live.items():
+            size = os.path.getsize(self._segment_path(segno))
+            if sum(_PACKED_ENTRY.unpack(e)[2] for _, e in entries) < size * self.compact_ratio:
+                drop.append(segno)
+        moves = []
+        with open(self._segment_path(newseg), 'wb') as out:
+            for segno in drop:
+                with open(self._segment_path(segno), 'rb') as f:
+                    for fp, entry in sorted(live[segno], key=lambda e: e[1]):
+                        _, offset, length, ts = _PACKED_ENTRY.unpack(entry)
+                        f.seek(offset)
+                        newentry = _PACKED_ENTRY.pack(newseg, out.tell(), length, ts)
+                        out.write(f.read(length))
+                        moves.append((fp, entry, newentry))
+        return drop, moves
+
+    def _compacted(self, result, newseg):
+        if not result or not result[0]:
+            if os.path.exists(self._segment_path(newseg)):
+                os.remove(self._segment_path(newseg))
+            return
+        drop, moves = result
+        with self._lock:
+            if self.index is None:
+                return
+            self.segments.add(newseg)
+            for fp, entry, newentry in moves:
+                # skip entries stored again while compacting
+                if self.index.get(fp) == entry:
+                    self.index.set(fp, newentry)
+            for segno in drop:
+                self.segments.discard(segno)
+                mm = self._maps.pop(segno, None)
+                if mm is not None:
+                    mm.close()
+                os.remove(self._segment_path(segno))
+        logger.debug("Compacted %(count)d HTTP cache segments in %(path)s",
+                     {'count': len(drop), 'path': self.path})
+
+
 class LeveldbCacheStorage(object):
 
-    def __init__(self, settings):
+    def __init__(self, settings, fingerprinter=None):
         import leveldb
         self._leveldb = leveldb
         self.cachedir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
         self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
         self.db = None
+        self.fingerprinter = fingerprinter or RequestFingerprinter()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, fingerprinter=crawler.request_fingerprinter)
 
     def open_spider(self, spider):
         dbpath = os.path.join(self.cachedir, '%s.leveldb' % spider.name)
@@ -407,8 +785,120 @@ class LeveldbCacheStorage(object):
             return pickle.loads(data)
 
     def _request_key(self, request):
-        return to_bytes(request_fingerprint(request))
+        return to_bytes(_fingerprint_hex(self.fingerprinter, request))
+
+
+class MemoryCacheStorage(object):
+    """Storage keeping recently used responses in memory in front of another
+    storage (``HTTPCACHE_MEMORY_BACKEND``), so repeated hits on the same
+    responses skip deserializing them again.
+
+    Responses are kept in a LRU bounded to ``HTTPCACHE_MEMORY_MAXSIZE``
+    bytes (approximated from the size of the URL, headers and body). Stores
+    always go through to the backend. Hits, misses and evictions of each
+    tier are counted in the ``httpcache/memory/*`` and
+    ``httpcache/backend/*`` stats.
 
+    Backends do not tell when the responses they return were stored, so
+    when ``HTTPCACHE_EXPIRATION_SECS`` is set those responses are not kept
+    in memory (their memory entry could outlive the backend one); only the
+    responses stored through this storage are.
+
+    The backend may be any storage, including one returning Deferreds.
+    """
+
+    def __init__(self, settings, backend=None, fingerprinter=None, stats=None):
+        if backend is None:
+            backend = load_object(settings['HTTPCACHE_MEMORY_BACKEND'])(settings)
+        self.backend = backend
+        self.maxsize = settings.getint('HTTPCACHE_MEMORY_MAXSIZE')
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.fingerprinter = fingerprinter or RequestFingerprinter()
+        self.stats = stats
+        self.entries = OrderedDict()
+        self.size = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        backendcls = load_object(crawler.settings['HTTPCACHE_MEMORY_BACKEND'])
+        if hasattr(backendcls, 'from_crawler'):
+            backend = backendcls.from_crawler(crawler)
+        else:
+            backend = backendcls(crawler.settings)
+        return cls(crawler.settings, backend,
+                   fingerprinter=crawler.request_fingerprinter,
+                   stats=crawler.stats)
+
+    def open_spider(self, spider):
+        return self.backend.open_spider(spider)
+
+    def close_spider(self, spider):
+        self.entries.clear()
+        self.size = 0
+        return self.backend.close_spider(spider)
+
+    def retrieve_response(self, spider, request):
+        key = self.fingerprinter.fingerprint(request)
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            response, size, ts = entry
+            if 0 < self.expiration_secs < time() - ts:
+                self.size -= size
+            else:
+                self.entries[key] = entry
+                self._inc_stats('memory/hit', spider)
+                return response.copy()
+        self._inc_stats('memory/miss', spider)
+        response = self.backend.retrieve_response(spider, request)
+        if isinstance(response, defer.Deferred):
+            return response.addCallback(self._retrieved, key, spider)
+        return self._retrieved(response, key, spider)
+
+    def _retrieved(self, response, key, spider):
+        if response is None:
+            self._inc_stats('backend/miss', spider)
+            return
+        self._inc_stats('backend/hit', spider)
+        if not self.expiration_secs:
+            self._add(key, response, spider)
+        return response
+
+    def store_response(self, spider, request, response):
+        self._add(self.fingerprinter.fingerprint(request), response, spider)
+        return self.backend.store_response(spider, request, response)
+
+    def _add(self, key, response, spider):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        size = _response_size(response)
+        if size > self.maxsize:
+            return
+        # keep a private copy: the middleware and the spider may alter the
+        # returned response (its flags or headers, for instance)
+        response = response.replace(flags=None, request=None)
+        self.entries[key] = (response, size, time())
+        self.size += size
+        while self.size > self.maxsize:
+            _, (_, evicted, _) = self.entries.popitem(last=False)
+            self.size -= evicted
+            self._inc_stats('memory/eviction', spider)
+
+    def _inc_stats(self, key, spider):
+        if self.stats is not None:
+            self.stats.inc_value('httpcache/%s' % key, spider=spider)
+
+
+def _response_size(response):
+    """Rough size in bytes of a response held in memory"""
+    size = len(response.url) + len(response.body) + 512
+    for name, values in response.headers.items():
+        size += len(name) + sum(len(v) for v in values)
+    return size
+
+
+def _fingerprint_hex(fingerprinter, request):
+    return to_native_str(hexlify(fingerprinter.fingerprint(request)))
 
 
 def parse_cachecontrol(header):
@@ -6,14 +6,16 @@ This package contains a collection of Link Extractors.
 For more info see docs/topics/link-extractors.rst
 """
 import re
+import warnings
+import posixpath
 
-from six.moves.urllib.parse import urlparse
+from six.moves.urllib.parse import urlparse, uses_params
 from parsel.csstranslator import HTMLTranslator
 from w3lib.url import canonicalize_url
 
 from scrapy.utils.misc import arg_to_iter
 from scrapy.utils.url import (
-    url_is_from_any_domain, url_has_any_extension,
+    url_is_from_any_domain, url_has_any_extension, parse_url, DomainMatcher,
 )
 
 
@@ -44,6 +46,59 @@ _matches = lambda url, regexs: any(r.search(url) for r in regexs)
 _is_valid_url = lambda url: url.split('://', 1)[0] in {'http', 'https', \
                                                        'file', 'ftp'}
 
+# patterns which cannot be joined with others into a single alternation:
+# backreferences and conditional group references (``(?(1)...)``) would point
+# to other groups, and global inline flags would apply to all the patterns
+_unjoinable = re.compile(r'\\[1-9]|\(\?P=|\(\?\(|\(\?[aiLmsux]+\)').search
+
+
+def _compile_matcher(regexs):
+    """Return a function telling whether any of ``regexs`` matches a string
+    (searching it), running a single regex when they can be joined"""
+    if len(regexs) == 1:
+        return regexs[0].search
+    flags = set(r.flags for r in regexs)
+    if len(flags) == 1 and not any(r.flags & re.VERBOSE for r in regexs) and \
+            not any(_unjoinable(r.pattern) for r in regexs):
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                joined = re.compile('|'.join('(?:%s)' % r.pattern
+                                             for r in regexs), flags.pop())
+        except (re.error, TypeError, Warning):
+            pass
+        else:
+            return joined.search
+    return lambda url: _matches(url, regexs)
+
+
+# host and path of plain urls, split like urlparse() does; urls with
+# characters urlparse() strips or validates are left to it
+_plain_url = re.compile(r'([a-zA-Z][a-zA-Z0-9+.\-]*)://([^/?#]*)([^?#]*)').match
+_unusual_char = re.compile(r'[\x00-\x20\x7f\[\]]|[^\x00-\x7f]').search
+_uses_params = frozenset(uses_params)
+
+
+def _host_and_path(url):
+    """Return the lowercase network location and the path of ``url``, as
+    given by :func:`urlparse`"""
+    match = None if _unusual_char(url) else _plain_url(url)
+    if match is None:
+        parsed_url = urlparse(url)
+        return parsed_url.netloc.lower(), parsed_url.path
+    scheme, netloc, path = match.groups()
+    if ';' in path and scheme.lower() in _uses_params:
+        i = path.find(';', path.rfind('/'))
+        if i >= 0:
+            path = path[:i]
+    return netloc.lower(), path
+
+
+def _domain_matcher(domains):
+    match = DomainMatcher(domains).match
+    # urls without host belong to no domain, see url_is_from_any_domain()
+    return lambda host: bool(host) and match(host)
+
 
 class FilteringLinkExtractor(object):
 
@@ -59,6 +114,7 @@ class FilteringLinkExtractor(object):
         self.deny_res = [x if isinstance(x, _re_type) else re.compile(x)
                          for x in arg_to_iter(deny)]
 
+        # a DomainMatcher (e.g. DomainMatcher.from_file()) gives its domains
         self.allow_domains = set(arg_to_iter(allow_domains))
         self.deny_domains = set(arg_to_iter(deny_domains))
 
@@ -72,35 +128,50 @@ class FilteringLinkExtractor(object):
         self.deny_extensions = {'.' + e for e in arg_to_iter(deny_extensions)}
         self.restrict_text = [x if isinstance(x, _re_type) else re.compile(x)
                               for x in arg_to_iter(restrict_text)]
+        self._compile_filters()
+
+    def _compile_filters(self):
+        ## 将各过滤条件预编译：正则合并为一个分支表达式，域名检查改为后缀集合查找
+        self._allow = self.allow_res and _compile_matcher(self.allow_res)
+        self._deny = self.deny_res and _compile_matcher(self.deny_res)
+        self._allow_domain = self.allow_domains and \
+            _domain_matcher(self.allow_domains)
+        self._deny_domain = self.deny_domains and \
+            _domain_matcher(self.deny_domains)
+        self._text = self.restrict_text and \
+            _compile_matcher(self.restrict_text)
 
     def _link_allowed(self, link):
         if not _is_valid_url(link.url):
             return False
-        if self.allow_res and not _matches(link.url, self.allow_res):
+        if self._allow and not self._allow(link.url):
             return False
-        if self.deny_res and _matches(link.url, self.deny_res):
+        if self._deny and self._deny(link.url):
             return False
-        parsed_url = urlparse(link.url)
-        if self.allow_domains and not url_is_from_any_domain(parsed_url, self.allow_domains):
+        host, path = _host_and_path(link.url)
+        if self._allow_domain and not self._allow_domain(host):
             return False
-        if self.deny_domains and url_is_from_any_domain(parsed_url, self.deny_domains):
+        if self._deny_domain and self._deny_domain(host):
             return False
-        if self.deny_extensions and url_has_any_extension(parsed_url, self.deny_extensions):
+        if self.deny_extensions and \
+                posixpath.splitext(path)[1].lower() in self.deny_extensions:
             return False
-        if self.restrict_text and not _matches(link.text, self.restrict_text):
+        if self._text and not self._text(link.text):
             return False
         return True
 
     def matches(self, url):
 
-        if self.allow_domains and not url_is_from_any_domain(url, self.allow_domains):
-            return False
-        if self.deny_domains and url_is_from_any_domain(url, self.deny_domains):
-            return False
+        if self.allow_domains or self.deny_domains:
+            host = parse_url(url).netloc.lower()
+            if self._allow_domain and not self._allow_domain(host):
+                return False
+            if self._deny_domain and self._deny_domain(host):
+                return False
 
-        allowed = (regex.search(url) for regex in self.allow_res) if self.allow_res else [True]
-        denied = (regex.search(url) for regex in self.deny_res) if self.deny_res else []
-        return any(allowed) and not any(denied)
+        allowed = self._allow(url) if self._allow else True
+        denied = self._deny(url) if self._deny else False
+        return bool(allowed) and not denied
 
     def _process_links(self, links):
         links = [x for x in links if self._link_allowed(x)]
@@ -36,6 +36,7 @@ class LxmlParserLinkExtractor(object):
         self.process_attr = process if callable(process) else lambda v: v
         self.unique = unique
         self.strip = strip
+        self.canonicalized = canonicalized
         if canonicalized:
             self.link_key = lambda link: link.url
         else:
@@ -99,6 +100,8 @@ class LxmlLinkExtractor(FilteringLinkExtractor):
                  unique=True, process_value=None, deny_extensions=None, restrict_css=(),
                  strip=True, restrict_text=None):
         tags, attrs = set(arg_to_iter(tags)), set(arg_to_iter(attrs))
+        self._tags, self._attrs = tags, attrs
+        self._process_value = process_value
         tag_func = lambda x: x in tags
         attr_func = lambda x: x in attrs
         lx = LxmlParserLinkExtractor(
@@ -129,3 +132,175 @@ class LxmlLinkExtractor(FilteringLinkExtractor):
             links = self._extract_links(doc, response.url, response.encoding, base_url)
             all_links.extend(self._process_links(links))
         return unique_list(all_links)
+
+
+class RuleSetLinkExtractor(object):
+    """Extract the links of several link extractors (the rules of a
+    :class:`~scrapy.spiders.CrawlSpider`) from a response at once.
+
+    :meth:`extract_links` returns, for each extractor, the links its own
+    ``extract_links()`` would return. The document is walked a single time
+    for all the :class:`LxmlLinkExtractor` instances: links are collected for
+    the union of their tags and attributes, made absolute once, and then
+    passed through the filters of every extractor they apply to. Other link
+    extractors (including subclasses) are called as usual.
+    """
+
+    def __init__(self, link_extractors):
+        self.link_extractors = list(link_extractors)
+        self._compiled = [type(le) is LxmlLinkExtractor and
+                          type(le.link_extractor) is LxmlParserLinkExtractor
+                          for le in self.link_extractors]
+        # extractors interested in each tag
+        self._tag_extractors = {}
+        for i, le in enumerate(self.link_extractors):
+            if self._compiled[i]:
+                for tag in le._tags:
+                    self._tag_extractors.setdefault(tag, []).append(i)
+
+    def extract_links(self, response):
+        """Return a list with the links of every link extractor"""
+        if not any(self._compiled):
+            return [le.extract_links(response) for le in self.link_extractors]
+        base_url = get_base_url(response)
+        candidates, by_element = self._collect(response, base_url)
+        urls = _CanonicalUrls()
+        results = []
+        for i, le in enumerate(self.link_extractors):
+            if not self._compiled[i]:
+                results.append(le.extract_links(response))
+                continue
+            if le.restrict_xpaths:
+                docs = [[c for el in subdoc.root.iter(etree.Element)
+                         for c in by_element.get(el, ())]
+                        for x in le.restrict_xpaths
+                        for subdoc in response.xpath(x)]
+            else:
+                docs = [candidates]
+            all_links = []
+            for doc in docs:
+                links = self._links_for(le, doc, response, urls)
+                all_links.extend(self._process_links(le, links, urls))
+            results.append(unique_list(all_links))
+        return results
+
+    def _collect(self, response, base_url):
+        """Walk the document once, return the ``(element, attribute, value)``
+        candidates of all the compiled extractors in document order, also
+        indexed by element"""
+        candidates = []
+        by_element = {}
+        tag_extractors = self._tag_extractors
+        for el in response.selector.root.iter(etree.Element):
+            indexes = tag_extractors.get(_nons(el.tag))
+            if not indexes:
+                continue
+            found = []
+            for attrib, value in el.attrib.items():
+                if any(attrib in self.link_extractors[i]._attrs
+                       for i in indexes):
+                    found.append(_Candidate(el, attrib, value, base_url))
+            if found:
+                candidates.extend(found)
+                by_element[el] = found
+        return candidates, by_element
+
+    def _links_for(self, le, candidates, response, urls):
+        """Build the links of extractor ``le`` from ``candidates``, like
+        :meth:`LxmlParserLinkExtractor._extract_links` does"""
+        lx = le.link_extractor
+        links = []
+        for c in candidates:
+            if _nons(c.el.tag) not in le._tags or c.attr not in le._attrs:
+                continue
+            url = c.url(lx.strip, le._process_value, lx.process_attr, response)
+            if url is None:
+                continue
+            links.append(Link(url, c.text(), nofollow=c.nofollow()))
+        return urls.deduplicate(lx, links)
+
+    def _process_links(self, le, links, urls):
+        """:meth:`FilteringLinkExtractor._process_links`, the urls being
+        canonicalized once for all the extractors"""
+        links = [x for x in links if le._link_allowed(x)]
+        if le.canonicalize:
+            for link in links:
+                link.url = urls.canonicalize(link.url)
+        return urls.deduplicate(le.link_extractor, links)
+
+
+class _CanonicalUrls(object):
+    """Canonical forms of the urls of a response, computed once"""
+
+    def __init__(self):
+        self._canonical = {}
+        self._keys = {}
+
+    def canonicalize(self, url):
+        if url not in self._canonical:
+            self._canonical[url] = canonicalize_url(url)
+        return self._canonical[url]
+
+    def key(self, url):
+        # LxmlParserLinkExtractor.link_key of non canonicalized links
+        if url not in self._keys:
+            self._keys[url] = canonicalize_url(url, keep_fragments=True)
+        return self._keys[url]
+
+    def deduplicate(self, lx, links):
+        """:meth:`LxmlParserLinkExtractor._deduplicate_if_needed`"""
+        if not lx.unique:
+            return links
+        if lx.canonicalized:
+            return unique_list(links, key=lambda link: link.url)
+        return unique_list(links, key=lambda link: self.key(link.url))
+
+
+class _Candidate(object):
+    """Attribute value of an element which may be a link, with the results
+    of the work shared by the extractors which scan it"""
+
+    __slots__ = ['el', 'attr', 'value', 'base_url', '_urls', '_text',
+                 '_nofollow']
+
+    def __init__(self, el, attr, value, base_url):
+        self.el = el
+        self.attr = attr
+        self.value = value
+        self.base_url = base_url
+        self._urls = {}
+        self._text = None
+        self._nofollow = None
+
+    def url(self, strip, process_value, process, response):
+        # extractors without process_value share the same url
+        key = (strip, process_value)
+        if key not in self._urls:
+            self._urls[key] = self._make_url(strip, process, response)
+        return self._urls[key]
+
+    def _make_url(self, strip, process, response):
+        # pseudo lxml.html.HtmlElement.make_links_absolute(base_url)
+        try:
+            attr_val = self.value
+            if strip:
+                attr_val = strip_html5_whitespace(attr_val)
+            attr_val = urljoin(self.base_url, attr_val)
+        except ValueError:
+            return  # skipping bogus links
+        url = process(attr_val)
+        if url is None:
+            return
+        url = to_native_str(url, encoding=response.encoding)
+        # to fix relative links after process_value
+        return urljoin(response.url, url)
+
+    def text(self):
+        if self._text is None:
+            self._text = _collect_string_content(self.el) or u''
+        return self._text
+
+    def nofollow(self):
+        if self._nofollow is None:
+            self._nofollow = rel_has_nofollow(self.el.get('rel'))
+        return self._nofollow
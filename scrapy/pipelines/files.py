@@ -3,12 +3,16 @@ Files Pipeline
 
 See documentation in topics/media-pipeline.rst
 """
+import errno
 import functools
 import hashlib
 import os
 import os.path
 import time
+import uuid
 import logging
+import threading
+from importlib import import_module
 from email.utils import parsedate_tz, mktime_tz
 from six.moves.urllib.parse import urlparse
 from collections import defaultdict
@@ -19,9 +23,11 @@ try:
 except ImportError:
     from io import BytesIO
 
-from twisted.internet import defer, threads
+from twisted.internet import defer, threads, reactor
+from twisted.python.threadpool import ThreadPool
 
 from scrapy.pipelines.media import MediaPipeline
+from scrapy.core.downloader.stream import FileBodyConsumer, DecompressingConsumer
 from scrapy.settings import Settings
 from scrapy.exceptions import NotConfigured, IgnoreRequest
 from scrapy.http import Request
@@ -39,41 +45,151 @@ class FileException(Exception):
     """General media error exception"""
 
 
+_replace = getattr(os, 'replace', os.rename)
+
+
 class FSFilesStore(object):
+    """Store files in a local directory.
+
+    Disk I/O and checksums are done in a pool of ``THREADS`` threads. Files
+    are written to a temporary file which is then renamed, so a file is
+    never seen partially written. If ``INDEX`` is true, the modification
+    time, size and checksum of the stored files are kept in a dbm database
+    in the store directory, so that :meth:`stat_file` only needs to read a
+    file again if it changed since it was stored.
+    """
+
+    THREADS = 4  # Overriden (per store) from settings.FILES_STORE_THREADS
+                 # in FilesPipeline.__init__.
+    INDEX = True
+    INDEX_NAME = '.scrapy-files-index'
+    CHUNK_SIZE = 64 * 1024
+
     def __init__(self, basedir):
         if '://' in basedir:
             basedir = basedir.split('://', 1)[1]
         self.basedir = basedir
-        self._mkdir(self.basedir)
         self.created_directories = defaultdict(set)
+        self._mkdir_lock = threading.Lock()
+        self._mkdir(self.basedir)
+        self._threadpool = None
+        self._index = None
+        self._index_lock = threading.Lock()
 
     def persist_file(self, path, buf, info, meta=None, headers=None):
+        """Write the content of ``buf`` (from its current position) to
+        ``path``. Return a deferred with the new stats of the file, as
+        returned by :meth:`stat_file`."""
+        return self._in_thread(self._persist_file, path, buf, info)
+
+    def stat_file(self, path, info):
+        return self._in_thread(self._stat_file, path)
+
+    def _persist_file(self, path, buf, info):
         absolute_path = self._get_filesystem_path(path)
         self._mkdir(os.path.dirname(absolute_path), info)
-        with open(absolute_path, 'wb') as f:
-            f.write(buf.getvalue())
+        tmp_path = '%s.%s.part' % (absolute_path, uuid.uuid4().hex[:12])
+        m = hashlib.md5()
+        try:
+            with open(tmp_path, 'wb') as f:
+                while True:
+                    data = buf.read(self.CHUNK_SIZE)
+                    if not data:
+                        break
+                    m.update(data)
+                    f.write(data)
+            _replace(tmp_path, absolute_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        stat = os.stat(absolute_path)
+        checksum = m.hexdigest()
+        self._index_set(path, stat, checksum)
+        return {'last_modified': stat.st_mtime, 'checksum': checksum}
 
-    def stat_file(self, path, info):
+    def _stat_file(self, path):
         absolute_path = self._get_filesystem_path(path)
         try:
-            last_modified = os.path.getmtime(absolute_path)
+            stat = os.stat(absolute_path)
         except os.error:
             return {}
 
-        with open(absolute_path, 'rb') as f:
-            checksum = md5sum(f)
-
-        return {'last_modified': last_modified, 'checksum': checksum}
+        checksum = self._index_get(path, stat)
+        if checksum is None:
+            with open(absolute_path, 'rb') as f:
+                checksum = md5sum(f)
+            self._index_set(path, stat, checksum)
+
+        return {'last_modified': stat.st_mtime, 'checksum': checksum}
+
+    def _in_thread(self, func, *args):
+        if self._threadpool is None:
+            self._threadpool = ThreadPool(
+                minthreads=0, maxthreads=self.THREADS, name='FSFilesStore')
+            self._threadpool.start()
+            reactor.addSystemEventTrigger('during', 'shutdown', self.close)
+        return threads.deferToThreadPool(reactor, self._threadpool, func, *args)
+
+    def _get_index(self):
+        # called with the index lock held
+        if self._index is None and self.INDEX:
+            dbmodule = import_module('anydbm' if six.PY2 else 'dbm')
+            try:
+                self._index = dbmodule.open(
+                    os.path.join(self.basedir, self.INDEX_NAME), 'c')
+            except Exception as e:
+                logger.warning("Cannot open the index of files store "
+                               "%(basedir)s, running without it: %(error)s",
+                               {'basedir': self.basedir, 'error': e})
+                self.INDEX = False
+        return self._index
+
+    def _index_get(self, path, stat):
+        """Return the indexed checksum of ``path`` if its stats did not
+        change since it was indexed"""
+        with self._index_lock:
+            index = self._get_index()
+            if index is None:
+                return
+            entry = index.get(to_bytes(path))
+        if entry is not None:
+            mtime, size, checksum = entry.decode('ascii').split(' ')
+            if float(mtime) == stat.st_mtime and int(size) == stat.st_size:
+                return checksum
+
+    def _index_set(self, path, stat, checksum):
+        entry = '%r %d %s' % (stat.st_mtime, stat.st_size, checksum)
+        with self._index_lock:
+            index = self._get_index()
+            if index is not None:
+                index[to_bytes(path)] = entry.encode('ascii')
+
+    def close(self):
+        if self._threadpool is not None:
+            self._threadpool.stop()
+            self._threadpool = None
+        with self._index_lock:
+            if self._index is not None:
+                self._index.close()
+                self._index = None
 
     def _get_filesystem_path(self, path):
         path_comps = path.split('/')
         return os.path.join(self.basedir, *path_comps)
 
     def _mkdir(self, dirname, domain=None):
-        seen = self.created_directories[domain] if domain else set()
-        if dirname not in seen:
-            if not os.path.exists(dirname):
-                os.makedirs(dirname)
+        # called from the threads of the pool
+        with self._mkdir_lock:
+            seen = self.created_directories[domain] if domain else set()
+            if dirname in seen:
+                return
+        try:
+            os.makedirs(dirname)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        with self._mkdir_lock:
             seen.add(dirname)
 
 
@@ -169,7 +285,7 @@ class S3FilesStore(object):
             if headers:
                 h.update(headers)
             return threads.deferToThread(
-                k.set_contents_from_string, buf.getvalue(),
+                k.set_contents_from_string, buf.read(),
                 headers=h, policy=self.POLICY)
 
     def _headers_to_botocore_kwargs(self, headers):
@@ -240,9 +356,10 @@ class GCSFilesStore(object):
         blob = self.bucket.blob(self.prefix + path)
         blob.cache_control = self.CACHE_CONTROL
         blob.metadata = {k: str(v) for k, v in six.iteritems(meta or {})}
+        buf.seek(0)
         return threads.deferToThread(
             blob.upload_from_string,
-            data=buf.getvalue(),
+            data=buf.read(),
             content_type=self._get_content_type(headers),
             predefined_acl=self.POLICY
         )
@@ -303,6 +420,10 @@ class FilesPipeline(MediaPipeline):
         self.files_result_field = settings.get(
             resolve('FILES_RESULT_FIELD'), self.FILES_RESULT_FIELD
         )
+        self.stream = settings.getbool(resolve('FILES_STREAM'))
+        if isinstance(self.store, FSFilesStore):
+            self.store.THREADS = settings.getint('FILES_STORE_THREADS',
+                                                 self.store.THREADS)
 
         super(FilesPipeline, self).__init__(download_func=download_func, settings=settings)
 
@@ -368,8 +489,18 @@ class FilesPipeline(MediaPipeline):
                          exc_info=failure_to_exc_info(f),
                          extra={'spider': info.spider})
         )
+        if self.stream:
+            dfd.addCallback(self._stream_to_file, request)
         return dfd
 
+    def _stream_to_file(self, result, request):
+        # the file will be downloaded: have its body written to a temporary
+        # file instead of kept in memory
+        if result is None:
+            request.meta.setdefault('download_stream',
+                                    DecompressingConsumer(FileBodyConsumer()))
+        return result
+
     def media_failed(self, failure, request, info):
         if not isinstance(failure.value, IgnoreRequest):
             referer = referer_str(request)
@@ -385,8 +516,11 @@ class FilesPipeline(MediaPipeline):
 
     def media_downloaded(self, response, request, info):
         referer = referer_str(request)
+        streamed = self._streamed_file(response, request)
 
         if response.status != 200:
+            if streamed:
+                os.remove(streamed.path)
             logger.warning(
                 'File (code: %(status)s): Error downloading file from '
                 '%(request)s referred in <%(referer)s>',
@@ -396,7 +530,9 @@ class FilesPipeline(MediaPipeline):
             )
             raise FileException('download-error')
 
-        if not response.body:
+        if not (streamed.size if streamed else response.body):
+            if streamed:
+                os.remove(streamed.path)
             logger.warning(
                 'File (empty-content): Empty file from %(request)s referred '
                 'in <%(referer)s>: no-content',
@@ -414,27 +550,39 @@ class FilesPipeline(MediaPipeline):
         )
         self.inc_stats(info.spider, status)
 
-        try:
-            path = self.file_path(request, response=response, info=info)
-            checksum = self.file_downloaded(response, request, info)
-        except FileException as exc:
+        dfd = defer.maybeDeferred(self.file_path, request, response=response, info=info)
+        dfd.addCallback(self._file_downloaded, response, request, info)
+        dfd.addErrback(self._file_processing_failed, request, referer, info)
+        return dfd
+
+    def _file_downloaded(self, path, response, request, info):
+        # file_downloaded() may return the checksum or a deferred with it
+        dfd = defer.maybeDeferred(self.file_downloaded, response, request, info)
+        return dfd.addCallback(
+            lambda checksum: {'url': request.url, 'path': path, 'checksum': checksum})
+
+    def _file_processing_failed(self, failure, request, referer, info):
+        exc = failure.value
+        if isinstance(exc, FileException):
             logger.warning(
                 'File (error): Error processing file from %(request)s '
                 'referred in <%(referer)s>: %(errormsg)s',
                 {'request': request, 'referer': referer, 'errormsg': str(exc)},
-                extra={'spider': info.spider}, exc_info=True
+                extra={'spider': info.spider}, exc_info=failure_to_exc_info(failure)
             )
-            raise
-        except Exception as exc:
-            logger.error(
-                'File (unknown-error): Error processing file from %(request)s '
-                'referred in <%(referer)s>',
-                {'request': request, 'referer': referer},
-                exc_info=True, extra={'spider': info.spider}
-            )
-            raise FileException(str(exc))
+            return failure
+        logger.error(
+            'File (unknown-error): Error processing file from %(request)s '
+            'referred in <%(referer)s>',
+            {'request': request, 'referer': referer},
+            exc_info=failure_to_exc_info(failure), extra={'spider': info.spider}
+        )
+        raise FileException(str(exc))
 
-        return {'url': request.url, 'path': path, 'checksum': checksum}
+    def close_spider(self, spider):
+        super(FilesPipeline, self).close_spider(spider)
+        if hasattr(self.store, 'close'):
+            self.store.close()
 
     def inc_stats(self, spider, status):
         spider.crawler.stats.inc_value('file_count', spider=spider)
@@ -446,11 +594,37 @@ class FilesPipeline(MediaPipeline):
 
     def file_downloaded(self, response, request, info):
         path = self.file_path(request, response=response, info=info)
-        buf = BytesIO(response.body)
-        checksum = md5sum(buf)
+        streamed = self._streamed_file(response, request)
+        if streamed:
+            buf = open(streamed.path, 'rb')
+        else:
+            buf = BytesIO(response.body)
+        dfd = defer.maybeDeferred(self.store.persist_file, path, buf, info)
+        dfd.addCallback(self._persisted_checksum, buf)
+        if streamed:
+            dfd.addBoth(self._remove_streamed_file, buf, streamed.path)
+        return dfd
+
+    def _persisted_checksum(self, result, buf):
+        # FSFilesStore computes the checksum while writing the file, other
+        # stores do not: compute it from a thread
+        if isinstance(result, dict) and result.get('checksum'):
+            return result['checksum']
         buf.seek(0)
-        self.store.persist_file(path, buf, info)
-        return checksum
+        return threads.deferToThread(md5sum, buf)
+
+    def _streamed_file(self, response, request):
+        """Return the consumer the body of ``response`` was streamed to, if it
+        was streamed to a file"""
+        if 'streamed' in response.flags:
+            consumer = request.meta.get('download_stream')
+            if getattr(consumer, 'path', None):
+                return consumer
+
+    def _remove_streamed_file(self, result, buf, path):
+        buf.close()
+        os.remove(path)
+        return result
 
     def item_completed(self, results, item, info):
         if isinstance(item, dict) or self.files_result_field in item.fields:
@@ -3,8 +3,16 @@ Images Pipeline
 
 See documentation in topics/media-pipeline.rst
 """
+import os
+import pickle
+import logging
 import functools
 import hashlib
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from time import time
+
 import six
 
 try:
@@ -13,15 +21,50 @@ except ImportError:
     from io import BytesIO
 
 from PIL import Image
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
 
-from scrapy.utils.misc import md5sum
+from scrapy.core.cpubound import fork_pool, defer_to_pool
 from scrapy.utils.python import to_bytes
+from scrapy.utils.reqser import request_to_dict, request_from_dict, \
+    response_to_dict, response_from_dict
 from scrapy.http import Request
 from scrapy.settings import Settings
 from scrapy.exceptions import DropItem
 #TODO: from scrapy.pipelines.media import MediaPipeline
 from scrapy.pipelines.files import FileException, FilesPipeline
 
+logger = logging.getLogger(__name__)
+
+# Image.ANTIALIAS was removed in Pillow 10
+_RESAMPLE = getattr(Image, 'LANCZOS', None) or Image.ANTIALIAS
+
+# time spent in each stage by the images being processed in this thread
+_timings = threading.local()
+
+# pipeline used by the processing pool workers, set in the crawl process right
+# before they are forked (when the spider is opened)
+_pipeline = None
+
+
+@contextmanager
+def _stage(name):
+    stages = getattr(_timings, 'stages', None)
+    start = time()
+    try:
+        yield
+    finally:
+        if stages is not None:
+            stages[name] = stages.get(name, 0) + time() - start
+
+
+def _process_in_worker(data):
+    """Run in the processing pool workers"""
+    response, request = pickle.loads(data)
+    return _pipeline._process_images(response_from_dict(response),
+                                     request_from_dict(request),
+                                     _pipeline.spiderinfo)
+
 
 class NoimagesDrop(DropItem):
     """Product with no images exception"""
@@ -34,6 +77,11 @@ class ImageException(FileException):
 class ImagesPipeline(FilesPipeline):
     """Abstract pipeline that implement the image thumbnail generation logic
 
+    Images are processed in the reactor thread, unless
+    ``IMAGES_PROCESSING_POOL`` is ``'thread'`` or ``'process'``: then
+    :meth:`get_images`, :meth:`convert_image`, :meth:`file_path` and
+    :meth:`thumb_path` (and their overrides) run in a pool of threads or
+    forked processes, and must be thread-safe.
     """
 
     MEDIA_NAME = 'image'
@@ -83,6 +131,16 @@ class ImagesPipeline(FilesPipeline):
         self.thumbs = settings.get(
             resolve('IMAGES_THUMBS'), self.THUMBS
         )
+        # images are processed from the response body
+        self.stream = False
+        self.processing_pool = settings.get(
+            resolve('IMAGES_PROCESSING_POOL'), ''
+        )
+        self.processing_workers = settings.getint(
+            resolve('IMAGES_PROCESSING_WORKERS')
+        ) or multiprocessing.cpu_count()
+        self._threadpool = None
+        self._process_pool = None
 
     @classmethod
     def from_settings(cls, settings):
@@ -106,17 +164,103 @@ class ImagesPipeline(FilesPipeline):
         return self.image_downloaded(response, request, info)
 
     def image_downloaded(self, response, request, info):
-        checksum = None
-        for path, image, buf in self.get_images(response, request, info):
-            if checksum is None:
-                buf.seek(0)
-                checksum = md5sum(buf)
-            width, height = image.size
-            self.store.persist_file(
-                path, buf, info,
+        dfd = self._process(response, request, info)
+        dfd.addCallback(self._images_processed, info)
+        return dfd
+
+    def _process(self, response, request, info):
+        if self._process_pool is not None:
+            try:
+                data = pickle.dumps((response_to_dict(response),
+                                     request_to_dict(request)), protocol=2)
+            except Exception as e:
+                logger.debug("Processing image %(request)s in the reactor "
+                             "thread, it cannot be sent to the processing "
+                             "pool: %(error)s",
+                             {'request': request, 'error': e},
+                             extra={'spider': info.spider})
+            else:
+                return defer_to_pool(self._process_pool, _process_in_worker,
+                                     data)
+        elif self.processing_pool == 'thread':
+            return threads.deferToThreadPool(
+                reactor, self._get_threadpool(), self._process_images,
+                response, request, info)
+        return defer.maybeDeferred(self._process_images, response, request, info)
+
+    def _get_threadpool(self):
+        if self._threadpool is None:
+            self._threadpool = ThreadPool(minthreads=0,
+                                          maxthreads=self.processing_workers,
+                                          name='ImagesPipeline')
+            self._threadpool.start()
+            reactor.addSystemEventTrigger('during', 'shutdown',
+                                          self._close_pools)
+        return self._threadpool
+
+    def open_spider(self, spider):
+        global _pipeline
+        super(ImagesPipeline, self).open_spider(spider)
+        # the workers are forked before the reactor threads are started,
+        # see scrapy.core.cpubound
+        if self.processing_pool == 'process' and hasattr(os, 'fork') \
+                and self._process_pool is None:
+            _pipeline = self
+            self._process_pool = fork_pool(self.processing_workers)
+            logger.info("Started image processing pool with %(processes)d "
+                        "processes", {'processes': self.processing_workers},
+                        extra={'spider': spider})
+
+    def _close_pools(self):
+        if self._threadpool is not None:
+            self._threadpool.stop()
+            self._threadpool = None
+        if self._process_pool is not None:
+            self._process_pool.terminate()
+            self._process_pool = None
+
+    def close_spider(self, spider):
+        super(ImagesPipeline, self).close_spider(spider)
+        self._close_pools()
+
+    def _process_images(self, response, request, info):
+        """Get the images to store for ``response``. Return the checksum of
+        the first one, their ``(path, width, height, data)`` and the time
+        spent in each processing stage.
+
+        This runs in the processing pool, if any.
+        """
+        _timings.stages = stages = {}
+        try:
+            checksum = None
+            images = []
+            for path, image, buf in self.get_images(response, request, info):
+                data = buf.getvalue()
+                if checksum is None:
+                    checksum = hashlib.md5(data).hexdigest()
+                width, height = image.size
+                images.append((path, width, height, data))
+        finally:
+            _timings.stages = None
+        return checksum, images, stages
+
+    def _images_processed(self, result, info):
+        checksum, images, stages = result
+        stats = info.spider.crawler.stats
+        stats.inc_value('images/processed', spider=info.spider)
+        for name, seconds in six.iteritems(stages):
+            stats.inc_value('images/processing_time/%s' % name, seconds,
+                            spider=info.spider)
+        dfds = []
+        for path, width, height, data in images:
+            dfds.append(defer.maybeDeferred(
+                self.store.persist_file,
+                path, BytesIO(data), info,
                 meta={'width': width, 'height': height},
-                headers={'Content-Type': 'image/jpeg'})
-        return checksum
+                headers={'Content-Type': 'image/jpeg'}))
+        dfd = defer.DeferredList(dfds, fireOnOneErrback=True, consumeErrors=True)
+        dfd.addCallbacks(lambda _: checksum, lambda f: f.value.subFailure)
+        return dfd
 
     def get_images(self, response, request, info):
         path = self.file_path(request, response=response, info=info)
@@ -127,6 +271,10 @@ class ImagesPipeline(FilesPipeline):
             raise ImageException("Image too small (%dx%d < %dx%d)" %
                                  (width, height, self.min_width, self.min_height))
 
+        # the image is decoded once, thumbnails are made from the converted
+        # original image
+        with _stage('decode'):
+            orig_image.load()
         image, buf = self.convert_image(orig_image)
         yield path, image, buf
 
@@ -136,24 +284,27 @@ class ImagesPipeline(FilesPipeline):
             yield thumb_path, thumb_image, thumb_buf
 
     def convert_image(self, image, size=None):
-        if image.format == 'PNG' and image.mode == 'RGBA':
-            background = Image.new('RGBA', image.size, (255, 255, 255))
-            background.paste(image, image)
-            image = background.convert('RGB')
-        elif image.mode == 'P':
-            image = image.convert("RGBA")
-            background = Image.new('RGBA', image.size, (255, 255, 255))
-            background.paste(image, image)
-            image = background.convert('RGB')
-        elif image.mode != 'RGB':
-            image = image.convert('RGB')
+        with _stage('convert'):
+            if image.format == 'PNG' and image.mode == 'RGBA':
+                background = Image.new('RGBA', image.size, (255, 255, 255))
+                background.paste(image, image)
+                image = background.convert('RGB')
+            elif image.mode == 'P':
+                image = image.convert("RGBA")
+                background = Image.new('RGBA', image.size, (255, 255, 255))
+                background.paste(image, image)
+                image = background.convert('RGB')
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
 
         if size:
-            image = image.copy()
-            image.thumbnail(size, Image.ANTIALIAS)
+            with _stage('thumbnail'):
+                image = image.copy()
+                image.thumbnail(size, _RESAMPLE)
 
-        buf = BytesIO()
-        image.save(buf, 'JPEG')
+        with _stage('encode'):
+            buf = BytesIO()
+            image.save(buf, 'JPEG')
         return image, buf
 
     def get_media_requests(self, item, info):
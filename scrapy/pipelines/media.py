@@ -1,30 +1,88 @@
 from __future__ import print_function
 
+import os
 import functools
 import logging
 from collections import defaultdict
+from importlib import import_module
+
+import six
+from six.moves import cPickle as pickle
 from twisted.internet.defer import Deferred, DeferredList
 from twisted.python.failure import Failure
 
 from scrapy.settings import Settings
-from scrapy.utils.datatypes import SequenceExclude
+from scrapy.utils.datatypes import SequenceExclude, LRUCache
 from scrapy.utils.defer import mustbe_deferred, defer_result
-from scrapy.utils.request import request_fingerprint
+from scrapy.utils.request import fingerprint
 from scrapy.utils.misc import arg_to_iter
 from scrapy.utils.log import failure_to_exc_info
+from scrapy.utils.job import job_dir
+from scrapy.utils.python import to_bytes
 
 logger = logging.getLogger(__name__)
 
 
+class DownloadedResults(object):
+    """Results of the media requests, by request fingerprint.
+
+    Up to ``limit`` results (all of them if ``limit`` is 0) are kept in
+    memory, the least recently used ones being dropped first. If ``path`` is
+    given, successful results are also stored in a dbm database at that
+    path, so they are still known once dropped from memory, or when a job is
+    resumed.
+    """
+
+    def __init__(self, limit=0, path=None):
+        self._memory = LRUCache(limit) if limit else {}
+        self._db = None
+        if path:
+            dbmodule = import_module('anydbm' if six.PY2 else 'dbm')
+            self._db = dbmodule.open(path, 'c')
+
+    def __contains__(self, fp):
+        if fp in self._memory:
+            return True
+        return self._db is not None and to_bytes(fp) in self._db
+
+    def __getitem__(self, fp):
+        try:
+            return self._memory[fp]
+        except KeyError:
+            if self._db is None:
+                raise
+        result = pickle.loads(self._db[to_bytes(fp)])
+        self._memory[fp] = result
+        return result
+
+    def __setitem__(self, fp, result):
+        self._memory[fp] = result
+        if self._db is not None and not isinstance(result, Failure):
+            try:
+                data = pickle.dumps(result, protocol=2)
+            except Exception:
+                return
+            self._db[to_bytes(fp)] = data
+
+    def __len__(self):
+        return len(self._memory)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
 class MediaPipeline(object):
 
     LOG_FAILED_RESULTS = True
 
     class SpiderInfo(object):
-        def __init__(self, spider):
+        def __init__(self, spider, downloaded=None):
             self.spider = spider
             self.downloading = set()
-            self.downloaded = {}
+            ## 已处理过的请求结果（按请求指纹），用于在 item 之间去重
+            self.downloaded = downloaded if downloaded is not None else {}
             self.waiting = defaultdict(list)
 
     def __init__(self, download_func=None, settings=None):
@@ -39,6 +97,8 @@ class MediaPipeline(object):
             resolve('MEDIA_ALLOW_REDIRECTS'), False
         )
         self._handle_statuses(self.allow_redirects)
+        self.results_limit = settings.getint(resolve('MEDIA_RESULTS_LIMIT'))
+        self.jobdir = job_dir(settings)
 
     def _handle_statuses(self, allow_redirects):
         self.handle_httpstatus_list = None
@@ -72,7 +132,15 @@ class MediaPipeline(object):
         return pipe
 
     def open_spider(self, spider):
-        self.spiderinfo = self.SpiderInfo(spider)
+        path = None
+        if self.jobdir:
+            path = os.path.join(self.jobdir, 'media-%s.db'
+                                % self.__class__.__name__.lower())
+        downloaded = DownloadedResults(self.results_limit, path)
+        self.spiderinfo = self.SpiderInfo(spider, downloaded)
+
+    def close_spider(self, spider):
+        self.spiderinfo.downloaded.close()
 
     def process_item(self, item, spider):
         info = self.spiderinfo
@@ -82,7 +150,7 @@ class MediaPipeline(object):
         return dfd.addCallback(self.item_completed, item, info)
 
     def _process_request(self, request, info):
-        fp = request_fingerprint(request)
+        fp = self._fingerprint(request)
         cb = request.callback or (lambda _: _)
         eb = request.errback
         request.callback = None
@@ -110,6 +178,12 @@ class MediaPipeline(object):
         )
         return dfd.addBoth(lambda _: wad)  # it must return wad at last
 
+    def _fingerprint(self, request):
+        crawler = getattr(self, 'crawler', None)
+        if crawler is not None:
+            return crawler.request_fingerprinter.fingerprint(request)
+        return fingerprint(request)
+
     def _modify_media_request(self, request):
         if self.handle_httpstatus_list:
             request.meta['handle_httpstatus_list'] = self.handle_httpstatus_list
@@ -0,0 +1,175 @@
+"""
+Scheduler priority queues
+"""
+
+import re
+import hashlib
+from time import time
+from collections import deque
+
+import six
+from six.moves.urllib.parse import urlparse
+from queuelib import PriorityQueue
+
+from scrapy.http import Request
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.python import to_bytes
+
+
+def _path_safe(text):
+    """Return a filesystem-safe version of a download slot key, which is
+    unique for every key"""
+    text = six.text_type(text)
+    safe = re.sub(r'[^\w.-]', '_', text, flags=re.UNICODE)[:64]
+    return '%s-%s' % (safe, hashlib.md5(to_bytes(text)).hexdigest()[:8])
+
+
+class DownloaderAwarePriorityQueue(object):
+    """Priority queue that keeps one :class:`queuelib.PriorityQueue` per
+    download slot and hands out requests round-robin across slots, so that a
+    single domain dominating the frontier does not starve the others.
+
+    Slots that are currently saturated (as many active requests as their
+    concurrency allows) or waiting for their ``DOWNLOAD_DELAY`` are skipped;
+    if the next ``SCAN_LIMIT`` slots of the rotation are busy, the least
+    loaded of them is used, so popping a request does not depend on the
+    number of slots. Priorities are only honored within a slot.
+
+    It works both for memory queues (which hold requests) and for disk
+    queues (which hold dicts built by
+    :func:`~scrapy.utils.reqser.request_to_dict`). ``startprios`` and the
+    value returned by :meth:`close` map each slot to its active priorities.
+    The list of active priorities of a :class:`queuelib.PriorityQueue` (as
+    left in a ``JOBDIR`` crawled with the default
+    ``SCHEDULER_PRIORITY_QUEUE``) is also accepted: its requests are moved to
+    the queues of their slot.
+    """
+
+    SCAN_LIMIT = 32
+
+    def __init__(self, qfactory, startprios=None, crawler=None):
+        self.qfactory = qfactory
+        self.crawler = crawler
+        self.pqueues = {}
+        # slots in the order they get requests; emptied slots are only
+        # removed once they come up
+        self._rotation = deque()
+        self._in_rotation = set()
+        self._len = 0
+        if isinstance(startprios, (list, tuple)):
+            self._migrate(startprios)
+        else:
+            for slot, prios in (startprios or {}).items():
+                self._addslot(slot, prios)
+        self._len = sum(len(pq) for pq in self.pqueues.values())
+
+    @classmethod
+    def from_crawler(cls, crawler, qfactory, startprios=None):
+        return cls(qfactory, startprios=startprios, crawler=crawler)
+
+    @property
+    def _downloader(self):
+        engine = getattr(self.crawler, 'engine', None)
+        return getattr(engine, 'downloader', None)
+
+    def _migrate(self, startprios):
+        """Move the requests of a queuelib PriorityQueue, which used the same
+        queue factory, to the queues of their slot"""
+        old = PriorityQueue(self.qfactory, startprios)
+        for priority in sorted(old.queues):
+            q = old.queues[priority]
+            while True:
+                obj = q.pop()
+                if obj is None:
+                    break
+                self.push(obj, priority)
+        old.close()
+
+    def _addslot(self, slot, startprios=()):
+        safe = _path_safe(slot)
+        factory = lambda priority: self.qfactory('%s-%s' % (safe, priority))
+        pq = self.pqueues[slot] = PriorityQueue(factory, startprios)
+        if slot not in self._in_rotation:
+            self._in_rotation.add(slot)
+            self._rotation.append(slot)
+        return pq
+
+    def _slot_key(self, obj):
+        downloader = self._downloader
+        if isinstance(obj, Request):
+            meta = obj.meta
+            hostname = urlparse_cached(obj).hostname
+        else:
+            meta = obj.get('meta') or {}
+            hostname = urlparse(obj['url']).hostname
+        if 'download_slot' in meta:
+            return meta['download_slot']
+        hostname = hostname or ''
+        if downloader is not None:
+            return downloader._get_host_slot_key(hostname)
+        return hostname
+
+    def push(self, obj, priority=0):
+        slot = self._slot_key(obj)
+        pq = self.pqueues.get(slot)
+        if pq is None:
+            pq = self._addslot(slot)
+        pq.push(obj, priority)
+        self._len += 1
+
+    def _busy(self, slot, now):
+        """Return how busy the given downloader slot is: ``None`` if it can
+        take a request right away, otherwise the number of its active
+        requests"""
+        downloader = self._downloader
+        dslot = downloader.slots.get(slot) if downloader else None
+        if dslot is None:
+            return
+        if len(dslot.active) >= dslot.concurrency:
+            return len(dslot.active)
+        if dslot.delay and dslot.lastseen + dslot.delay > now:
+            return len(dslot.active)
+
+    def pop(self):
+        now = time()
+        fallback, fallback_load = None, None
+        scanned = 0
+        while self._rotation and scanned < self.SCAN_LIMIT:
+            slot = self._rotation.popleft()
+            if slot not in self.pqueues:
+                self._in_rotation.discard(slot)
+                continue
+            self._rotation.append(slot)
+            scanned += 1
+            load = self._busy(slot, now)
+            if load is None:
+                return self._popslot(slot)
+            if fallback is None or load < fallback_load:
+                fallback, fallback_load = slot, load
+        if fallback is not None:
+            return self._popslot(fallback)
+
+    def _popslot(self, slot):
+        pq = self.pqueues[slot]
+        obj = pq.pop()
+        if obj is not None:
+            self._len -= 1
+        if not len(pq):
+            pq.close()
+            del self.pqueues[slot]
+        return obj
+
+    def close(self):
+        active = {}
+        for slot, pq in self.pqueues.items():
+            prios = pq.close()
+            if prios:
+                active[slot] = prios
+        self.pqueues.clear()
+        self._rotation.clear()
+        self._in_rotation.clear()
+        self._len = 0
+        return active
+
+    def __len__(self):
+        return self._len
@@ -1,31 +1,229 @@
+from time import time
+
 from twisted.internet import defer
+from twisted.internet.abstract import isIPAddress, isIPv6Address
 from twisted.internet.base import ThreadedResolver
+from twisted.internet.error import DNSLookupError
+from twisted.internet.interfaces import IResolverSimple
+from twisted.python.failure import Failure
+from zope.interface.declarations import implementer
 
-from scrapy.utils.datatypes import LocalCache
+from scrapy.utils.datatypes import LRUCache
+from scrapy.utils.misc import load_object
 
-# TODO: cache misses
 
-dnscache = LocalCache(10000)
+class DNSCache(object):
+    """LRU cache of resolved host names.
 
-class CachingThreadedResolver(ThreadedResolver):
-    def __init__(self, reactor, cache_size, timeout):
-        super(CachingThreadedResolver, self).__init__(reactor)
-        dnscache.limit = cache_size
+    Every entry expires after the TTL it was stored with (never if it is
+    ``None``); names with a TTL of 0 are not cached at all. Failed lookups are stored as negative entries, with a ``None``
+    address. ``hits``, ``misses`` and ``negative_hits`` count the
+    :meth:`lookup` results.
+    """
+
+    def __init__(self, limit=10000):
+        self._entries = LRUCache(limit)
+        self.hits = self.misses = self.negative_hits = 0
+
+    @property
+    def limit(self):
+        return self._entries.limit
+
+    @limit.setter
+    def limit(self, limit):
+        self._entries.limit = limit
+        while limit is not None and len(self._entries) > limit:
+            self._entries.popitem(last=False)
+
+    def _entry(self, name):
+        entry = self._entries.get(name)
+        if entry is not None and entry[1] is not None and entry[1] < time():
+            del self._entries[name]
+            return
+        return entry
+
+    def lookup(self, name):
+        """Return the ``(address, expires)`` entry for ``name``, or ``None``
+        if it is not cached. ``expires`` is ``None`` for entries that never
+        expire"""
+        entry = self._entry(name)
+        if entry is None:
+            self.misses += 1
+        elif entry[0] is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def set(self, name, address, ttl=None):
+        if not self.limit:
+            return
+        if ttl is None:
+            self._entries[name] = (address, None)
+        elif ttl > 0:
+            self._entries[name] = (address, time() + ttl)
+        else:
+            # not cacheable: do not keep serving an older address either
+            self._entries.pop(name, None)
+
+    def get(self, name, default=None):
+        """Return the cached address for ``name``, or ``default``"""
+        entry = self._entry(name)
+        if entry is None or entry[0] is None:
+            return default
+        return entry[0]
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __getitem__(self, name):
+        address = self.get(name)
+        if address is None:
+            raise KeyError(name)
+        return address
+
+    def __setitem__(self, name, address):
+        self.set(name, address)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+dnscache = DNSCache(10000)
+
+
+class ThreadedBackend(object):
+    """Resolve names with the system resolver, in the reactor thread pool.
+
+    The TTL of the records is not known, so results get the ``default_ttl``
+    of the resolver."""
+
+    def __init__(self, reactor):
+        self._resolver = ThreadedResolver(reactor)
+
+    def lookup(self, name, timeout):
+        d = self._resolver.getHostByName(name, (timeout,))
+        d.addCallback(lambda address: (address, None))
+        return d
+
+
+class NamesBackend(object):
+    """Resolve names with the asynchronous :mod:`twisted.names` client, using
+    the nameservers of ``/etc/resolv.conf`` (and ``/etc/hosts``). Lookups
+    do not use threads, so their concurrency is not bound by
+    ``REACTOR_THREADPOOL_MAXSIZE``."""
+
+    def __init__(self, reactor):
+        from twisted.names import client, dns
+        self._dns = dns
+        self._resolver = client.createResolver()
+
+    def lookup(self, name, timeout):
+        d = self._resolver.lookupAddress(name, timeout=(timeout,))
+        d.addCallback(self._address, name, timeout)
+        return d
+
+    def _address(self, result, name, timeout):
+        answers = result[0]
+        ttl = None
+        for rr in answers:
+            if rr.type in (self._dns.A, self._dns.CNAME):
+                ttl = rr.ttl if ttl is None else min(ttl, rr.ttl)
+            if rr.type == self._dns.A:
+                return rr.payload.dottedQuad(), ttl
+        # answers without a final A record (e.g. a CNAME chain the
+        # nameserver did not follow): let the resolver chase it
+        d = self._resolver.getHostByName(name, timeout=(timeout,))
+        d.addCallback(lambda address: (address, ttl))
+        return d
+
+
+@implementer(IResolverSimple)
+class CachingResolver(object):
+    """Resolver caching results in :data:`dnscache`, honoring the TTL given
+    by its backend (``default_ttl`` when unknown, never less than
+    ``min_ttl``). Results with a TTL of 0 are not cached, while a
+    ``default_ttl`` of 0 keeps results of unknown TTL cached forever.
+
+    Failed and timed out lookups are cached for ``negative_ttl`` seconds
+    (not at all if 0), and always fail with ``DNSLookupError``. Concurrent
+    lookups of the same name share a single backend query. IP addresses are
+    returned as they are, without querying the backend.
+    """
+
+    def __init__(self, reactor, backend, cache_size, timeout, default_ttl=0,
+                 min_ttl=0, negative_ttl=0):
+        self.reactor = reactor
+        self.backend = backend
         self.timeout = timeout
+        self.default_ttl = default_ttl
+        self.min_ttl = min_ttl
+        self.negative_ttl = negative_ttl
+        dnscache.limit = cache_size
+        self._pending = {}
+
+    @classmethod
+    def from_settings(cls, settings, reactor):
+        if settings.getbool('DNSCACHE_ENABLED'):
+            cache_size = settings.getint('DNSCACHE_SIZE')
+        else:
+            cache_size = 0
+        backendcls = load_object(settings['DNS_RESOLVER_BACKEND'])
+        return cls(reactor, backendcls(reactor), cache_size,
+                   timeout=settings.getfloat('DNS_TIMEOUT'),
+                   default_ttl=settings.getint('DNSCACHE_DEFAULT_TTL'),
+                   min_ttl=settings.getint('DNSCACHE_MIN_TTL'),
+                   negative_ttl=settings.getint('DNSCACHE_NEGATIVE_TTL'))
 
     def getHostByName(self, name, timeout=None):
-        if name in dnscache:
-            return defer.succeed(dnscache[name])
+        if isIPAddress(name) or isIPv6Address(name):
+            return defer.succeed(name)
+        if dnscache.limit:
+            entry = dnscache.lookup(name)
+            if entry is not None:
+                if entry[0] is None:
+                    return defer.fail(DNSLookupError(name))
+                return defer.succeed(entry[0])
+        waiter = defer.Deferred()
+        if name in self._pending:
+            self._pending[name].append(waiter)
+            return waiter
+        self._pending[name] = [waiter]
         # in Twisted<=16.6, getHostByName() is always called with
         # a default timeout of 60s (actually passed as (1, 3, 11, 45) tuple),
         # so the input argument above is simply overridden
         # to enforce Scrapy's DNS_TIMEOUT setting's value
-        timeout = (self.timeout,)
-        d = super(CachingThreadedResolver, self).getHostByName(name, timeout)
-        if dnscache.limit:
-            d.addCallback(self._cache_result, name)
-        return d
+        d = defer.maybeDeferred(self.backend.lookup, name, self.timeout)
+        d.addCallbacks(self._resolved, self._failed,
+                       callbackArgs=(name,), errbackArgs=(name,))
+        return waiter
 
-    def _cache_result(self, result, name):
-        dnscache[name] = result
-        return result
+    def _resolved(self, result, name):
+        address, ttl = result
+        if ttl is None:
+            ttl = self.default_ttl or None
+        elif ttl < self.min_ttl:
+            ttl = self.min_ttl
+        dnscache.set(name, address, ttl)
+        for waiter in self._pending.pop(name):
+            waiter.callback(address)
+
+    def _failed(self, failure, name):
+        if self.negative_ttl:
+            dnscache.set(name, None, self.negative_ttl)
+        # same error as negative cache hits, whatever the backend raised
+        # (timeouts, nameserver errors...): it is what retries and
+        # Twisted's name resolution expect
+        if not failure.check(DNSLookupError):
+            failure = Failure(DNSLookupError(
+                '%s: %s' % (name, failure.getErrorMessage())))
+        for waiter in self._pending.pop(name):
+            waiter.errback(failure)
+
+
+class CachingThreadedResolver(CachingResolver):
+    """:class:`CachingResolver` using the :class:`ThreadedBackend`"""
+
+    def __init__(self, reactor, cache_size, timeout):
+        super(CachingThreadedResolver, self).__init__(
+            reactor, ThreadedBackend(reactor), cache_size, timeout)
@@ -21,6 +21,10 @@ import six
 
 AJAXCRAWL_ENABLED = False
 
+## 允许的域名列表文件（每行一个域名，# 开头为注释），OffsiteMiddleware 启动时加载，
+## 与 Spider 的 allowed_domains 合并；Spider 也可以通过 allowed_domains_file 属性单独指定
+ALLOWED_DOMAINS_FILE = None
+
 AUTOTHROTTLE_ENABLED = False
 AUTOTHROTTLE_DEBUG = False
 AUTOTHROTTLE_MAX_DELAY = 60.0
@@ -43,6 +47,15 @@ COMPRESSION_ENABLED = True
 ## Item 处理器（管道）能处理的每个响应的 items 的最大并发量
 CONCURRENT_ITEMS = 100
 
+## 运行爬虫的 worker 进程数，大于 1 时按下载 slot（域名）的一致性哈希将请求分配给各个 worker 进程，
+## 各 worker 的统计数据在爬取结束时合并（见 scrapy.core.sharding）
+CRAWL_WORKERS = 1
+
+## 执行 CPU 密集型回调（@cpu_bound 或 meta['cpu_bound']）的进程池大小，0 表示 CPU 核数
+CPU_BOUND_PROCESSES = 0
+## 进程池中最多同时等待处理的响应数，达到后引擎暂停向 scraper 输送响应，0 表示进程数的 2 倍
+CPU_BOUND_MAX_PENDING = 0
+
 ## Scrapy 下载器发起请求的最大并发量
 CONCURRENT_REQUESTS = 16
 ## 任何一个域，所能发起请求的最大并发量
@@ -73,8 +86,21 @@ DEPTH_PRIORITY = 0
 DNSCACHE_ENABLED = True
 ## DNS 缓存的最大值
 DNSCACHE_SIZE = 10000
+## DNS 缓存记录的有效期（秒）：后端不提供记录 TTL 时使用的默认值（0 表示不过期），
+## TTL 的下限（TTL 最终为 0 的记录不缓存），以及查询失败（域名不存在、超时）结果的
+## 缓存时间（0 表示不缓存）
+DNSCACHE_DEFAULT_TTL = 0
+DNSCACHE_MIN_TTL = 60
+DNSCACHE_NEGATIVE_TTL = 60
 ## 处理 DNS 查询的超时时间（以秒为单位）
 DNS_TIMEOUT = 60
+## 执行 DNS 查询的后端：ThreadedBackend 在 reactor 线程池中调用系统解析器；
+## NamesBackend 使用 twisted.names 异步查询，并发数不受线程池大小限制
+DNS_RESOLVER_BACKEND = 'scrapy.resolver.ThreadedBackend'
+## DNS 预解析：是否启用、同时进行的查询数，以及等待解析的主机名数量上限
+DNS_PREFETCH_ENABLED = False
+DNS_PREFETCH_CONCURRENCY = 16
+DNS_PREFETCH_QUEUE_SIZE = 10000
 
 ## 下载延迟，下载器在下载同一网站的连续页面时，应该等待的时间
 ## 一般用来限制爬取速度，避免对服务器造成压力
@@ -151,10 +177,20 @@ DOWNLOADER_MIDDLEWARES_BASE = {
     # Downloader side
 }
 
+## 为 True 时，同一 CrawlerRunner/CrawlerProcess 中的所有 crawler 共用一个下载器
+## （下载处理器和连接池、下载 slot、robots.txt 缓存），各 crawler 的下载器中间件、管道和统计仍各自独立
+SHARED_DOWNLOADER = False
+
 DOWNLOADER_STATS = True
+## 为 True 时，DownloaderStats 还按下载 slot 统计响应的字节数
+DOWNLOADER_STATS_PER_SLOT = False
 
 ## 用于检测和过滤重复请求的类
+## 海量请求时可使用 'scrapy.dupefilters.CompactRFPDupeFilter'（二进制指纹 + mmap 存储）
 DUPEFILTER_CLASS = 'scrapy.dupefilters.RFPDupeFilter'
+## BloomDupeFilter 的容量与可接受的误判率（用于计算位数组大小）
+DUPEFILTER_EXPECTED_ITEMS = 1000000
+DUPEFILTER_FP_RATE = 0.001
 
 ## 当使用 edit 命令编辑 spiders 时，默认使用的编辑器
 EDITOR = 'vi'
@@ -175,6 +211,7 @@ EXTENSIONS_BASE = {
     'scrapy.extensions.logstats.LogStats': 0,
     'scrapy.extensions.spiderstate.SpiderState': 0,
     'scrapy.extensions.throttle.AutoThrottle': 0,
+    'scrapy.extensions.dnsprefetch.DnsPrefetch': 0,
 }
 
 ## 数据导出的相关设置
@@ -205,10 +242,18 @@ FEED_EXPORTERS_BASE = {
 }
 FEED_EXPORT_INDENT = 0
 
+## 媒体管道（FilesPipeline、ImagesPipeline 等）在内存中保留的已下载结果的最大数量（按最近使用淘汰），0 表示不限制；
+## 设置了 JOBDIR 时，成功的结果还会保存在 JOBDIR 下，淘汰后或恢复任务时仍可用于去重
+MEDIA_RESULTS_LIMIT = 100000
+
 ## 文件储存的相关设置
 
 FILES_STORE_S3_ACL = 'private'
 FILES_STORE_GCS_ACL = ''
+## 本地文件储存（FSFilesStore）用于磁盘读写和计算校验和的线程数
+FILES_STORE_THREADS = 4
+## 为 True 时，FilesPipeline 将文件的响应体流式写入临时文件，而不是在内存中缓存整个响应体
+FILES_STREAM = False
 
 ## 上传数据到 FTP 服务器上的相关设置
 
@@ -230,6 +275,13 @@ HTTPCACHE_IGNORE_RESPONSE_CACHE_CONTROLS = []
 HTTPCACHE_DBM_MODULE = 'anydbm' if six.PY2 else 'dbm'
 HTTPCACHE_POLICY = 'scrapy.extensions.httpcache.DummyPolicy'
 HTTPCACHE_GZIP = False
+## ThreadedFilesystemCacheStorage 进行磁盘读写所用线程池的大小
+HTTPCACHE_THREADPOOL_MAXSIZE = 4
+## PackedCacheStorage 单个段文件的最大字节数
+HTTPCACHE_SEGMENT_SIZE = 256*1024*1024   # 256m
+## MemoryCacheStorage 的内存层（LRU）最多占用的字节数，及其后端存储类
+HTTPCACHE_MEMORY_MAXSIZE = 64*1024*1024   # 64m
+HTTPCACHE_MEMORY_BACKEND = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
 
 ## HTTP 代理相关设置
 HTTPPROXY_ENABLED = True
@@ -238,6 +290,12 @@ HTTPPROXY_AUTH_ENCODING = 'latin-1'
 ## 图片储存的相关设置
 IMAGES_STORE_S3_ACL = 'private'
 IMAGES_STORE_GCS_ACL = ''
+## 图片的解码、转换、缩略图生成和编码在哪里执行：''（reactor 线程，默认）、'thread'（线程池）
+## 或 'process'（进程池）。使用池时，get_images、convert_image、file_path、thumb_path
+## 及其重写方法不在 reactor 线程中执行，必须是线程安全的（进程池中还必须可以被 fork 复制）
+IMAGES_PROCESSING_POOL = ''
+## 图片处理池的线程数或进程数，为 0 时使用 CPU 核数
+IMAGES_PROCESSING_WORKERS = 0
 
 ## item 处理器
 ITEM_PROCESSOR = 'scrapy.pipelines.ItemPipelineManager'
@@ -301,6 +359,11 @@ NEWSPIDER_MODULE = ''
 RANDOMIZE_DOWNLOAD_DELAY = True
 
 REACTOR_THREADPOOL_MAXSIZE = 10
+## defer_succeed/defer_fail 推迟回调的方式：'delay'（延迟 REACTOR_YIELD_DELAY 秒）、
+## 'tick'（下一轮 reactor 循环）或 'budget'（每轮 reactor 循环最多执行 REACTOR_YIELD_BUDGET 个）
+REACTOR_YIELD_POLICY = 'budget'
+REACTOR_YIELD_DELAY = 0.1
+REACTOR_YIELD_BUDGET = 100
 
 ## 重定向的相关配置
 
@@ -311,6 +374,9 @@ REDIRECT_PRIORITY_ADJUST = +2
 REFERER_ENABLED = True
 REFERRER_POLICY = 'scrapy.spidermiddlewares.referer.DefaultReferrerPolicy'
 
+## 请求指纹生成器：去重过滤器、HTTP 缓存、媒体管道共用同一个实例
+REQUEST_FINGERPRINTER_CLASS = 'scrapy.utils.request.RequestFingerprinter'
+
 ## 重发请求的相关配置
 
 RETRY_ENABLED = True
@@ -325,10 +391,15 @@ ROBOTSTXT_OBEY = False
 
 SCHEDULER = 'scrapy.core.scheduler.Scheduler'
 ## 基于磁盘的任务队列：后进先出
+## 可改用 'scrapy.squeues.BatchedLifoDiskQueue'（按块批量读写、紧凑编码）以加快 JOBDIR 爬取
 SCHEDULER_DISK_QUEUE = 'scrapy.squeues.PickleLifoDiskQueue'
 ## 基于内存的任务队列：后进先出
 SCHEDULER_MEMORY_QUEUE = 'scrapy.squeues.LifoMemoryQueue'
+## 混合模式（需要 JOBDIR）：内存队列中请求数量或字节数超出限制后，才将低优先级请求转移到磁盘，0 表示不限制
+SCHEDULER_MEMORY_QUEUE_BYTES = 0
+SCHEDULER_MEMORY_QUEUE_LIMIT = 0
 ## 基于优先级的任务队列
+## 广度爬取时可改用 'scrapy.pqueues.DownloaderAwarePriorityQueue'，按下载槽（域名）轮流出队
 SCHEDULER_PRIORITY_QUEUE = 'queuelib.PriorityQueue'
 
 SPIDER_LOADER_CLASS = 'scrapy.spiderloader.SpiderLoader'
@@ -341,6 +412,8 @@ SPIDER_MIDDLEWARES = {}
 SPIDER_MIDDLEWARES_BASE = {
     # Engine side
 
+    ## 多进程爬取时，将请求转发给它所属的 worker 进程
+    'scrapy.spidermiddlewares.sharding.ShardingMiddleware': 25,
     ## 会针对状态码 200 的响应进行相关处理
     'scrapy.spidermiddlewares.httperror.HttpErrorMiddleware': 50,
     ## 如果 Spider 中定义了 allowed_domains，会自动过滤除此之外的域名请求
@@ -10,6 +10,7 @@ import warnings
 from scrapy import signals
 from scrapy.http import Request
 from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.url import DomainMatcher
 
 logger = logging.getLogger(__name__)
 
@@ -20,12 +21,13 @@ class OffsiteMiddleware(object):
     ## 如果请求中设置了 dont_filter 为 True，则该请求不会被过滤，不管该请求是否在
     ## allowed_domains 中
 
-    def __init__(self, stats):
+    def __init__(self, stats, domains_file=None):
         self.stats = stats
+        self.domains_file = domains_file
 
     @classmethod
     def from_crawler(cls, crawler):
-        o = cls(crawler.stats)
+        o = cls(crawler.stats, crawler.settings.get('ALLOWED_DOMAINS_FILE'))
         crawler.signals.connect(o.spider_opened, signal=signals.spider_opened)
         return o
 
@@ -53,19 +55,32 @@ class OffsiteMiddleware(object):
         return bool(regex.search(host))
 
     def get_host_regex(self, spider):
-        """Override this method to implement a different offsite policy"""
+        """Override this method to implement a different offsite policy.
+
+        It returns an object whose ``search()`` method is called with the
+        host names of the requests: a regex, or a
+        :class:`~scrapy.utils.url.DomainMatcher` of the allowed domains.
+        """
+        ## allowed_domains 可能非常多（如数万个域名），因此用按标签倒序组织的
+        ## DomainMatcher 代替一个巨大的正则表达式，匹配耗时只与主机名的标签数有关
         allowed_domains = getattr(spider, 'allowed_domains', None)
-        if not allowed_domains:
+        domains_file = getattr(spider, 'allowed_domains_file', self.domains_file)
+        if not allowed_domains and not domains_file:
             return re.compile('')  # allow all by default
         url_pattern = re.compile("^https?://.*$")
-        for domain in allowed_domains:
-            if url_pattern.match(domain):
+        for domain in allowed_domains or ():
+            if domain is not None and url_pattern.match(domain):
                 message = ("allowed_domains accepts only domains, not URLs. "
                            "Ignoring URL entry %s in allowed_domains." % domain)
                 warnings.warn(message, URLWarning)
-        domains = [re.escape(d) for d in allowed_domains if d is not None]
-        regex = r'^(.*\.)?(%s)$' % '|'.join(domains)
-        return re.compile(regex)
+        matcher = DomainMatcher(d for d in allowed_domains or () if d is not None)
+        if domains_file:
+            matcher.load(domains_file)
+            logger.info("Loaded allowed domains from %(path)s (%(count)d "
+                        "domains allowed)",
+                        {'path': domains_file, 'count': len(matcher)},
+                        extra={'spider': spider})
+        return matcher
 
     def spider_opened(self, spider):
         self.host_regex = self.get_host_regex(spider)
@@ -0,0 +1,38 @@
+"""
+Sharding Spider Middleware
+
+Sends the requests which belong to other workers of a multi-process crawl to
+them, see :mod:`scrapy.core.sharding`.
+"""
+from scrapy.http import Request
+from scrapy.exceptions import NotConfigured
+
+
+class ShardingMiddleware(object):
+    ## 多进程爬取时，将不属于当前 worker 的请求转发给它所属的 worker；
+    ## 每个 worker 都会生成全部的初始请求，只保留属于自己的那部分
+
+    def __init__(self, shard, stats):
+        self.shard = shard
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if crawler.shard is None:
+            raise NotConfigured
+        return cls(crawler.shard, crawler.stats)
+
+    def process_spider_output(self, response, result, spider):
+        for x in result:
+            if isinstance(x, Request) and not self.shard.owns(x) \
+                    and self.shard.route(x, spider):
+                self.stats.inc_value('shard/requests_routed', spider=spider)
+                continue
+            yield x
+
+    def process_start_requests(self, start_requests, spider):
+        for r in start_requests:
+            if isinstance(r, Request) and not self.shard.owns(r):
+                self.stats.inc_value('shard/start_requests_skipped', spider=spider)
+                continue
+            yield r
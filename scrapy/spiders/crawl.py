@@ -11,6 +11,7 @@ import six
 from scrapy.http import Request, HtmlResponse
 from scrapy.utils.spider import iterate_spider_output
 from scrapy.spiders import Spider
+from scrapy.linkextractors.lxmlhtml import RuleSetLinkExtractor
 
 
 def identity(x):
@@ -57,9 +58,10 @@ class CrawlSpider(Spider):
         if not isinstance(response, HtmlResponse):
             return
         seen = set()
+        ## 所有规则的链接在一次文档遍历中提取，再按规则顺序分派（链接归第一个匹配的规则）
+        rule_links = self._rules_link_extractor.extract_links(response)
         for n, rule in enumerate(self._rules):
-            links = [lnk for lnk in rule.link_extractor.extract_links(response)
-                     if lnk not in seen]
+            links = [lnk for lnk in rule_links[n] if lnk not in seen]
             if links and rule.process_links:
                 links = rule.process_links(links)
             for link in links:
@@ -94,6 +96,8 @@ class CrawlSpider(Spider):
             rule.callback = get_method(rule.callback)
             rule.process_links = get_method(rule.process_links)
             rule.process_request = get_method(rule.process_request)
+        self._rules_link_extractor = RuleSetLinkExtractor(
+            [rule.link_extractor for rule in self._rules])
 
     @classmethod
     def from_crawler(cls, crawler, *args, **kwargs):
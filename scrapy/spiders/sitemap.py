@@ -5,7 +5,8 @@ import six
 from scrapy.spiders import Spider
 from scrapy.http import Request, XmlResponse
 from scrapy.utils.sitemap import Sitemap, sitemap_urls_from_robots
-from scrapy.utils.gz import gunzip, gzip_magic_number
+from scrapy.utils.gz import gunzip, iter_gunzip, gzip_magic_number
+from scrapy.core.downloader.stream import DecompressionMaxSizeExceeded
 
 
 logger = logging.getLogger(__name__)
@@ -44,25 +45,55 @@ class SitemapSpider(Spider):
             for url in sitemap_urls_from_robots(response.text, base_url=response.url):
                 yield Request(url, callback=self._parse_sitemap)
         else:
-            body = self._get_sitemap_body(response)
+            body = self._get_sitemap_document(response)
             if body is None:
                 logger.warning("Ignoring invalid sitemap: %(response)s",
                                {'response': response}, extra={'spider': self})
                 return
 
-            s = Sitemap(body)
-            it = self.sitemap_filter(s)
-
-            if s.type == 'sitemapindex':
-                for loc in iterloc(it, self.sitemap_alternate_links):
-                    if any(x.search(loc) for x in self._follow):
-                        yield Request(loc, callback=self._parse_sitemap)
-            elif s.type == 'urlset':
-                for loc in iterloc(it, self.sitemap_alternate_links):
-                    for r, c in self._cbs:
-                        if r.search(loc):
-                            yield Request(loc, callback=c)
-                            break
+            ## 边解析边生成请求：站点地图被增量解析，请求在解析到对应条目时立即产出
+            try:
+                s = Sitemap(body)
+                it = self.sitemap_filter(s)
+
+                if s.type == 'sitemapindex':
+                    for loc in iterloc(it, self.sitemap_alternate_links):
+                        if any(x.search(loc) for x in self._follow):
+                            yield Request(loc, callback=self._parse_sitemap)
+                elif s.type == 'urlset':
+                    for loc in iterloc(it, self.sitemap_alternate_links):
+                        for r, c in self._cbs:
+                            if r.search(loc):
+                                yield Request(loc, callback=c)
+                                break
+            except DecompressionMaxSizeExceeded:
+                logger.warning("Stopped parsing gzipped sitemap %(response)s: "
+                               "it exceeds the download max size "
+                               "(%(maxsize)s) once decompressed",
+                               {'response': response,
+                                'maxsize': self._sitemap_maxsize(response)},
+                               extra={'spider': self})
+
+    def _get_sitemap_document(self, response):
+        """Return the sitemap document contained in the given response, as
+        returned by :meth:`_get_sitemap_body` unless it is gzipped: it is
+        then an iterable of chunks, decompressed as the sitemap is parsed.
+        """
+        overridden = six.get_unbound_function(type(self)._get_sitemap_body) \
+            is not six.get_unbound_function(SitemapSpider._get_sitemap_body)
+        if not overridden and not isinstance(response, XmlResponse) \
+                and gzip_magic_number(response):
+            return iter_gunzip(response.body, self._sitemap_maxsize(response))
+        return self._get_sitemap_body(response)
+
+    def _sitemap_maxsize(self, response):
+        settings = getattr(self, 'settings', None)
+        maxsize = getattr(self, 'download_maxsize',
+                          settings.getint('DOWNLOAD_MAXSIZE') if settings else 0)
+        # responses built by hand may not be tied to a request
+        if response.request is not None:
+            maxsize = response.request.meta.get('download_maxsize', maxsize)
+        return maxsize
 
     def _get_sitemap_body(self, response):
         """Return the sitemap body contained in the given response,
@@ -71,7 +102,16 @@ class SitemapSpider(Spider):
         if isinstance(response, XmlResponse):
             return response.body
         elif gzip_magic_number(response):
-            return gunzip(response.body)
+            maxsize = self._sitemap_maxsize(response)
+            try:
+                return gunzip(response.body, maxsize)
+            except DecompressionMaxSizeExceeded:
+                logger.warning("Ignoring gzipped sitemap %(response)s: it "
+                               "exceeds the download max size (%(maxsize)s) "
+                               "once decompressed",
+                               {'response': response, 'maxsize': maxsize},
+                               extra={'spider': self})
+                return
         # actual gzipped sitemap files are decompressed above ;
         # if we are here (response body is not gzipped)
         # and have a response for .xml.gz,
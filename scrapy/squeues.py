@@ -2,7 +2,12 @@
 Scheduler queues
 """
 
+import os
+import json
+import glob
+import struct
 import marshal
+from collections import deque
 from six.moves import cPickle as pickle
 
 from queuelib import queue
@@ -47,3 +52,274 @@ MarshalLifoDiskQueue = _serializable_queue(queue.LifoDiskQueue, \
 FifoMemoryQueue = queue.FifoMemoryQueue
 ## 后进先出内存队列
 LifoMemoryQueue = queue.LifoMemoryQueue
+
+
+_REQUEST_FIELDS = ('url', 'callback', 'errback', 'method', 'headers', 'body',
+                   'cookies', 'meta', '_encoding', 'priority', 'dont_filter',
+                   'flags')
+_SIZE = struct.Struct('>L')
+
+
+class _BatchedDiskQueue(object):
+    """Base class for disk queues of request dicts (as returned by
+    :func:`~scrapy.utils.reqser.request_to_dict`) which are written and read
+    in blocks of up to ``batch_size`` records.
+
+    Request dicts are stored as fixed-order rows with the callback and
+    errback names interned in a per-queue table, serialized with ``marshal``
+    when possible and with ``pickle`` otherwise. Records are serialized as
+    soon as they are pushed, so unserializable requests are still rejected
+    with ``ValueError`` at push time, but they only reach the disk once a
+    whole block is full. A whole block is deserialized when read, so the
+    following pops are served from memory.
+    """
+
+    batch_size = 100
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.info = self._loadinfo()
+        self._names = self.info['names']
+        self._name_ids = dict((n, i) for i, n in enumerate(self._names))
+        self._wbuf = []
+
+    def _intern(self, name):
+        if name is None:
+            return None
+        try:
+            return self._name_ids[name]
+        except KeyError:
+            self._names.append(name)
+            i = self._name_ids[name] = len(self._names) - 1
+            return i
+
+    def _encode(self, obj):
+        if isinstance(obj, dict) and all(f in obj for f in _REQUEST_FIELDS):
+            row = [obj[f] for f in _REQUEST_FIELDS]
+            row[1] = self._intern(row[1])
+            row[2] = self._intern(row[2])
+            extra = dict((k, v) for k, v in obj.items()
+                         if k not in _REQUEST_FIELDS)
+            row.append(extra or None)
+            data = tuple(row)
+        else:
+            data = (obj,)
+        try:
+            return b'm' + marshal.dumps(data)
+        except ValueError:
+            return b'p' + _pickle_serialize(data)
+
+    def _decode(self, record):
+        if record[:1] == b'm':
+            data = marshal.loads(record[1:])
+        else:
+            data = pickle.loads(record[1:])
+        if len(data) == 1:
+            return data[0]
+        d = dict(zip(_REQUEST_FIELDS, data))
+        for f in ('callback', 'errback'):
+            if d[f] is not None:
+                d[f] = self._names[d[f]]
+        if data[-1]:
+            d.update(data[-1])
+        return d
+
+    def _pack(self, records):
+        return b''.join(_SIZE.pack(len(r)) + r for r in records)
+
+    def _unpack(self, block):
+        records, pos, end = [], 0, len(block)
+        while pos < end:
+            size = _SIZE.unpack_from(block, pos)[0]
+            pos += _SIZE.size
+            records.append(self._decode(block[pos:pos + size]))
+            pos += size
+        return records
+
+    def _infopath(self):
+        return os.path.join(self.path, 'info.json')
+
+    def _loadinfo(self):
+        infopath = self._infopath()
+        if os.path.exists(infopath):
+            with open(infopath) as f:
+                return json.load(f)
+        return self._newinfo()
+
+    def _newinfo(self):
+        return {'size': 0, 'names': []}
+
+    def _saveinfo(self):
+        with open(self._infopath(), 'w') as f:
+            json.dump(self.info, f)
+
+    def _cleanup(self):
+        for x in glob.glob(os.path.join(self.path, 'q*')):
+            os.remove(x)
+        os.remove(self._infopath())
+        if not os.listdir(self.path):
+            os.rmdir(self.path)
+
+    def __len__(self):
+        return self.info['size']
+
+
+class BatchedFifoDiskQueue(_BatchedDiskQueue):
+    """Persistent FIFO queue of request dicts, see
+    :class:`_BatchedDiskQueue`. Blocks are appended to chunk files holding up
+    to ``chunksize`` records, and each chunk file is removed once read."""
+
+    chunksize = 100000
+
+    def __init__(self, path):
+        super(BatchedFifoDiskQueue, self).__init__(path)
+        self.headf = self._openchunk(self.info['head'][0], 'ab+')
+        tnum, toffset, tskip = self.info['tail']
+        self.tailf = self._openchunk(tnum)
+        self.tailf.seek(toffset)
+        self._rbuf = deque()
+        self._rblock = 0
+        if tskip:
+            self._readblock()
+            for _ in range(tskip):
+                self._rbuf.popleft()
+
+    def _newinfo(self):
+        info = super(BatchedFifoDiskQueue, self)._newinfo()
+        info.update(head=[0, 0], tail=[0, 0, 0])
+        return info
+
+    def _openchunk(self, number, mode='rb'):
+        return open(os.path.join(self.path, 'q%05d' % number), mode)
+
+    def push(self, obj):
+        self._wbuf.append(self._encode(obj))
+        self.info['size'] += 1
+        if len(self._wbuf) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._wbuf:
+            return
+        block = self._pack(self._wbuf)
+        self.headf.write(_SIZE.pack(len(block)) + block)
+        self.headf.flush()
+        hnum, hcount = self.info['head']
+        hcount += len(self._wbuf)
+        if hcount >= self.chunksize:
+            hnum, hcount = hnum + 1, 0
+            self.headf.close()
+            self.headf = self._openchunk(hnum, 'ab+')
+        self.info['head'] = [hnum, hcount]
+        self._wbuf = []
+
+    def _readblock(self):
+        tnum, toffset, _ = self.info['tail']
+        while True:
+            szhdr = self.tailf.read(_SIZE.size)
+            if szhdr:
+                break
+            if tnum >= self.info['head'][0]:
+                return
+            self.tailf.close()
+            os.remove(self.tailf.name)
+            tnum, toffset = tnum + 1, 0
+            self.tailf = self._openchunk(tnum)
+            self.info['tail'] = [tnum, toffset, 0]
+        block = self.tailf.read(_SIZE.unpack(szhdr)[0])
+        records = self._unpack(block)
+        self._rbuf.extend(records)
+        self._rblock = len(records)
+        self.info['tail'] = [tnum, toffset, 0]
+
+    def pop(self):
+        if not self._rbuf:
+            if self._rblock:
+                # the previous block was fully consumed
+                tnum, _, _ = self.info['tail']
+                self.info['tail'] = [tnum, self.tailf.tell(), 0]
+                self._rblock = 0
+            self._readblock()
+        if self._rbuf:
+            obj = self._rbuf.popleft()
+        elif self._wbuf:
+            obj = self._decode(self._wbuf.pop(0))
+        else:
+            return
+        self.info['size'] -= 1
+        return obj
+
+    def close(self):
+        self._flush()
+        tnum, toffset, _ = self.info['tail']
+        if self._rbuf:
+            self.info['tail'] = [tnum, toffset, self._rblock - len(self._rbuf)]
+        elif self._rblock:
+            self.info['tail'] = [tnum, self.tailf.tell(), 0]
+        self.headf.close()
+        self.tailf.close()
+        self._saveinfo()
+        if len(self) == 0:
+            self._cleanup()
+
+
+class BatchedLifoDiskQueue(_BatchedDiskQueue):
+    """Persistent LIFO queue of request dicts, see
+    :class:`_BatchedDiskQueue`. Blocks are stored in a single file, each one
+    followed by its size so that the last block can be read and truncated."""
+
+    def __init__(self, path):
+        super(BatchedLifoDiskQueue, self).__init__(path)
+        qpath = os.path.join(self.path, 'q')
+        self.f = open(qpath, 'rb+' if os.path.exists(qpath) else 'wb+')
+        self.f.seek(0, os.SEEK_END)
+        self._rbuf = []
+
+    def push(self, obj):
+        self._wbuf.append(self._encode(obj))
+        self.info['size'] += 1
+        if len(self._wbuf) >= self.batch_size:
+            # records read ahead are older than the pushed ones, so they
+            # must go back to the file first
+            self._flush([self._encode(o) for o in self._rbuf])
+            self._flush(self._wbuf)
+            self._rbuf, self._wbuf = [], []
+
+    def _flush(self, records):
+        if records:
+            block = self._pack(records)
+            self.f.write(block + _SIZE.pack(len(block)))
+
+    def _readblock(self):
+        end = self.f.tell()
+        if not end:
+            return
+        self.f.seek(end - _SIZE.size)
+        size = _SIZE.unpack(self.f.read(_SIZE.size))[0]
+        start = end - _SIZE.size - size
+        self.f.seek(start)
+        self._rbuf = self._unpack(self.f.read(size))
+        self.f.seek(start)
+        self.f.truncate()
+
+    def pop(self):
+        if self._wbuf:
+            obj = self._decode(self._wbuf.pop())
+        else:
+            if not self._rbuf:
+                self._readblock()
+            if not self._rbuf:
+                return
+            obj = self._rbuf.pop()
+        self.info['size'] -= 1
+        return obj
+
+    def close(self):
+        self._flush([self._encode(obj) for obj in self._rbuf])
+        self._flush(self._wbuf)
+        self.f.close()
+        self._saveinfo()
+        if len(self) == 0:
+            self._cleanup()
@@ -306,6 +306,37 @@ class LocalCache(OrderedDict):
         super(LocalCache, self).__setitem__(key, value)
 
 
+class LRUCache(LocalCache):
+    """Dictionary with a finite number of keys.
+
+    Least recently used items expire first.
+
+    """
+
+    def __getitem__(self, key):
+        value = super(LRUCache, self).__getitem__(key)
+        self._touch(key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self:
+            OrderedDict.__delitem__(self, key)
+        super(LRUCache, self).__setitem__(key, value)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def _touch(self, key, value):
+        if six.PY2:
+            OrderedDict.__delitem__(self, key)
+            OrderedDict.__setitem__(self, key, value)
+        else:
+            self.move_to_end(key)
+
+
 class SequenceExclude(object):
     """Object to test if an item is NOT within some sequence."""
 
@@ -42,3 +42,10 @@ def inthread(func):
     def wrapped(*a, **kw):
         return threads.deferToThread(func, *a, **kw)
     return wrapped
+
+
+def cpu_bound(func):
+    """Decorator to mark a spider callback as CPU-bound, so it is called in
+    the callback process pool (see :mod:`scrapy.core.cpubound`)"""
+    func.cpu_bound = True
+    return func
@@ -2,31 +2,106 @@
 Helper functions for dealing with Twisted deferreds
 """
 
+import logging
+from collections import deque
+
 from twisted.internet import defer, reactor, task
 from twisted.python import failure
 
 from scrapy.exceptions import IgnoreRequest
 
+logger = logging.getLogger(__name__)
+
+
+class YieldPolicy(object):
+    """Decide how callbacks postponed by :func:`defer_succeed` and
+    :func:`defer_fail` are given back to the reactor.
+
+    * ``'delay'`` calls each one after ``delay`` seconds (0.1 was the only
+      behaviour of older Scrapy versions)
+    * ``'tick'`` calls each one in the next reactor iteration
+      (``callLater(0)``)
+    * ``'budget'`` queues them and runs at most ``budget`` of them per
+      reactor iteration, so that I/O is still attended between batches
+      while needing a single delayed call per batch
+
+    The reactor processes network events before the delayed calls
+    scheduled during the current iteration, so neither ``'tick'`` nor
+    ``'budget'`` starve readers and writers.
+    """
+
+    def __init__(self, policy='budget', delay=0.1, budget=100):
+        if policy not in ('delay', 'tick', 'budget'):
+            raise ValueError("Unknown yield policy: %r" % policy)
+        self.policy = policy
+        self.delay = delay
+        self.budget = max(budget, 1)
+        self._queue = deque()
+        self._nextcall = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(settings.get('REACTOR_YIELD_POLICY'),
+                   delay=settings.getfloat('REACTOR_YIELD_DELAY'),
+                   budget=settings.getint('REACTOR_YIELD_BUDGET'))
+
+    def call(self, func, *args):
+        if self.policy == 'delay':
+            reactor.callLater(self.delay, func, *args)
+        elif self.policy == 'tick':
+            reactor.callLater(0, func, *args)
+        else:
+            self._queue.append((func, args))
+            if self._nextcall is None:
+                self._nextcall = reactor.callLater(0, self._run)
+
+    def _run(self):
+        self._nextcall = None
+        # calls queued while running wait for the next iteration
+        for _ in range(min(self.budget, len(self._queue))):
+            func, args = self._queue.popleft()
+            try:
+                func(*args)
+            except Exception:
+                # logged like the reactor logs failing delayed calls, the
+                # other queued calls must still run
+                logger.error("Error running postponed call %(func)r",
+                             {'func': func}, exc_info=True)
+        if self._queue:
+            self._nextcall = reactor.callLater(0, self._run)
+
+
+_yield_policy = YieldPolicy('delay')
+
+
+def set_yield_policy(policy):
+    """Set the :class:`YieldPolicy` used by :func:`defer_succeed` and
+    :func:`defer_fail`. Return the previous one."""
+    global _yield_policy
+    previous, _yield_policy = _yield_policy, policy
+    return previous
+
+
 def defer_fail(_failure):
     """Same as twisted.internet.defer.fail but delay calling errback until
     next reactor loop
 
-    It delays by 100ms so reactor has a chance to go through readers and writers
-    before attending pending delayed calls, so do not set delay to zero.
+    How it is delayed depends on the current :class:`YieldPolicy`, so the
+    reactor has a chance to go through readers and writers first.
     """
     d = defer.Deferred()
-    reactor.callLater(0.1, d.errback, _failure)
+    _yield_policy.call(d.errback, _failure)
     return d
 
 def defer_succeed(result):
     """Same as twisted.internet.defer.succeed but delay calling callback until
     next reactor loop
 
-    It delays by 100ms so reactor has a chance to go trough readers and writers
-    before attending pending delayed calls, so do not set delay to zero.
+    How it is delayed depends on the current :class:`YieldPolicy`, so the
+    reactor has a chance to go through readers and writers first.
     """
     d = defer.Deferred()
-    reactor.callLater(0.1, d.callback, result)
+    _yield_policy.call(d.callback, result)
     return d
 
 def defer_result(result):
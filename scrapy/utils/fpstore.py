@@ -0,0 +1,300 @@
+"""
+Compact storage for fixed-size binary fingerprints (like the 20-byte SHA1
+digests used for request fingerprints).
+
+Fingerprints are kept either in an exact open-addressing hash table or in a
+Bloom filter, both laid out in a single ``mmap``. When a path is given the
+structure is backed by that file, so reopening it (for example when resuming
+a job) only maps the file instead of rebuilding an in-memory set.
+
+This module must not depend on any module outside the Standard Library.
+"""
+
+import os
+import math
+import mmap
+import struct
+
+
+_HEADER = struct.Struct('<8sQQQ')
+_HEADER_SIZE = 32
+_MAGIC = b'SFPSTOR1'
+_SLOT_HASH = struct.Struct('<Q')
+
+
+class FingerprintStore(object):
+    """Set-like container of binary fingerprints of ``digest_size`` bytes.
+
+    Fingerprints are expected to be uniformly distributed (cryptographic
+    digests), so their leading bytes are used directly as the hash value.
+    An all-zero fingerprint is reserved to mark empty slots.
+
+    If ``value_size`` is not zero, every fingerprint also carries a value of
+    exactly that many bytes, which can be read with :meth:`get` and written
+    with :meth:`set`, so the store can be used as a fixed-size mapping.
+    """
+
+    max_load = 0.7
+
+    def __init__(self, path=None, digest_size=20, capacity=1 << 16,
+                 value_size=0):
+        self.path = path
+        self.digest_size = digest_size
+        self._empty = b'\x00' * digest_size
+        self._file = None
+        if path and os.path.exists(path) and os.path.getsize(path):
+            self._file = open(path, 'r+b')
+            self._mm = mmap.mmap(self._file.fileno(), 0)
+            magic, self.capacity, self.count, self.value_size = \
+                _HEADER.unpack_from(self._mm, 0)
+            if magic != _MAGIC:
+                self.close()
+                raise ValueError("Not a fingerprint store: %s" % path)
+        else:
+            self.value_size = value_size
+            capacity = _round_capacity(capacity)
+            self._file, self._mm = self._create(path, capacity)
+            self.capacity, self.count = capacity, 0
+        self.slot_size = self.digest_size + self.value_size
+
+    def _create(self, path, capacity):
+        size = _HEADER_SIZE + capacity * (self.digest_size + self.value_size)
+        if path:
+            f = open(path, 'w+b')
+            f.truncate(size)
+            mm = mmap.mmap(f.fileno(), size)
+        else:
+            f, mm = None, mmap.mmap(-1, size)
+        _HEADER.pack_into(mm, 0, _MAGIC, capacity, 0, self.value_size)
+        return f, mm
+
+    def _write_header(self):
+        _HEADER.pack_into(self._mm, 0, _MAGIC, self.capacity, self.count,
+                          self.value_size)
+
+    def _slot(self, mm, capacity, fp):
+        """Return the offset of the slot holding ``fp`` (or of the empty slot
+        where it should go) and whether it was found"""
+        size = self.digest_size
+        slot_size = self.digest_size + self.value_size
+        mask = capacity - 1
+        i = _SLOT_HASH.unpack_from(fp)[0] & mask
+        while True:
+            offset = _HEADER_SIZE + i * slot_size
+            current = mm[offset:offset + size]
+            if current == fp:
+                return offset, True
+            if current == self._empty:
+                return offset, False
+            i = (i + 1) & mask
+
+    def __contains__(self, fp):
+        return self._slot(self._mm, self.capacity, fp)[1]
+
+    def __len__(self):
+        return self.count
+
+    def add(self, fp):
+        """Add ``fp`` to the store. Return ``True`` if it was already there"""
+        return self._insert(fp)[1]
+
+    def _insert(self, fp):
+        if len(fp) != self.digest_size:
+            raise ValueError("Expected a %d-byte fingerprint, got %d bytes"
+                             % (self.digest_size, len(fp)))
+        offset, found = self._slot(self._mm, self.capacity, fp)
+        if found:
+            return offset, True
+        if self.count + 1 > self.capacity * self.max_load:
+            self._grow()
+            offset = self._slot(self._mm, self.capacity, fp)[0]
+        self._mm[offset:offset + self.digest_size] = fp
+        self.count += 1
+        self._write_header()
+        return offset, False
+
+    def add_many(self, fps):
+        """Add all the given fingerprints and return a list telling, for each
+        one, whether it was already in the store"""
+        return [self.add(fp) for fp in fps]
+
+    def get(self, fp, default=None):
+        """Return the value stored for ``fp``, or ``default``"""
+        offset, found = self._slot(self._mm, self.capacity, fp)
+        if not found:
+            return default
+        offset += self.digest_size
+        return self._mm[offset:offset + self.value_size]
+
+    def set(self, fp, value):
+        """Add ``fp`` to the store if needed and set its value"""
+        if len(value) != self.value_size:
+            raise ValueError("Expected a %d-byte value, got %d bytes"
+                             % (self.value_size, len(value)))
+        offset = self._insert(fp)[0] + self.digest_size
+        self._mm[offset:offset + self.value_size] = value
+
+    def items(self, start=0, stop=None):
+        """Iterate over ``(fingerprint, value)`` pairs stored in the slots
+        from ``start`` to ``stop``. Slots are only renumbered when the store
+        grows, which changes its ``capacity``."""
+        size, slot_size = self.digest_size, self.slot_size
+        stop = self.capacity if stop is None else min(stop, self.capacity)
+        for i in range(start, stop):
+            offset = _HEADER_SIZE + i * slot_size
+            fp = self._mm[offset:offset + size]
+            if fp != self._empty:
+                yield fp, self._mm[offset + size:offset + slot_size]
+
+    def __iter__(self):
+        for fp, _ in self.items():
+            yield fp
+
+    def _grow(self):
+        capacity = self.capacity * 2
+        tmppath = self.path + '.tmp' if self.path else None
+        f, mm = self._create(tmppath, capacity)
+        for fp, value in self.items():
+            offset = self._slot(mm, capacity, fp)[0]
+            mm[offset:offset + self.slot_size] = fp + value
+        _HEADER.pack_into(mm, 0, _MAGIC, capacity, self.count, self.value_size)
+        self.close()
+        if self.path:
+            mm.close()
+            f.close()
+            _replace(tmppath, self.path)
+            f = open(self.path, 'r+b')
+            mm = mmap.mmap(f.fileno(), 0)
+        self._file, self._mm, self.capacity = f, mm, capacity
+
+    def flush(self):
+        if self._file:
+            self._mm.flush()
+
+    def close(self):
+        self.flush()
+        self._mm.close()
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+_BLOOM_HEADER = struct.Struct('<8sQQQQ')
+_BLOOM_HEADER_SIZE = 48
+_BLOOM_MAGIC = b'SFPBLOM1'
+_BLOOM_HASHES = struct.Struct('<QQ')
+
+
+class BloomFilter(object):
+    """Bloom filter over binary fingerprints of at least 16 bytes.
+
+    The filter is sized for ``expected_items`` entries with a false positive
+    rate of ``fp_rate``. Bit positions are derived from the fingerprint
+    itself through double hashing, so fingerprints must be uniformly
+    distributed. When reopening an existing file its stored sizing is used.
+    """
+
+    def __init__(self, path=None, expected_items=1000000, fp_rate=0.001):
+        self.path = path
+        self._file = None
+        if path and os.path.exists(path) and os.path.getsize(path):
+            self._file = open(path, 'r+b')
+            self._mm = mmap.mmap(self._file.fileno(), 0)
+            magic, self.num_bits, self.num_hashes, self.count, self.bits_set = \
+                _BLOOM_HEADER.unpack_from(self._mm, 0)
+            if magic != _BLOOM_MAGIC:
+                self.close()
+                raise ValueError("Not a bloom filter: %s" % path)
+            return
+        if expected_items <= 0 or not 0 < fp_rate < 1:
+            raise ValueError("Invalid bloom filter sizing: %r items, %r "
+                             "false positive rate" % (expected_items, fp_rate))
+        num_bits = -expected_items * math.log(fp_rate) / (math.log(2) ** 2)
+        self.num_bits = int(math.ceil(num_bits / 8.0)) * 8
+        self.num_hashes = max(1, int(round(
+            self.num_bits / float(expected_items) * math.log(2))))
+        self.count = self.bits_set = 0
+        size = _BLOOM_HEADER_SIZE + self.num_bits // 8
+        if path:
+            self._file = open(path, 'w+b')
+            self._file.truncate(size)
+            self._mm = mmap.mmap(self._file.fileno(), size)
+        else:
+            self._mm = mmap.mmap(-1, size)
+        self._write_header()
+
+    def _write_header(self):
+        _BLOOM_HEADER.pack_into(self._mm, 0, _BLOOM_MAGIC, self.num_bits,
+                                self.num_hashes, self.count, self.bits_set)
+
+    def _positions(self, fp):
+        h1, h2 = _BLOOM_HASHES.unpack_from(fp)
+        h2 |= 1
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def __contains__(self, fp):
+        mm = self._mm
+        for pos in self._positions(fp):
+            offset = _BLOOM_HEADER_SIZE + (pos >> 3)
+            if not ord(mm[offset:offset + 1]) & (1 << (pos & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+    def add(self, fp):
+        """Add ``fp`` to the filter. Return ``True`` if it (probably) was
+        already there"""
+        mm = self._mm
+        seen = True
+        for pos in self._positions(fp):
+            offset = _BLOOM_HEADER_SIZE + (pos >> 3)
+            byte = ord(mm[offset:offset + 1])
+            bit = 1 << (pos & 7)
+            if not byte & bit:
+                mm[offset:offset + 1] = struct.pack('B', byte | bit)
+                self.bits_set += 1
+                seen = False
+        if not seen:
+            self.count += 1
+            self._write_header()
+        return seen
+
+    def add_many(self, fps):
+        return [self.add(fp) for fp in fps]
+
+    @property
+    def fill_ratio(self):
+        return self.bits_set / float(self.num_bits)
+
+    @property
+    def fp_rate(self):
+        """Estimated false positive rate given the current fill ratio"""
+        return self.fill_ratio ** self.num_hashes
+
+    def flush(self):
+        if self._file:
+            self._mm.flush()
+
+    def close(self):
+        self.flush()
+        self._mm.close()
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+def _round_capacity(capacity):
+    n = 1
+    while n < capacity:
+        n <<= 1
+    return n
+
+
+def _replace(src, dst):
+    # os.replace() is not available on Python 2
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
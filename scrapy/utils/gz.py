@@ -1,54 +1,41 @@
-import struct
-
-try:
-    from cStringIO import StringIO as BytesIO
-except ImportError:
-    from io import BytesIO
-from gzip import GzipFile
-
-import six
+import zlib
 import re
 
-# - Python>=3.5 GzipFile's read() has issues returning leftover
-#   uncompressed data when input is corrupted
-#   (regression or bug-fix compared to Python 3.4)
-# - read1(), which fetches data before raising EOFError on next call
-#   works here but is only available from Python>=3.3
-# - scrapy does not support Python 3.2
-# - Python 2.7 GzipFile works fine with standard read() + extrabuf
-if six.PY2:
-    def read1(gzf, size=-1):
-        return gzf.read(size)
-else:
-    def read1(gzf, size=-1):
-        return gzf.read1(size)
+from scrapy.core.downloader.stream import Decoder, DecompressionMaxSizeExceeded
 
 
-def gunzip(data):
+def gunzip(data, max_size=0):
     """Gunzip the given data and return as much data as possible.
 
-    This is resilient to CRC checksum errors.
+    This is resilient to CRC checksum errors. If ``max_size`` is not 0,
+    :exc:`~scrapy.core.downloader.stream.DecompressionMaxSizeExceeded` is
+    raised as soon as the output grows beyond ``max_size`` bytes.
     """
-    f = GzipFile(fileobj=BytesIO(data))
-    output_list = []
-    chunk = b'.'
-    while chunk:
-        try:
-            chunk = read1(f, 8196)
-            output_list.append(chunk)
-        except (IOError, EOFError, struct.error):
-            # complete only if there is some data, otherwise re-raise
-            # see issue 87 about catching struct.error
-            # some pages are quite small so output_list is empty and f.extrabuf
-            # contains the whole page content
-            if output_list or getattr(f, 'extrabuf', None):
-                try:
-                    output_list.append(f.extrabuf[-f.extrasize:])
-                finally:
-                    break
-            else:
-                raise
-    return b''.join(output_list)
+    return b''.join(iter_gunzip(data, max_size))
+
+
+def iter_gunzip(data, max_size=0):
+    """Like :func:`gunzip`, but yield the output in chunks, decompressing
+    the data as they are consumed"""
+    decoder = Decoder(b'gzip', salvage=True)
+    size = 0
+    try:
+        for chunk in decoder.iter_decompress(data):
+            size += len(chunk)
+            if max_size and size > max_size:
+                raise DecompressionMaxSizeExceeded(
+                    "Decompressed size exceeds %d bytes" % max_size)
+            yield chunk
+    except zlib.error as e:
+        # complete only if there is some data (e.g. a corrupted or
+        # truncated end), otherwise this is not gzipped data
+        size += len(decoder.salvaged)
+        if max_size and size > max_size:
+            raise DecompressionMaxSizeExceeded(
+                "Decompressed size exceeds %d bytes" % max_size)
+        if not size:
+            raise IOError("Not a gzipped file (%s)" % e)
+        yield decoder.salvaged
 
 _is_gzipped = re.compile(br'^application/(x-)?gzip\b', re.I).search
 _is_octetstream = re.compile(br'^(application|binary)/octet-stream\b', re.I).search
@@ -42,32 +42,54 @@ def xmliter(obj, nodename):
 
 
 def xmliter_lxml(obj, nodename, namespace=None, prefix='x'):
+    """Like :func:`xmliter`, but using lxml's incremental parser. Besides
+    the types accepted by :func:`xmliter`, ``obj`` may be a binary file
+    object, which is then read in chunks."""
     from lxml import etree
     reader = _StreamReader(obj)
-    tag = '{%s}%s' % (namespace, nodename) if namespace else nodename
+    tag = _xmliter_tag(nodename, namespace)
     iterable = etree.iterparse(reader, tag=tag, encoding=reader.encoding)
-    selxpath = '//' + ('%s:%s' % (prefix, nodename) if namespace else nodename)
     for _, node in iterable:
-        nodetext = etree.tostring(node, encoding='unicode')
+        xs = _xmliter_node(node, nodename, namespace, prefix)
         node.clear()
-        xs = Selector(text=nodetext, type='xml')
-        if namespace:
-            xs.register_namespace(prefix, namespace)
-        yield xs.xpath(selxpath)[0]
+        yield xs
+
+
+def _xmliter_tag(nodename, namespace=None):
+    return '{%s}%s' % (namespace, nodename) if namespace else nodename
+
+
+def _xmliter_node(node, nodename, namespace=None, prefix='x'):
+    """Return a selector for the given lxml node"""
+    from lxml import etree
+    nodetext = etree.tostring(node, encoding='unicode')
+    selxpath = '//' + ('%s:%s' % (prefix, nodename) if namespace else nodename)
+    xs = Selector(text=nodetext, type='xml')
+    if namespace:
+        xs.register_namespace(prefix, namespace)
+    return xs.xpath(selxpath)[0]
 
 
 class _StreamReader(object):
 
     def __init__(self, obj):
         self._ptr = 0
+        self._file = None
         if isinstance(obj, Response):
             self._text, self.encoding = obj.body, obj.encoding
+        elif hasattr(obj, 'read'):
+            # binary file, e.g. a body streamed to disk: read it lazily and
+            # let lxml detect its encoding
+            self._file, self._text, self.encoding = obj, b'', None
         else:
             self._text, self.encoding = obj, 'utf-8'
         self._is_unicode = isinstance(self._text, six.text_type)
 
     def read(self, n=65535):
-        self.read = self._read_unicode if self._is_unicode else self._read_string
+        if self._file is not None:
+            self.read = self._file.read
+        else:
+            self.read = self._read_unicode if self._is_unicode else self._read_string
         return self.read(n).lstrip()
 
     def _read_string(self, n=65535):
@@ -1,9 +1,9 @@
 """
-Helper functions for serializing (and deserializing) requests.
+Helper functions for serializing (and deserializing) requests and responses.
 """
 import six
 
-from scrapy.http import Request
+from scrapy.http import Request, Headers
 from scrapy.utils.python import to_unicode, to_native_str
 from scrapy.utils.misc import load_object
 
@@ -67,6 +67,35 @@ def request_from_dict(d, spider=None):
         flags=d.get('flags'))
 
 
+def response_to_dict(response, spider=None):
+    """Convert Response object to a dict, its request (if any) being
+    converted with :func:`request_to_dict`.
+    """
+    request = getattr(response, 'request', None)
+    return {
+        '_class': response.__module__ + '.' + response.__class__.__name__,
+        'url': response.url,
+        'status': response.status,
+        'headers': dict(response.headers),
+        'body': response.body,
+        'flags': response.flags,
+        'encoding': getattr(response, 'encoding', None),
+        'request': request_to_dict(request, spider) if request is not None else None,
+    }
+
+
+def response_from_dict(d, spider=None):
+    """Create Response object from a dict."""
+    kwargs = {}
+    if d['encoding'] is not None:
+        kwargs['encoding'] = d['encoding']
+    if d['request'] is not None:
+        kwargs['request'] = request_from_dict(d['request'], spider)
+    return load_object(d['_class'])(
+        url=d['url'], status=d['status'], headers=Headers(d['headers']),
+        body=d['body'], flags=d['flags'], **kwargs)
+
+
 def _find_method(obj, func):
     if obj:
         try:
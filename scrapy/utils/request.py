@@ -6,16 +6,58 @@ scrapy.http.Request objects
 from __future__ import print_function
 import hashlib
 import weakref
+from binascii import hexlify
 from six.moves.urllib.parse import urlunparse
 
 from w3lib.http import basic_auth_header
 from scrapy.utils.python import to_bytes, to_native_str
+from scrapy.utils.datatypes import LRUCache
 
 from w3lib.url import canonicalize_url
 from scrapy.utils.httpobj import urlparse_cached
 
 
 _fingerprint_cache = weakref.WeakKeyDictionary()
+_canonical_url_cache = LRUCache(limit=10000)
+
+
+def _canonicalize_url(url):
+    ## 规范化 URL 的代价较高，而同一 URL 常常出现在多个页面中，因此缓存最近使用的结果
+    try:
+        return _canonical_url_cache[url]
+    except KeyError:
+        curl = _canonical_url_cache[url] = to_bytes(canonicalize_url(url))
+        return curl
+
+
+def fingerprint(request, include_headers=None):
+    """
+    Return the request fingerprint as a 20-byte binary SHA1 digest.
+
+    This is the binary counterpart of :func:`request_fingerprint`, see its
+    documentation for details. Both functions share the same per-request
+    cache, so computing one after the other does not hash the request twice.
+    """
+    if include_headers:
+        include_headers = tuple(to_bytes(h.lower())
+                                 for h in sorted(include_headers))
+    cache = _fingerprint_cache.setdefault(request, {})
+    if include_headers not in cache:
+        ## 使用 sha1 算法生成指纹
+        fp = hashlib.sha1()
+        fp.update(to_bytes(request.method))
+        fp.update(_canonicalize_url(request.url))
+        fp.update(request.body or b'')
+        if include_headers:
+            for hdr in include_headers:
+                if hdr in request.headers:
+                    fp.update(hdr)
+                    for v in request.headers.getlist(hdr):
+                        fp.update(v)
+        cache[include_headers] = fp.digest()
+    return cache[include_headers]
+
+
 def request_fingerprint(request, include_headers=None):
     """
     Return the request fingerprint.
@@ -43,27 +85,28 @@ def request_fingerprint(request, include_headers=None):
     include_headers argument, which is a list of Request headers to include.
 
     """
-    ## 返回请求指纹
+    ## 返回请求指纹（十六进制字符串形式）
+    return to_native_str(hexlify(fingerprint(request, include_headers)))
 
-    ## 请求生成是否包含 headers
-    if include_headers:
-        include_headers = tuple(to_bytes(h.lower())
-                                 for h in sorted(include_headers))
-    cache = _fingerprint_cache.setdefault(request, {})
-    if include_headers not in cache:
-        ## 使用 sha1 算法生成指纹
-        fp = hashlib.sha1()
-        fp.update(to_bytes(request.method))
-        fp.update(to_bytes(canonicalize_url(request.url)))
-        fp.update(request.body or b'')
-        if include_headers:
-            for hdr in include_headers:
-                if hdr in request.headers:
-                    fp.update(hdr)
-                    for v in request.headers.getlist(hdr):
-                        fp.update(v)
-        cache[include_headers] = fp.hexdigest()
-    return cache[include_headers]
+
+class RequestFingerprinter(object):
+    """Default request fingerprinter, see ``REQUEST_FINGERPRINTER_CLASS``.
+
+    Components that need request fingerprints should use the instance
+    available as ``crawler.request_fingerprinter`` so that all of them agree
+    on (and share) the same fingerprints. Custom fingerprinters must
+    implement a ``fingerprint(request)`` method returning bytes.
+    """
+
+    def __init__(self, settings=None):
+        pass
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings)
+
+    def fingerprint(self, request):
+        return fingerprint(request)
 
 
 def request_authenticate(request, username, password):
@@ -90,6 +133,28 @@ def request_httprepr(request):
     return s
 
 
+def request_httprepr_size(request):
+    """Return the length of :func:`request_httprepr` for the given request,
+    computed without building the representation."""
+    parsed = urlparse_cached(request)
+    path = urlunparse(('', '', parsed.path or '/', parsed.params, parsed.query, ''))
+    size = len(to_bytes(request.method)) + len(to_bytes(path)) + 12
+    size += len(to_bytes(parsed.hostname or b'')) + 8
+    if request.headers:
+        size += _headers_raw_size(request.headers) + 2
+    return size + 2 + len(request.body)
+
+
+def _headers_raw_size(headers):
+    """Length of ``headers.to_string()``"""
+    size = lines = 0
+    for key, values in headers.items():
+        for value in values:
+            size += len(key) + len(value) + 2
+            lines += 1
+    return size + 2 * (lines - 1) if lines else 0
+
+
 def referer_str(request):
     """ Return Referer HTTP header suitable for logging. """
     referrer = request.headers.get('Referer')
@@ -9,6 +9,7 @@ import tempfile
 
 from twisted.web import http
 from scrapy.utils.python import to_bytes, to_native_str
+from scrapy.utils.request import _headers_raw_size
 from w3lib import html
 
 from scrapy.utils.decorators import deprecated
@@ -61,6 +62,16 @@ def response_httprepr(response):
     return s
 
 
+def response_httprepr_size(response):
+    """Return the length of :func:`response_httprepr` for the given response,
+    computed without building the representation (nor copying the body)."""
+    size = len(to_bytes(str(response.status))) + 12
+    size += len(to_bytes(http.RESPONSES.get(response.status, b'')))
+    if response.headers:
+        size += _headers_raw_size(response.headers) + 2
+    return size + 2 + len(response.body)
+
+
 def open_in_browser(response, _openfunc=webbrowser.open):
     """Open the given response in a local web browser, populating the <base>
     tag for external links to work
@@ -5,35 +5,95 @@ Note: The main purpose of this module is to provide support for the
 SitemapSpider, its API is subject to change without notice.
 """
 
+from collections import deque
+
+import six
 import lxml.etree
 from six.moves.urllib.parse import urljoin
 
 
 class Sitemap(object):
     """Class to parse Sitemap (type=urlset) and Sitemap Index
-    (type=sitemapindex) files"""
+    (type=sitemapindex) files.
+
+    ``xmltext`` is the document, or an iterable of chunks of it. The document
+    is parsed incrementally as its entries are iterated (once), and parsed
+    entries are dropped, so memory use does not grow with its size.
+    """
+
+    chunk_size = 65536
 
     def __init__(self, xmltext):
-        xmlp = lxml.etree.XMLParser(recover=True, remove_comments=True, resolve_entities=False)
-        self._root = lxml.etree.fromstring(xmltext, parser=xmlp)
-        rt = self._root.tag
-        self.type = self._root.tag.split('}', 1)[1] if '}' in rt else rt
+        if isinstance(xmltext, (bytes, six.text_type)):
+            self._chunks = self._split(xmltext)
+        else:
+            self._chunks = iter(xmltext)
+        self._parser = parser = lxml.etree.XMLPullParser(
+            events=('start',), recover=True, remove_comments=True,
+            resolve_entities=False)
+        self._root = None
+        self.type = None
+        # parse up to the root element, which gives the sitemap type
+        more = True
+        while self._root is None and more:
+            more = self._parse_chunk()
+            for _, elem in parser.read_events():
+                self._root = elem
+                break
+        if self._root is not None:
+            rt = self._root.tag
+            self.type = rt.split('}', 1)[1] if '}' in rt else rt
+
+    def _split(self, text):
+        for i in range(0, len(text), self.chunk_size):
+            yield text[i:i + self.chunk_size]
+
+    def _parse_chunk(self):
+        """Feed the next chunk of the document to the parser, return whether
+        there is more to parse"""
+        if self._parser is None:
+            return False
+        # only the root start event is used, drop the other ones
+        deque(self._parser.read_events(), maxlen=0)
+        for chunk in self._chunks:
+            self._parser.feed(chunk)
+            return True
+        try:
+            self._parser.close()
+        except lxml.etree.XMLSyntaxError:
+            pass
+        self._parser = None
+        return False
 
     def __iter__(self):
-        for elem in self._root.getchildren():
-            d = {}
-            for el in elem.getchildren():
-                tag = el.tag
-                name = tag.split('}', 1)[1] if '}' in tag else tag
-
-                if name == 'link':
-                    if 'href' in el.attrib:
-                        d.setdefault('alternate', []).append(el.get('href'))
-                else:
-                    d[name] = el.text.strip() if el.text else ''
-
-            if 'loc' in d:
-                yield d
+        root = self._root
+        if root is None:
+            return
+        more = self._parser is not None
+        while True:
+            # the last entry (<url> or <sitemap>) may not be complete yet
+            complete = len(root) - 1 if more else len(root)
+            for elem in root[:complete]:
+                d = self._entry(elem)
+                if 'loc' in d:
+                    yield d
+            del root[:complete]
+            if not more:
+                break
+            more = self._parse_chunk()
+
+    def _entry(self, elem):
+        d = {}
+        for el in elem.getchildren():
+            tag = el.tag
+            name = tag.split('}', 1)[1] if '}' in tag else tag
+
+            if name == 'link':
+                if 'href' in el.attrib:
+                    d.setdefault('alternate', []).append(el.get('href'))
+            else:
+                d[name] = el.text.strip() if el.text else ''
+        return d
 
 
 def sitemap_urls_from_robots(robots_text, base_url=None):
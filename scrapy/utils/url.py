@@ -16,13 +16,84 @@ from w3lib.url import _safe_chars, _unquotepath
 from scrapy.utils.python import to_unicode
 
 
+class DomainMatcher(object):
+    """Set of domains telling whether host names belong to any of them,
+    that is, are one of them or a subdomain of one. Domains (and host names)
+    are case insensitive.
+
+    Domains are kept in a trie of their labels, from the rightmost one, so
+    checking a host name takes a time proportional to its number of labels,
+    whatever the number of domains. Iterating a matcher gives its domains.
+    """
+
+    def __init__(self, domains=()):
+        self._root = {}
+        self._domains = set()
+        for domain in domains:
+            self.add(domain)
+
+    @classmethod
+    def from_file(cls, path):
+        """Build a matcher with the domains listed in the file at ``path``,
+        see :meth:`load`"""
+        matcher = cls()
+        matcher.load(path)
+        return matcher
+
+    def load(self, path):
+        """Add the domains listed in the file at ``path``: one domain per
+        line, blank lines and lines starting with ``#`` being ignored"""
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    self.add(line)
+
+    def add(self, domain):
+        domain = domain.lower()
+        if domain in self._domains:
+            return
+        self._domains.add(domain)
+        node = self._root
+        for label in reversed(domain.split('.')):
+            node = node.setdefault(label, {})
+        # labels are strings, None marks the end of a domain
+        node[None] = True
+
+    def match(self, host):
+        """Return True if ``host`` is one of the domains or a subdomain of
+        one"""
+        node = self._root
+        for label in reversed(host.lower().split('.')):
+            node = node.get(label)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+    # what OffsiteMiddleware calls on the regex of its allowed domains
+    search = match
+
+    def __contains__(self, host):
+        return self.match(host)
+
+    def __iter__(self):
+        return iter(self._domains)
+
+    def __len__(self):
+        return len(self._domains)
+
+
 def url_is_from_any_domain(url, domains):
-    """Return True if the url belongs to any of the given domains"""
+    """Return True if the url belongs to any of the given domains (an
+    iterable of domains, or a :class:`DomainMatcher`)"""
     host = parse_url(url).netloc.lower()
     if not host:
         return False
-    domains = [d.lower() for d in domains]
-    return any((host == d) or (host.endswith('.%s' % d)) for d in domains)
+    if not isinstance(domains, DomainMatcher):
+        domains = DomainMatcher(domains)
+    return domains.match(host)
 
 
 def url_is_from_spider(url, spider):